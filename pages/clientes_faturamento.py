@@ -3,7 +3,10 @@
 import streamlit as st
 import numpy as np
 import pandas as pd
-from utils.format import brl, PALETTE
+from utils.format import brl, to_reais, PALETTE
+from utils.cube import cube_of
+from utils.yoy import yearly_pivot, compare_years, column_periods, distinct_clients
+from utils.filters import rolling_window_controls, year_pair_controls
 from utils.loaders import load_main_base
 from utils.export import create_zip_package 
 
@@ -85,31 +88,45 @@ def render(df, mes_ini, mes_fim, show_labels, ultima_atualizacao=None):
     st.markdown("<h2 style='text-align: center; color: #003366;'>Clientes & Faturamento</h2>", unsafe_allow_html=True)
     st.markdown("<div style='margin-bottom: 20px;'></div>", unsafe_allow_html=True)
 
-    # Normalização
-    df = df.rename(columns={c: c.lower() for c in df.columns})
+    # A base chega no esquema canônico (colunas em minúsculas); nada é copiado aqui
     if "faturamento" not in df.columns:
         st.error("Coluna 'Faturamento' ausente na base.")
         return
-    if "insercoes" not in df.columns:
-        df["insercoes"] = 0.0
+    # Métricas somadas no cubo mensal da base (utils/cube.py), não nas transações;
+    # faturamento em centavos inteiros (somas exatas), reais só na formatação
+    cubo, em_centavos = cube_of(df).with_centavos()
 
     # Anos
-    anos = sorted(df["ano"].dropna().unique())
+    anos = sorted(cubo.celulas["ano"].dropna().unique())
     if not anos: st.info("Sem anos válidos."); return
-    if len(anos) >= 2: ano_base, ano_comp = anos[-2], anos[-1]
-    else: ano_base = ano_comp = anos[-1]
 
-    base_periodo = df[df["mes"].between(mes_ini, mes_fim)]
+    # Períodos comparados nas colunas: o par de anos escolhido, nos meses do filtro (padrão), ou,
+    # no modo de janela móvel, a janela atual e a mesma janela um ano antes (no lugar dos anos)
+    prefixos = cubo.prefix_sums()
+    janelas = rolling_window_controls(prefixos, "clientes_faturamento")
+    if janelas is None:
+        ano_base, ano_comp = year_pair_controls(anos, "clientes_faturamento")
+        base_periodo = cubo.slice(mes_ini, mes_fim)
+    else:
+        base_periodo = cubo.windows(janelas)
+        ano_base, ano_comp = janelas
+        st.caption("As colunas de cada ano passam a ser as janelas móveis comparadas.")
+
+    def pivo(group_col):
+        """Pivô de todos os anos (ou das janelas) da dimensão, calculado uma vez por recorte (utils/yoy.py)."""
+        return yearly_pivot(cubo, group_col, mes_ini, mes_fim, janelas)
+
+    def totais_emissora():
+        """Faturamento e inserções por emissora no período todo; nas janelas, a soma das colunas do pivô."""
+        if janelas is None:
+            return base_periodo.group("emissora")
+        return pd.DataFrame({medida: pivo("emissora")[medida].sum(axis=1) for medida in ["faturamento", "insercoes"]})
 
     # Helper de métricas
     def enrich_with_metrics_split(df_main, group_col):
-        piv_ins = base_periodo.groupby([group_col, "ano"])["insercoes"].sum().unstack(fill_value=0)
-        piv_fat = base_periodo.groupby([group_col, "ano"])["faturamento"].sum().unstack(fill_value=0)
-        
-        for ano in [ano_base, ano_comp]:
-            if ano not in piv_ins.columns: piv_ins[ano] = 0.0
-            if ano not in piv_fat.columns: piv_fat[ano] = 0.0
-            
+        piv_ins = compare_years(pivo(group_col), ano_base, ano_comp, "insercoes")
+        piv_fat = compare_years(pivo(group_col), ano_base, ano_comp, "faturamento")
+
         custo_base = np.where(piv_ins[ano_base] > 0, piv_fat[ano_base] / piv_ins[ano_base], np.nan)
         custo_comp = np.where(piv_ins[ano_comp] > 0, piv_fat[ano_comp] / piv_ins[ano_comp], np.nan)
         
@@ -133,12 +150,7 @@ def render(df, mes_ini, mes_fim, show_labels, ultima_atualizacao=None):
 
     # ==================== 1. CLIENTES POR EMISSORA ====================
     st.subheader("1. Número de Clientes por Emissora (Comparativo)")
-    base_clientes_raw = base_periodo.groupby(["emissora", "ano"])["cliente"].nunique().unstack(fill_value=0).reset_index()
-    for ano in [ano_base, ano_comp]:
-        if ano not in base_clientes_raw.columns: base_clientes_raw[ano] = 0
-
-    base_clientes_raw["Δ"] = base_clientes_raw[ano_comp] - base_clientes_raw[ano_base]
-    base_clientes_raw["Δ%"] = np.where(base_clientes_raw[ano_base] > 0, (base_clientes_raw["Δ"] / base_clientes_raw[ano_base]) * 100, np.nan)
+    base_clientes_raw = compare_years(pivo("emissora"), ano_base, ano_comp, "clientes").reset_index()
     
     # Separa Total
     df_1_main = base_clientes_raw.copy()
@@ -188,13 +200,7 @@ def render(df, mes_ini, mes_fim, show_labels, ultima_atualizacao=None):
 
     # ==================== 2. FATURAMENTO POR EMISSORA ====================
     st.subheader("2. Faturamento por Emissora (com Eficiência)")
-    base_emissora_raw = base_periodo.groupby(["emissora", "ano"])["faturamento"].sum().unstack(fill_value=0).reset_index()
-    for ano in [ano_base, ano_comp]:
-        if ano not in base_emissora_raw.columns: base_emissora_raw[ano] = 0.0
-
-    base_emissora_raw["Δ"] = base_emissora_raw[ano_comp] - base_emissora_raw[ano_base]
-    base_emissora_raw["Δ%"] = np.where(base_emissora_raw[ano_base] > 0, (base_emissora_raw["Δ"] / base_emissora_raw[ano_base]) * 100, np.nan)
-    
+    base_emissora_raw = compare_years(pivo("emissora"), ano_base, ano_comp).reset_index()
     base_emissora_raw = enrich_with_metrics_split(base_emissora_raw, "emissora")
 
     df_2_main = base_emissora_raw.copy()
@@ -238,8 +244,11 @@ def render(df, mes_ini, mes_fim, show_labels, ultima_atualizacao=None):
             d["Δ%"] = d["Δ%"].apply(format_percent_col)
             d[f"Ins. {ano_base}"] = d[f"Ins. {ano_base}"].apply(format_int)
             d[f"Ins. {ano_comp}"] = d[f"Ins. {ano_comp}"].apply(format_int)
-            d[f"Custo Médio Unitário ({ano_base})"] = d[f"Custo Médio Unitário ({ano_base})"].apply(brl)
-            d[f"Custo Médio Unitário ({ano_comp})"] = d[f"Custo Médio Unitário ({ano_comp})"].apply(brl)
+            d[f"Custo Médio Unitário ({ano_base})"] = d[f"Custo Médio Unitário ({ano_base})"].apply(brl, centavos=em_centavos)
+            d[f"Custo Médio Unitário ({ano_comp})"] = d[f"Custo Médio Unitário ({ano_comp})"].apply(brl, centavos=em_centavos)
+            # Colunas formatadas pelo styler seguem numéricas (e em reais) para a exportação
+            for col in dict.fromkeys([str(ano_base), str(ano_comp), "Δ"]):
+                d[col] = to_reais(d[col], em_centavos)
             d['#'] = d['#'].astype(str)
 
     export_2 = display_combined_table(
@@ -251,12 +260,7 @@ def render(df, mes_ini, mes_fim, show_labels, ultima_atualizacao=None):
 
     # ==================== 3. FATURAMENTO POR EXECUTIVO ====================
     st.subheader("3. Faturamento por Executivo (com Eficiência)")
-    tx_raw = base_periodo.groupby(["executivo", "ano"])["faturamento"].sum().unstack(fill_value=0).reset_index()
-    for ano in [ano_base, ano_comp]:
-        if ano not in tx_raw.columns: tx_raw[ano] = 0.0
-    
-    tx_raw["Δ"] = tx_raw[ano_comp] - tx_raw[ano_base]
-    tx_raw["Δ%"] = np.where(tx_raw[ano_base] > 0, (tx_raw["Δ"] / tx_raw[ano_base]) * 100, np.nan)
+    tx_raw = compare_years(pivo("executivo"), ano_base, ano_comp).reset_index()
     tx_raw = enrich_with_metrics_split(tx_raw, "executivo")
 
     df_3_main = tx_raw.copy()
@@ -298,8 +302,11 @@ def render(df, mes_ini, mes_fim, show_labels, ultima_atualizacao=None):
             d["Δ%"] = d["Δ%"].apply(format_percent_col)
             d[f"Ins. {ano_base}"] = d[f"Ins. {ano_base}"].apply(format_int)
             d[f"Ins. {ano_comp}"] = d[f"Ins. {ano_comp}"].apply(format_int)
-            d[f"Custo Médio Unitário ({ano_base})"] = d[f"Custo Médio Unitário ({ano_base})"].apply(brl)
-            d[f"Custo Médio Unitário ({ano_comp})"] = d[f"Custo Médio Unitário ({ano_comp})"].apply(brl)
+            d[f"Custo Médio Unitário ({ano_base})"] = d[f"Custo Médio Unitário ({ano_base})"].apply(brl, centavos=em_centavos)
+            d[f"Custo Médio Unitário ({ano_comp})"] = d[f"Custo Médio Unitário ({ano_comp})"].apply(brl, centavos=em_centavos)
+            # Colunas formatadas pelo styler seguem numéricas (e em reais) para a exportação
+            for col in dict.fromkeys([str(ano_base), str(ano_comp), "Δ"]):
+                d[col] = to_reais(d[col], em_centavos)
             d['#'] = d['#'].astype(str)
 
     export_3 = display_combined_table(
@@ -311,8 +318,13 @@ def render(df, mes_ini, mes_fim, show_labels, ultima_atualizacao=None):
 
     # ==================== 4. MÉDIAS ====================
     st.subheader("4. Médias por Cliente (Investimento e Inserções)")
-    t16_raw = base_periodo.groupby("emissora").agg(
-        Faturamento=("faturamento", "sum"), Insercoes=("insercoes", "sum"), Clientes=("cliente", "nunique")
+    # Clientes distintos no período todo (todos os anos ou as duas janelas): OR dos bitsets de clientes
+    periodos_4 = [p for intervalos in column_periods(anos, mes_ini, mes_fim, janelas).values() for p in intervalos]
+    t16_raw = totais_emissora()
+    t16_raw["clientes"] = distinct_clients(cubo, "emissora", {"clientes": periodos_4})["clientes"] \
+        .reindex(t16_raw.index, fill_value=0)
+    t16_raw = t16_raw.rename(
+        columns={"faturamento": "Faturamento", "insercoes": "Insercoes", "clientes": "Clientes"}
     ).reset_index()
     t16_raw["Média Invest./Cliente"] = np.where(t16_raw["Clientes"] == 0, np.nan, t16_raw["Faturamento"] / t16_raw["Clientes"])
     t16_raw["Média Inserções/Cliente"] = np.where(t16_raw["Clientes"] == 0, np.nan, t16_raw["Insercoes"] / t16_raw["Clientes"])
@@ -323,7 +335,8 @@ def render(df, mes_ini, mes_fim, show_labels, ultima_atualizacao=None):
     if not df_4_main.empty:
         tfat = df_4_main["Faturamento"].sum()
         tins = df_4_main["Insercoes"].sum()
-        tcli = base_periodo["cliente"].nunique()
+        conjuntos = cubo.client_sets()
+        tcli = conjuntos.count(conjuntos.union(periodos_4))
         mfat = tfat/tcli if tcli > 0 else np.nan
         mins = tins/tcli if tcli > 0 else np.nan
         
@@ -341,9 +354,9 @@ def render(df, mes_ini, mes_fim, show_labels, ultima_atualizacao=None):
 
     for d in [df_4_main, df_4_total]:
         if not d.empty:
-            d["Faturamento"] = d["Faturamento"].apply(brl)
+            d["Faturamento"] = d["Faturamento"].apply(brl, centavos=em_centavos)
             d["Total Inserções"] = d["Total Inserções"].apply(format_int)
-            d["Média Invest./Cliente"] = d["Média Invest./Cliente"].apply(brl)
+            d["Média Invest./Cliente"] = d["Média Invest./Cliente"].apply(brl, centavos=em_centavos)
             d["Média Inserções/Cliente"] = d["Média Inserções/Cliente"].apply(lambda x: f"{x:,.1f}" if pd.notna(x) else "-")
             d['#'] = d['#'].astype(str)
 
@@ -352,9 +365,9 @@ def render(df, mes_ini, mes_fim, show_labels, ultima_atualizacao=None):
 
     # ==================== 5. FATURAMENTO TOTAL ====================
     st.subheader("5. Faturamento por Emissora (Total)")
-    t15_simple = base_periodo.groupby("emissora", as_index=False).agg(
-        Faturamento=("faturamento", "sum"), Insercoes=("insercoes", "sum")
-    ).sort_values("Faturamento", ascending=False)
+    t15_simple = totais_emissora().rename(
+        columns={"faturamento": "Faturamento", "insercoes": "Insercoes"}
+    ).reset_index().sort_values("Faturamento", ascending=False)
     t15_simple["Custo Unitário"] = np.where(t15_simple["Insercoes"] > 0, t15_simple["Faturamento"] / t15_simple["Insercoes"], np.nan)
 
     df_5_main = t15_simple.copy()
@@ -375,9 +388,9 @@ def render(df, mes_ini, mes_fim, show_labels, ultima_atualizacao=None):
 
     for d in [df_5_main, df_5_total]:
         if not d.empty:
-            d["Faturamento"] = d["Faturamento"].apply(brl)
+            d["Faturamento"] = d["Faturamento"].apply(brl, centavos=em_centavos)
             d["Inserções"] = d["Inserções"].apply(format_int)
-            d["Custo Médio Unitário"] = d["Custo Médio Unitário"].apply(brl)
+            d["Custo Médio Unitário"] = d["Custo Médio Unitário"].apply(brl, centavos=em_centavos)
             d['#'] = d['#'].astype(str)
 
     export_5 = display_combined_table(df_5_main, df_5_total)
@@ -386,11 +399,13 @@ def render(df, mes_ini, mes_fim, show_labels, ultima_atualizacao=None):
     # ==================== 6. COMPARATIVO MÊS A MÊS ====================
     st.subheader("6. Comparativo mês a mês")
     mes_map = {1: "Jan", 2: "Fev", 3: "Mar", 4: "Abr", 5: "Mai", 6: "Jun", 7: "Jul", 8: "Ago", 9: "Set", 10: "Out", 11: "Nov", 12: "Dez"}
-    base_para_tabela = base_periodo.copy()
-    base_para_tabela["mes_nome"] = base_para_tabela["mes"].map(mes_map)
-    
-    piv_fat = base_para_tabela.groupby(["ano", "mes", "mes_nome"])["faturamento"].sum().reset_index().pivot(index=["mes", "mes_nome"], columns="ano", values="faturamento").fillna(0.0)
-    piv_ins = base_para_tabela.groupby(["ano", "mes", "mes_nome"])["insercoes"].sum().reset_index().pivot(index=["mes", "mes_nome"], columns="ano", values="insercoes").fillna(0.0)
+    def por_mes(medida):
+        tabela = base_periodo.group(["ano", "mes"], [medida]).reset_index()
+        tabela["mes_nome"] = tabela["mes"].map(mes_map)
+        return tabela.pivot(index=["mes", "mes_nome"], columns="ano", values=medida).fillna(0.0)
+
+    piv_fat = por_mes("faturamento")
+    piv_ins = por_mes("insercoes")
     
     if not piv_fat.empty:
         for ano in [ano_base, ano_comp]:
@@ -441,12 +456,12 @@ def render(df, mes_ini, mes_fim, show_labels, ultima_atualizacao=None):
         for d in [df_6_main, df_6_total]:
             d.columns = d.columns.map(str)
             for col in d.columns:
-                if "Fat." in col: d[col] = d[col].apply(brl)
+                if "Fat." in col: d[col] = d[col].apply(brl, centavos=em_centavos)
                 if "Ins." in col: d[col] = d[col].apply(format_int)
                 if "Custo" in col:
                     new_name = col.replace("Custo", "Custo Médio Unitário")
                     d.rename(columns={col: new_name}, inplace=True)
-                    d[new_name] = d[new_name].apply(brl)
+                    d[new_name] = d[new_name].apply(brl, centavos=em_centavos)
 
         export_6 = display_combined_table(df_6_main, df_6_total)
     else:
@@ -458,8 +473,8 @@ def render(df, mes_ini, mes_fim, show_labels, ultima_atualizacao=None):
     # ==================== 7. RELAÇÃO DE CLIENTES ====================
     st.subheader(f"7. Relação de Clientes ({ano_base} vs {ano_comp})")
     
-    t17_fat = base_periodo.groupby(["cliente", "ano"])["faturamento"].sum().unstack(fill_value=0)
-    t17_ins = base_periodo.groupby(["cliente", "ano"])["insercoes"].sum().unstack(fill_value=0)
+    t17_fat = pivo("cliente")["faturamento"].copy()
+    t17_ins = pivo("cliente")["insercoes"].copy()
     
     for ano in [ano_base, ano_comp]:
         if ano not in t17_fat.columns: t17_fat[ano] = 0.0
@@ -514,7 +529,7 @@ def render(df, mes_ini, mes_fim, show_labels, ultima_atualizacao=None):
         if not d.empty:
             d.rename(columns=rename_7, inplace=True)
             for col in d.columns:
-                if "Faturamento" in col or "Custo" in col: d[col] = d[col].apply(brl)
+                if "Faturamento" in col or "Custo" in col: d[col] = d[col].apply(brl, centavos=em_centavos)
                 if "Inserções" in col: d[col] = d[col].apply(format_int)
     
     # Ordenação colunas
@@ -4,6 +4,7 @@ import streamlit as st
 import pandas as pd
 import numpy as np
 from utils.format import brl, PALETTE
+from utils.cube import cube_of
 import plotly.graph_objects as go
 import plotly.express as px
 from itertools import combinations
@@ -53,30 +54,23 @@ def render(df, mes_ini, mes_fim, show_labels, ultima_atualizacao=None):
     pivot_cost_display = pd.DataFrame() 
     fig_mat = go.Figure() 
 
-    df = df.rename(columns={c: c.lower() for c in df.columns})
-
     if "cliente" not in df.columns or "emissora" not in df.columns or "faturamento" not in df.columns:
         st.error("Colunas obrigatórias 'Cliente', 'Emissora' e 'Faturamento' ausentes.")
         return
-    
-    if "insercoes" not in df.columns:
-        df["insercoes"] = 0.0
 
-    base_periodo = df[df["mes"].between(mes_ini, mes_fim)]
+    # Recorte do período no cubo mensal da base (utils/cube.py): somas por cliente/emissora já prontas
+    base_periodo = cube_of(df).slice(mes_ini, mes_fim)
 
     if base_periodo.empty:
         st.info("Sem dados para o período selecionado.")
         return
 
     # Agrupamento Base
-    agg = base_periodo.groupby(["cliente", "emissora"], as_index=False).agg(
-        faturamento=("faturamento", "sum"),
-        insercoes=("insercoes", "sum")
-    )
+    agg = base_periodo.group(["cliente", "emissora"]).reset_index()
     agg["presenca"] = np.where(agg["faturamento"] > 0, 1, 0)
 
     # Pivôs para cálculos
-    pres_pivot = agg.pivot_table(index="cliente", columns="emissora", values="presenca", fill_value=0)
+    pres_pivot = agg.pivot_table(index="cliente", columns="emissora", values="presenca", fill_value=0, observed=True)
     # Garante que todas as emissoras do dataframe filtrado apareçam nas colunas
     emissoras = sorted(agg["emissora"].unique())
     
@@ -248,9 +242,9 @@ def render(df, mes_ini, mes_fim, show_labels, ultima_atualizacao=None):
 
         df_emis_list = pres_pivot.loc[share_clients_idx].apply(get_emissoras_str, axis=1)
         
-        top_shared_raw = (base_periodo[base_periodo["cliente"].isin(share_clients_idx)]
-                          .groupby("cliente", as_index=False)
-                          .agg(faturamento=("faturamento", "sum"), insercoes=("insercoes", "sum"))
+        top_shared_raw = (base_periodo.slice(cliente=list(share_clients_idx))
+                          .group("cliente")
+                          .reset_index()
                           .sort_values("faturamento", ascending=False)
                           .head(20))
         
@@ -339,7 +333,7 @@ def render(df, mes_ini, mes_fim, show_labels, ultima_atualizacao=None):
             text_colors_2d = [['white' if v > max_val * 0.4 else 'black' for v in row] for row in z]
             
         elif metric == "Faturamento": 
-            val_pivot = agg.pivot_table(index="cliente", columns="emissora", values="faturamento", fill_value=0.0) 
+            val_pivot = agg.pivot_table(index="cliente", columns="emissora", values="faturamento", fill_value=0.0, observed=True) 
             for a, b in combinations(emis_list, 2):
                 menor = np.minimum(val_pivot[a], val_pivot[b])
                 vlr = menor[menor > 0].sum()
@@ -353,7 +347,7 @@ def render(df, mes_ini, mes_fim, show_labels, ultima_atualizacao=None):
             text_colors_2d = [['white' if v > max_val * 0.4 else 'black' for v in row] for row in z]
             
         else: 
-            ins_pivot = agg.pivot_table(index="cliente", columns="emissora", values="insercoes", fill_value=0.0)
+            ins_pivot = agg.pivot_table(index="cliente", columns="emissora", values="insercoes", fill_value=0.0, observed=True)
             for a, b in combinations(emis_list, 2):
                 menor = np.minimum(ins_pivot[a], ins_pivot[b])
                 vlr = menor[menor > 0].sum()
@@ -395,14 +389,14 @@ def render(df, mes_ini, mes_fim, show_labels, ultima_atualizacao=None):
         pivot_cost = df_cost.pivot_table(
             index="cliente", 
             columns="emissora", 
-            values="custo_unit"
+            values="custo_unit", observed=True
         )
         
         pivot_cost = pivot_cost.reindex(columns=emissoras)
         
         # Ordenação
-        client_ranking = base_periodo.groupby("cliente")["faturamento"].sum()
-        pivot_cost["_sort_val"] = pivot_cost.index.map(client_ranking)
+        client_ranking = base_periodo.group("cliente", ["faturamento"])["faturamento"]
+        pivot_cost["_sort_val"] = client_ranking.reindex(pivot_cost.index).to_numpy()
         pivot_cost = pivot_cost.sort_values("_sort_val", ascending=False).drop(columns="_sort_val")
         
         # --- CÁLCULO DA LINHA TOTALIZADORA (MÉDIA) ---
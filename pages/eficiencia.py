@@ -4,7 +4,11 @@ import streamlit as st
 import plotly.express as px
 import pandas as pd
 import numpy as np
-from utils.format import brl, PALETTE
+from utils.format import brl, to_reais, use_centavos, PALETTE
+from utils.period import period_slice
+from utils.cube import cube_of
+from utils.yoy import yearly_pivot, compare_years
+from utils.filters import year_pair_controls
 from utils.export import create_zip_package 
 
 def format_int(val):
@@ -34,29 +38,22 @@ def render(df, mes_ini, mes_fim, show_labels, ultima_atualizacao=None):
     st.markdown("<h2 style='text-align: center; color: #003366;'>Eficiência & KPIs Avançados</h2>", unsafe_allow_html=True)
     st.markdown("<div style='margin-bottom: 20px;'></div>", unsafe_allow_html=True)
 
-    # Normalização e Filtros
-    df = df.rename(columns={c: c.lower() for c in df.columns})
-    
+    # Colunas obrigatórias (a base já chega no esquema canônico)
     if "faturamento" not in df.columns or "cliente" not in df.columns:
         st.error("Colunas obrigatórias ausentes.")
         return
-    
-    if "insercoes" not in df.columns:
-        df["insercoes"] = 0.0
-
-    # Definição dos Anos para lógica de colunas
-    anos_global = sorted(df["ano"].dropna().unique())
-    if len(anos_global) >= 2:
-        ano_base, ano_comp = anos_global[-2], anos_global[-1]
-    elif len(anos_global) == 1:
-        ano_base = ano_comp = anos_global[0]
-    else:
-        ano_base = ano_comp = 2024 # Fallback
 
-    # Filtra período
-    base_periodo = df[df["mes"].between(mes_ini, mes_fim)]
+    # Cubo mensal da base (utils/cube.py): somas por emissora/ano sem reagrupar as transações
+    cubo = cube_of(df)
+
+    # Anos da base (o par comparado no resumo por emissora é escolhido na seção 2)
+    anos_global = sorted(cubo.celulas["ano"].dropna().unique())
+
+    # Filtra período. Faturamento somado em centavos inteiros e convertido para reais só depois
+    # da soma, a mesma conta do cubo (e das demais páginas): totais iguais centavo a centavo
+    base_periodo, em_centavos = use_centavos(period_slice(df, mes_ini, mes_fim))
     
-    # Filtra apenas quem tem faturamento > 0
+    # Filtra apenas quem tem faturamento > 0 (filtro por linha: a matriz fica nas transações)
     base_analise = base_periodo[base_periodo["faturamento"] > 0].copy()
 
     if base_analise.empty:
@@ -64,7 +61,7 @@ def render(df, mes_ini, mes_fim, show_labels, ultima_atualizacao=None):
         return
 
     # ==================== CÁLCULOS DE KPI (MACRO - CONSOLIDADO) ====================
-    total_fat = base_analise["faturamento"].sum()
+    total_fat = to_reais(base_analise["faturamento"].sum(), em_centavos)
     total_ins = base_analise["insercoes"].sum()
     total_cli = base_analise["cliente"].nunique()
     
@@ -99,14 +96,15 @@ def render(df, mes_ini, mes_fim, show_labels, ultima_atualizacao=None):
         df_matriz = base_analise.copy()
         titulo_matriz = "Consolidado"
     else:
-        df_matriz = base_analise[base_analise["ano"] == ano_sel].copy()
+        df_matriz = period_slice(base_analise, ano=ano_sel).copy()
         titulo_matriz = str(ano_sel)
 
     # Agrupa dados para o Gráfico
-    scatter_data = df_matriz.groupby(["cliente", "emissora"], as_index=False).agg(
+    scatter_data = df_matriz.groupby(["cliente", "emissora"], as_index=False, observed=True).agg(
         Faturamento=("faturamento", "sum"),
         Insercoes=("insercoes", "sum")
     )
+    scatter_data["Faturamento"] = to_reais(scatter_data["Faturamento"], em_centavos)
     
     # Calcula custo médio
     scatter_data["Custo_Medio"] = scatter_data["Faturamento"] / scatter_data["Insercoes"].replace(0, 1)
@@ -174,21 +172,20 @@ def render(df, mes_ini, mes_fim, show_labels, ultima_atualizacao=None):
     # ==================== 2. RESUMO POR EMISSORA (COM DIVISÃO ANUAL) ====================
     st.subheader("2. Resumo de Eficiência por Emissora (Comparativo Anual)")
     
-    # Pivotagem para separar por ano
-    # Agrupa Emissora + Ano
-    grp_ano = base_periodo.groupby(["emissora", "ano"]).agg(
-        Faturamento=("faturamento", "sum"),
-        Insercoes=("insercoes", "sum")
-    ).unstack(fill_value=0)
-    
-    # Flatten nas colunas (Fat 2024, Fat 2025, etc.)
-    grp_ano.columns = [f"{col[0]}_{col[1]}" for col in grp_ano.columns]
-    grp_ano = grp_ano.reset_index()
-    
-    # Garante colunas dos anos base e comp se não existirem
-    for ano in [ano_base, ano_comp]:
-        if f"Faturamento_{ano}" not in grp_ano.columns: grp_ano[f"Faturamento_{ano}"] = 0.0
-        if f"Insercoes_{ano}" not in grp_ano.columns: grp_ano[f"Insercoes_{ano}"] = 0.0
+    # Par de anos comparado (padrão: os dois últimos da base)
+    if anos_global:
+        ano_base, ano_comp = year_pair_controls(anos_global, "eficiencia")
+    else:
+        ano_base = ano_comp = 2024 # Fallback
+
+    # Emissora x ano do pivô anual guardado no cubo (utils/yoy.py), só com o par escolhido
+    pivo = yearly_pivot(cubo, "emissora", mes_ini, mes_fim)
+    var_fat = compare_years(pivo, ano_base, ano_comp, "faturamento")
+    var_ins = compare_years(pivo, ano_base, ano_comp, "insercoes")
+    grp_ano = pd.DataFrame({
+        f"Faturamento_{ano_base}": var_fat[ano_base], f"Faturamento_{ano_comp}": var_fat[ano_comp],
+        f"Insercoes_{ano_base}": var_ins[ano_base], f"Insercoes_{ano_comp}": var_ins[ano_comp],
+    }).reset_index()
 
     # Calcula Yield Anual
     grp_ano[f"Yield_{ano_base}"] = np.where(grp_ano[f"Insercoes_{ano_base}"] > 0, grp_ano[f"Faturamento_{ano_base}"] / grp_ano[f"Insercoes_{ano_base}"], 0.0)
@@ -230,22 +227,16 @@ def render(df, mes_ini, mes_fim, show_labels, ultima_atualizacao=None):
     }
     tb_display = tb_display.rename(columns=cols_rename)
     
-    # Ordenação das colunas
-    cols_order = [
-        "Emissora", 
-        f"Inserções ({ano_base})", f"Inserções ({ano_comp})",
-        f"Faturamento ({ano_base})", f"Faturamento ({ano_comp})",
-        f"Yield Médio ({ano_base})", f"Yield Médio ({ano_comp})"
-    ]
+    # Ordenação das colunas (uma vez só quando base e comparação são o mesmo ano)
+    anos_par = list(dict.fromkeys([ano_base, ano_comp]))
+    cols_order = ["Emissora"] + [f"{nome} ({ano})" for nome in ["Inserções", "Faturamento", "Yield Médio"] for ano in anos_par]
     tb_display = tb_display[cols_order]
     
     # Formatação
-    tb_display[f"Faturamento ({ano_base})"] = tb_display[f"Faturamento ({ano_base})"].apply(brl)
-    tb_display[f"Faturamento ({ano_comp})"] = tb_display[f"Faturamento ({ano_comp})"].apply(brl)
-    tb_display[f"Inserções ({ano_base})"] = tb_display[f"Inserções ({ano_base})"].apply(format_int)
-    tb_display[f"Inserções ({ano_comp})"] = tb_display[f"Inserções ({ano_comp})"].apply(format_int)
-    tb_display[f"Yield Médio ({ano_base})"] = tb_display[f"Yield Médio ({ano_base})"].apply(brl)
-    tb_display[f"Yield Médio ({ano_comp})"] = tb_display[f"Yield Médio ({ano_comp})"].apply(brl)
+    for ano in anos_par:
+        tb_display[f"Faturamento ({ano})"] = tb_display[f"Faturamento ({ano})"].apply(brl)
+        tb_display[f"Inserções ({ano})"] = tb_display[f"Inserções ({ano})"].apply(format_int)
+        tb_display[f"Yield Médio ({ano})"] = tb_display[f"Yield Médio ({ano})"].apply(brl)
     
     display_styled_table(tb_display)
 
@@ -1,9 +1,16 @@
 # pages/perdas_ganhos.py
 
 import streamlit as st
-from utils.format import brl
+from functools import partial
+from utils.format import brl, to_reais
+from utils.cube import cube_of, history_of
+from utils.period import month_label
+from utils.yoy import yearly_pivot, compare_years
+from utils.filters import rolling_window_controls, year_pair_controls
 import pandas as pd
 import numpy as np
+import plotly.graph_objects as go
+from plotly.subplots import make_subplots
 from utils.export import create_zip_package 
 
 def color_delta(val):
@@ -20,14 +27,14 @@ def color_delta(val):
     except (ValueError, TypeError): return ""
     return ""
 
-def format_currency(val):
+def format_currency(val, centavos=False):
     """Formata moeda de forma abreviada ou completa dependendo do tamanho."""
     if pd.isna(val): return "R$ 0,00"
-    val_abs = abs(val)
+    val_abs = to_reais(abs(val), centavos)
     sign = "-" if val < 0 else ""
     if val_abs >= 1_000_000:
         return f"{sign}R$ {val_abs/1_000_000:,.1f} Mi".replace(",", "X").replace(".", ",").replace("X", ".")
-    return brl(val)
+    return brl(val, centavos=centavos)
 
 def format_int(val):
     """Formata inteiros com separador de milhar."""
@@ -77,57 +84,70 @@ def render(df, mes_ini, mes_fim, show_labels, ultima_atualizacao=None):
     df_ganhos_raw = pd.DataFrame()
     var_cli_raw = pd.DataFrame()
     var_emis_raw = pd.DataFrame()
+    ciclo_emis_raw = pd.DataFrame()
+    linha_tempo_raw = pd.DataFrame()
     
-    # Normalização básica
-    df = df.rename(columns={c: c.lower() for c in df.columns})
-    
-    # Garante coluna insercoes
-    if "insercoes" not in df.columns:
-        df["insercoes"] = 0.0
-    
-    # ==================== LÓGICA DE ANOS (AUTOMÁTICA) ====================
-    anos = sorted(df["ano"].dropna().unique())
+    # ==================== TÍTULO CENTRALIZADO ====================
+    # Preenchido depois da escolha do par de anos (seletores logo abaixo do título)
+    titulo = st.empty()
+    st.markdown("<div style='margin-bottom: 20px;'></div>", unsafe_allow_html=True)
+
+    if "cliente" not in df.columns or "faturamento" not in df.columns:
+        titulo.markdown("<h2 style='text-align: center; color: #003366;'>Perdas & Ganhos</h2>", unsafe_allow_html=True)
+        st.error("Colunas obrigatórias 'Cliente' e/ou 'Faturamento' ausentes.")
+        return
+
+    # Métricas somadas no cubo mensal da base (utils/cube.py), não nas transações;
+    # faturamento em centavos inteiros (somas exatas), reais só na formatação
+    cubo, em_centavos = cube_of(df).with_centavos()
+    fmt_brl = partial(brl, centavos=em_centavos)
+
+    # ==================== PAR DE ANOS (ESCOLHIDO NA PÁGINA) ====================
+    anos = sorted(cubo.celulas["ano"].dropna().unique())
     
     if not anos:
+        titulo.markdown("<h2 style='text-align: center; color: #003366;'>Perdas & Ganhos</h2>", unsafe_allow_html=True)
         st.info("Sem anos válidos na base.")
         return
     
-    if len(anos) >= 2:
-        ano_base, ano_comp = anos[-2], anos[-1]
+    # Períodos comparados: o par de anos escolhido, nos meses do filtro (padrão), ou, no modo de
+    # janela móvel, a janela atual e a mesma janela um ano antes (rótulos no lugar dos anos)
+    prefixos = cubo.prefix_sums()
+    janelas = rolling_window_controls(prefixos, "perdas_ganhos")
+    if janelas is None:
+        ano_base, ano_comp = year_pair_controls(anos, "perdas_ganhos")
+        periodoA = ((ano_base, mes_ini), (ano_base, mes_fim))
+        periodoB = ((ano_comp, mes_ini), (ano_comp, mes_fim))
     else:
-        ano_base = ano_comp = anos[-1]
-
-    # ==================== TÍTULO CENTRALIZADO ====================
-    st.markdown(
+        (ano_base, periodoA), (ano_comp, periodoB) = janelas.items()
+    titulo.markdown(
         f"<h2 style='text-align: center; color: #003366;'>Perdas & Ganhos ({ano_base} vs {ano_comp})</h2>", 
         unsafe_allow_html=True
     )
-    st.markdown("<div style='margin-bottom: 20px;'></div>", unsafe_allow_html=True)
-
-    if "cliente" not in df.columns or "faturamento" not in df.columns:
-        st.error("Colunas obrigatórias 'Cliente' e/ou 'Faturamento' ausentes.")
-        return
-
-    # Filtra período (Meses) e separa as bases
-    base_periodo = df[df["mes"].between(mes_ini, mes_fim)]
-    baseA = base_periodo[base_periodo["ano"] == ano_base]
-    baseB = base_periodo[base_periodo["ano"] == ano_comp]
 
     # ==================== CÁLCULOS DE CHURN E NOVOS NEGÓCIOS ====================
-    cliA = set(baseA["cliente"].unique())
-    cliB = set(baseB["cliente"].unique())
-    
-    # Listas de Clientes
-    lista_perdas = sorted(list(cliA - cliB))
-    lista_ganhos = sorted(list(cliB - cliA))
+    # Situação de cada cliente entre os dois períodos pelo índice de ciclo de vida do cubo
+    # (meses ativos, primeiro e último mês visto), sem conjuntos de clientes nem filtros nas linhas.
+    # Primeiro e último mês visto no histórico do recorte (sem os filtros de ano e mês): quem
+    # veiculou antes do período filtrado é reativado, e não novo
+    historico = history_of(df)
+    ciclo = cubo.lifecycle(historico=historico)
+    situacao = ciclo.classify(periodoA, periodoB)
+    lista_perdas = list(situacao.index[situacao == "Perdido"])
+    lista_ganhos = list(situacao.index[situacao.isin(["Novo", "Reativado"])])
+
+    def por_cliente(periodo, clientes):
+        """Faturamento e inserções dos clientes no período, pelas somas acumuladas do cubo."""
+        return pd.DataFrame({medida: prefixos.totals("cliente", *periodo, medida).reindex(clientes)
+                             for medida in ["faturamento", "insercoes"]}).rename_axis("cliente")
 
     # Valores Perdidos (Saíram em A)
-    dados_perdas = baseA[baseA["cliente"].isin(lista_perdas)]
+    dados_perdas = por_cliente(periodoA, lista_perdas)
     val_perdas = dados_perdas["faturamento"].sum()
     ins_perdas = dados_perdas["insercoes"].sum()
     
     # Valores Ganhos (Entraram em B)
-    dados_ganhos = baseB[baseB["cliente"].isin(lista_ganhos)]
+    dados_ganhos = por_cliente(periodoB, lista_ganhos)
     val_ganhos = dados_ganhos["faturamento"].sum()
     ins_ganhos = dados_ganhos["insercoes"].sum()
 
@@ -146,8 +166,8 @@ def render(df, mes_ini, mes_fim, show_labels, ultima_atualizacao=None):
     
     col_s1.metric(
         "Saldo Líquido (R$)", 
-        format_currency(saldo_financeiro), 
-        delta=f"Novos: {format_currency(val_ganhos)} | Perdidos: {format_currency(val_perdas)}",
+        format_currency(saldo_financeiro, em_centavos), 
+        delta=f"Novos: {format_currency(val_ganhos, em_centavos)} | Perdidos: {format_currency(val_perdas, em_centavos)}",
         delta_color="normal" 
     )
     col_s2.metric(
@@ -164,8 +184,8 @@ def render(df, mes_ini, mes_fim, show_labels, ultima_atualizacao=None):
     )
     col_s4.metric(
         "Custo Médio Unitário (Saldo)",
-        f"{saldo_custo:+.2f}".replace(".", ","), 
-        delta=f"Novos: {brl(custo_medio_ganhos)} | Perdidos: {brl(custo_medio_perdas)}",
+        f"{to_reais(saldo_custo, em_centavos):+.2f}".replace(".", ","), 
+        delta=f"Novos: {fmt_brl(custo_medio_ganhos)} | Perdidos: {fmt_brl(custo_medio_perdas)}",
         delta_color="normal"
     )
     
@@ -178,9 +198,7 @@ def render(df, mes_ini, mes_fim, show_labels, ultima_atualizacao=None):
     with colA:
         st.subheader(f"1. Clientes Perdidos (Saíram de {ano_base})")
         if lista_perdas:
-            df_perdas_raw = (baseA[baseA["cliente"].isin(lista_perdas)]
-                             .groupby("cliente", as_index=False)
-                             .agg(faturamento=("faturamento", "sum"), insercoes=("insercoes", "sum"))
+            df_perdas_raw = (dados_perdas.reset_index()
                              .sort_values("faturamento", ascending=False)
                              .reset_index(drop=True))
             
@@ -201,7 +219,7 @@ def render(df, mes_ini, mes_fim, show_labels, ultima_atualizacao=None):
                 "insercoes": "Inserções"
             })
             t_display['#'] = t_display['#'].astype(str)
-            t_display["Faturamento"] = t_display["Faturamento"].apply(brl)
+            t_display["Faturamento"] = t_display["Faturamento"].apply(fmt_brl)
             t_display["Inserções"] = t_display["Inserções"].apply(format_int)
             
             # Chama função de estilo
@@ -214,9 +232,7 @@ def render(df, mes_ini, mes_fim, show_labels, ultima_atualizacao=None):
     with colB:
         st.subheader(f"2. Clientes Novos (Entraram em {ano_comp})")
         if lista_ganhos:
-            df_ganhos_raw = (baseB[baseB["cliente"].isin(lista_ganhos)]
-                             .groupby("cliente", as_index=False)
-                             .agg(faturamento=("faturamento", "sum"), insercoes=("insercoes", "sum"))
+            df_ganhos_raw = (dados_ganhos.reset_index()
                              .sort_values("faturamento", ascending=False)
                              .reset_index(drop=True))
             
@@ -237,7 +253,7 @@ def render(df, mes_ini, mes_fim, show_labels, ultima_atualizacao=None):
                 "insercoes": "Inserções"
             })
             t_display['#'] = t_display['#'].astype(str)
-            t_display["Faturamento"] = t_display["Faturamento"].apply(brl)
+            t_display["Faturamento"] = t_display["Faturamento"].apply(fmt_brl)
             t_display["Inserções"] = t_display["Inserções"].apply(format_int)
             
             # Chama função de estilo
@@ -250,19 +266,18 @@ def render(df, mes_ini, mes_fim, show_labels, ultima_atualizacao=None):
 
     # Função auxiliar para montar tabela de variação
     def build_variation_table(groupby_col, label_col):
-        piv_fat = base_periodo.groupby([groupby_col, "ano"])["faturamento"].sum().unstack(fill_value=0)
-        piv_ins = base_periodo.groupby([groupby_col, "ano"])["insercoes"].sum().unstack(fill_value=0)
-        
-        for ano in [ano_base, ano_comp]:
-            if ano not in piv_fat.columns: piv_fat[ano] = 0.0
-            if ano not in piv_ins.columns: piv_ins[ano] = 0.0
-            
-        df_var = pd.concat([piv_fat, piv_ins], axis=1)
-        df_var.columns = [f"Fat_{ano_base}", f"Fat_{ano_comp}", f"Ins_{ano_base}", f"Ins_{ano_comp}"]
-        
-        df_var["Δ Fat"] = df_var[f"Fat_{ano_comp}"] - df_var[f"Fat_{ano_base}"]
-        df_var["Δ%"] = np.where(df_var[f"Fat_{ano_base}"] > 0, (df_var["Δ Fat"] / df_var[f"Fat_{ano_base}"]) * 100, np.nan)
-        df_var["Δ Ins"] = df_var[f"Ins_{ano_comp}"] - df_var[f"Ins_{ano_base}"]
+        # Pivô de todos os anos guardado no cubo; só o par escolhido entra na tabela (utils/yoy.py)
+        pivo = yearly_pivot(cubo, groupby_col, mes_ini, mes_fim, janelas)
+        var_fat = compare_years(pivo, ano_base, ano_comp, "faturamento")
+        var_ins = compare_years(pivo, ano_base, ano_comp, "insercoes")
+
+        df_var = pd.DataFrame({
+            f"Fat_{ano_base}": var_fat[ano_base], f"Fat_{ano_comp}": var_fat[ano_comp],
+            f"Ins_{ano_base}": var_ins[ano_base], f"Ins_{ano_comp}": var_ins[ano_comp],
+        })
+        df_var["Δ Fat"] = var_fat["Δ"]
+        df_var["Δ%"] = var_fat["Δ%"]
+        df_var["Δ Ins"] = var_ins["Δ"]
         
         df_var = df_var.reset_index().rename(columns={groupby_col: label_col})
         df_var = df_var.sort_values("Δ Fat", ascending=True)
@@ -306,9 +321,9 @@ def render(df, mes_ini, mes_fim, show_labels, ultima_atualizacao=None):
     display_styled_table(
         var_cli_disp, 
         format_dict={
-            f"R$ {ano_base}": brl, 
-            f"R$ {ano_comp}": brl, 
-            "Δ Fat": brl, 
+            f"R$ {ano_base}": fmt_brl, 
+            f"R$ {ano_comp}": fmt_brl, 
+            "Δ Fat": fmt_brl, 
             f"Ins. {ano_base}": format_int,
             f"Ins. {ano_comp}": format_int,
             "Δ Ins": format_int
@@ -348,9 +363,9 @@ def render(df, mes_ini, mes_fim, show_labels, ultima_atualizacao=None):
     display_styled_table(
         var_emis_disp,
         format_dict={
-            f"R$ {ano_base}": brl, 
-            f"R$ {ano_comp}": brl, 
-            "Δ Fat": brl, 
+            f"R$ {ano_base}": fmt_brl, 
+            f"R$ {ano_comp}": fmt_brl, 
+            "Δ Fat": fmt_brl, 
             f"Ins. {ano_base}": format_int,
             f"Ins. {ano_comp}": format_int,
             "Δ Ins": format_int
@@ -360,6 +375,101 @@ def render(df, mes_ini, mes_fim, show_labels, ultima_atualizacao=None):
     
     st.divider()
 
+    # ==================== CICLO DE VIDA DA CARTEIRA ====================
+    st.subheader("5. Ciclo de Vida da Carteira")
+    st.caption(f"Novos: primeira veiculação da base em {ano_comp}. Reativados: ausentes em {ano_base}, "
+               f"mas com veiculações anteriores a {ano_comp}, inclusive fora dos anos e meses do filtro.")
+
+    def soma(periodo, clientes, medida="faturamento"):
+        return prefixos.totals("cliente", *periodo, medida).reindex(clientes).sum()
+
+    retidos = list(situacao.index[situacao == "Retido"])
+    novos = list(situacao.index[situacao == "Novo"])
+    reativados = list(situacao.index[situacao == "Reativado"])
+
+    col_c1, col_c2, col_c3, col_c4 = st.columns(4)
+    col_c1.metric("Retidos", len(retidos),
+                  delta=f"Δ {format_currency(soma(periodoB, retidos) - soma(periodoA, retidos), em_centavos)}",
+                  delta_color="normal")
+    col_c2.metric("Perdidos", len(lista_perdas),
+                  delta=f"{ano_base}: {format_currency(val_perdas, em_centavos)}", delta_color="off")
+    col_c3.metric("Novos", len(novos),
+                  delta=f"{ano_comp}: {format_currency(soma(periodoB, novos), em_centavos)}", delta_color="off")
+    col_c4.metric("Reativados", len(reativados),
+                  delta=f"{ano_comp}: {format_currency(soma(periodoB, reativados), em_centavos)}", delta_color="off")
+
+    # Mesma classificação por relação cliente x emissora (índice de ciclo de vida dos pares)
+    situacao_emis = cubo.lifecycle(("cliente", "emissora"), historico=historico).classify(periodoA, periodoB)
+    if not situacao_emis.empty:
+        ciclo_emis_raw = (situacao_emis.groupby([situacao_emis.index.get_level_values("emissora"), situacao_emis], observed=True)
+                          .size().unstack(fill_value=0)
+                          .reindex(columns=ciclo.SITUACOES, fill_value=0))
+        ciclo_emis_raw["Saldo"] = ciclo_emis_raw["Novo"] + ciclo_emis_raw["Reativado"] - ciclo_emis_raw["Perdido"]
+        ciclo_emis_raw = ciclo_emis_raw.rename_axis(index="Emissora", columns=None).reset_index()
+        ciclo_emis_raw = pd.concat([ciclo_emis_raw, pd.DataFrame([{
+            "Emissora": "Totalizador", **ciclo_emis_raw.drop(columns="Emissora").sum().to_dict()
+        }])], ignore_index=True)
+        ciclo_emis_raw = ciclo_emis_raw.rename(columns={"Retido": "Retidos", "Perdido": "Perdidos",
+                                                        "Novo": "Novos", "Reativado": "Reativados"})
+        ciclo_emis_raw.insert(0, "#", list(range(1, len(ciclo_emis_raw))) + ["Total"])
+
+        st.markdown("**Relações Cliente x Emissora**")
+        ciclo_disp = ciclo_emis_raw.copy()
+        ciclo_disp['#'] = ciclo_disp['#'].astype(str)
+        ciclo_disp["Saldo"] = ciclo_disp["Saldo"].apply(lambda x: f"{int(x):+}")
+        display_styled_table(ciclo_disp, color_cols=["Saldo"])
+
+    st.markdown("<br>", unsafe_allow_html=True)
+
+    # ==================== LINHA DO TEMPO DE ENTRADAS E SAÍDAS ====================
+    st.subheader("6. Linha do Tempo de Entradas e Saídas")
+    st.caption("Entradas: mês da primeira veiculação do cliente na base (com os filtros atuais, exceto ano e mês). "
+               "Saídas: mês da última veiculação (quem veiculou no primeiro mês da base já estava ativo, "
+               "e quem veiculou no último segue ativo).")
+
+    linha_tempo_raw = ciclo.timeline()
+    linha_tempo_raw = linha_tempo_raw[linha_tempo_raw["ativos"] > 0].reset_index()
+
+    if not linha_tempo_raw.empty:
+        rotulos = [month_label(a, m) for a, m in zip(linha_tempo_raw["ano"], linha_tempo_raw["mes"])]
+        fig_tempo = make_subplots(specs=[[{"secondary_y": True}]])
+        fig_tempo.add_trace(
+            go.Bar(x=rotulos, y=linha_tempo_raw["entradas"], name="Entradas", marker_color="#16a34a", opacity=0.85),
+            secondary_y=False
+        )
+        fig_tempo.add_trace(
+            go.Bar(x=rotulos, y=-linha_tempo_raw["saidas"], name="Saídas", marker_color="#dc2626", opacity=0.85,
+                   customdata=linha_tempo_raw["saidas"], hovertemplate="%{x}: %{customdata} saídas<extra></extra>"),
+            secondary_y=False
+        )
+        fig_tempo.add_trace(
+            go.Scatter(x=rotulos, y=linha_tempo_raw["ativos"], name="Clientes ativos", mode='lines+markers',
+                       line=dict(color="#007dc3", width=3), marker=dict(size=6)),
+            secondary_y=True
+        )
+        fig_tempo.update_yaxes(title_text="Entradas / Saídas (Qtd)", secondary_y=False,
+                               showgrid=True, gridcolor='#f0f0f0', zeroline=True, zerolinecolor="#999")
+        fig_tempo.update_yaxes(title_text="Clientes ativos", secondary_y=True, showgrid=False, rangemode="tozero")
+        fig_tempo.update_layout(
+            barmode="relative", height=400,
+            legend=dict(orientation="h", y=1.1, x=0.5, xanchor="center"),
+            template="plotly_white",
+            margin=dict(l=20, r=20, t=20, b=20)
+        )
+        if show_labels:
+            for rotulo, entradas, saidas in zip(rotulos, linha_tempo_raw["entradas"], linha_tempo_raw["saidas"]):
+                if entradas > 0:
+                    fig_tempo.add_annotation(x=rotulo, y=entradas, text=str(int(entradas)), showarrow=False,
+                                             yshift=10, font=dict(size=10, color="#16a34a"), secondary_y=False)
+                if saidas > 0:
+                    fig_tempo.add_annotation(x=rotulo, y=-saidas, text=str(int(saidas)), showarrow=False,
+                                             yshift=-10, font=dict(size=10, color="#dc2626"), secondary_y=False)
+        st.plotly_chart(fig_tempo, width="stretch")
+    else:
+        st.info("Sem dados para o período selecionado.")
+
+    st.divider()
+
     # ==================== EXPORTAÇÃO ====================
     def get_filter_string():
         f = st.session_state 
@@ -374,17 +484,28 @@ def render(df, mes_ini, mes_fim, show_labels, ultima_atualizacao=None):
     if st.session_state.get("show_perdas_export", False):
         @st.dialog("Opções de Exportação - Perdas & Ganhos")
         def export_dialog():
-            df_p_exp = df_perdas_raw.rename(columns={"cliente": "Cliente", "faturamento": "Faturamento", "insercoes": "Inserções"}) if not df_perdas_raw.empty else None
-            df_g_exp = df_ganhos_raw.rename(columns={"cliente": "Cliente", "faturamento": "Faturamento", "insercoes": "Inserções"}) if not df_ganhos_raw.empty else None
-            df_vc_exp = var_cli_raw if not var_cli_raw.empty else None
-            df_ve_exp = var_emis_raw if not var_emis_raw.empty else None
+            # Planilha exportada sempre em reais
+            def em_reais(d, cols):
+                return d.assign(**{c: to_reais(d[c], em_centavos) for c in cols})
+            cols_var = [f"Fat_{ano_base}", f"Fat_{ano_comp}", "Δ Fat"]
+
+            df_p_exp = em_reais(df_perdas_raw, ["faturamento"]).rename(columns={"cliente": "Cliente", "faturamento": "Faturamento", "insercoes": "Inserções"}) if not df_perdas_raw.empty else None
+            df_g_exp = em_reais(df_ganhos_raw, ["faturamento"]).rename(columns={"cliente": "Cliente", "faturamento": "Faturamento", "insercoes": "Inserções"}) if not df_ganhos_raw.empty else None
+            df_vc_exp = em_reais(var_cli_raw, cols_var) if not var_cli_raw.empty else None
+            df_ve_exp = em_reais(var_emis_raw, cols_var) if not var_emis_raw.empty else None
+            df_ce_exp = ciclo_emis_raw if not ciclo_emis_raw.empty else None
+            df_lt_exp = linha_tempo_raw.rename(columns={"ano": "Ano", "mes": "Mês", "ativos": "Clientes Ativos",
+                                                        "entradas": "Entradas", "saidas": "Saídas"}) \
+                if not linha_tempo_raw.empty else None
 
             # Chaves padronizadas com " (Dados)"
             table_options = {
                 f"1. Clientes Perdidos (Saíram de {ano_base}) (Dados)": {'df': df_p_exp}, 
                 f"2. Clientes Novos (Entraram em {ano_comp}) (Dados)": {'df': df_g_exp}, 
                 "3. Variações por Cliente (Dados)": {'df': df_vc_exp}, 
-                "4. Variações por Emissora (Dados)": {'df': df_ve_exp}
+                "4. Variações por Emissora (Dados)": {'df': df_ve_exp},
+                "5. Ciclo de Vida por Emissora (Dados)": {'df': df_ce_exp},
+                "6. Linha do Tempo de Entradas e Saídas (Dados)": {'df': df_lt_exp}
             }
             available_options = [name for name, data in table_options.items() if data.get('df') is not None and not data['df'].empty]
             
@@ -4,7 +4,8 @@ import streamlit as st
 import pandas as pd
 import numpy as np
 import plotly.express as px
-from utils.format import brl, PALETTE
+from utils.format import brl, to_reais, PALETTE
+from utils.cube import cube_of
 from utils.export import create_zip_package 
 
 def format_int(val):
@@ -31,18 +32,16 @@ def render(df, mes_ini, mes_fim, show_labels, ultima_atualizacao=None):
     df_abc_export = pd.DataFrame()
     fig_pie = None 
 
-    # Normalização
-    df = df.rename(columns={c: c.lower() for c in df.columns})
-    
     # Garante colunas
     if "cliente" not in df.columns or "faturamento" not in df.columns:
         st.error("Colunas obrigatórias ausentes.")
         return
-    if "insercoes" not in df.columns:
-        df["insercoes"] = 0.0
+    # Métricas somadas no cubo mensal da base (utils/cube.py), não nas transações;
+    # faturamento em centavos inteiros (somas exatas), reais só na formatação
+    cubo, em_centavos = cube_of(df).with_centavos()
 
     # Filtros
-    base_periodo = df[df["mes"].between(mes_ini, mes_fim)]
+    base_periodo = cubo.slice(mes_ini, mes_fim)
     
     if base_periodo.empty:
         st.info("Sem dados para o período selecionado.")
@@ -73,10 +72,7 @@ def render(df, mes_ini, mes_fim, show_labels, ultima_atualizacao=None):
 
     # ==================== CÁLCULO DO ABC ====================
     # 1. Agrupar por Cliente e Somar Métricas
-    df_abc = base_periodo.groupby("cliente", as_index=False).agg(
-        faturamento=("faturamento", "sum"),
-        insercoes=("insercoes", "sum")
-    )
+    df_abc = base_periodo.group("cliente", ["faturamento", "insercoes"]).reset_index()
     
     # 2. Definir coluna alvo para ordenação e corte
     target_col = "faturamento" if criterio == "Faturamento" else "insercoes"
@@ -106,7 +102,7 @@ def render(df, mes_ini, mes_fim, show_labels, ultima_atualizacao=None):
 
     # ==================== KPIs DO TOPO ====================
     # Agrupa por classe para os cards
-    resumo_classes = df_abc.groupby("classe").agg(
+    resumo_classes = df_abc.groupby("classe", observed=True).agg(
         Qtd_Clientes=("cliente", "count"),
         Total_Faturamento=("faturamento", "sum"),
         Total_Insercoes=("insercoes", "sum")
@@ -117,7 +113,7 @@ def render(df, mes_ini, mes_fim, show_labels, ultima_atualizacao=None):
     # Define qual valor mostrar no card (R$ ou Qtd)
     def get_kpi_display(row):
         if criterio == "Faturamento":
-            return brl(row["Total_Faturamento"])
+            return brl(row["Total_Faturamento"], centavos=em_centavos)
         else:
             return f"{int(row['Total_Insercoes']):,}".replace(",", ".") + " ins."
 
@@ -176,11 +172,11 @@ def render(df, mes_ini, mes_fim, show_labels, ultima_atualizacao=None):
         df_display["acum_fmt"] = (df_display["acumulado"] * 100).apply(lambda x: f"{x:.2f}%")
         
         # Formatação dos valores
-        df_display["faturamento_fmt"] = df_display["faturamento"].apply(brl)
+        df_display["faturamento_fmt"] = df_display["faturamento"].apply(brl, centavos=em_centavos)
         df_display["insercoes_fmt"] = df_display["insercoes"].apply(format_int)
         
         # Custo Médio
-        df_display["custo_fmt"] = df_display["custo_medio"].apply(lambda x: brl(x) if pd.notna(x) else "-")
+        df_display["custo_fmt"] = df_display["custo_medio"].apply(lambda x: brl(x, centavos=em_centavos) if pd.notna(x) else "-")
         
         # Seleção e Renomeação
         cols_order = ["classe", "cliente", "faturamento_fmt", "insercoes_fmt", "custo_fmt", "share_fmt", "acum_fmt"]
@@ -206,6 +202,8 @@ def render(df, mes_ini, mes_fim, show_labels, ultima_atualizacao=None):
         
         # Guarda para exportação
         df_abc_export = df_abc.copy()
+        df_abc_export["faturamento"] = to_reais(df_abc_export["faturamento"], em_centavos)
+        df_abc_export["custo_medio"] = to_reais(df_abc_export["custo_medio"], em_centavos)
         df_abc_export.columns = ["Cliente", "Faturamento", "Inserções", "Share", "Acumulado", "Classe", "Custo Médio"]
 
     # ==================== EXPORTAÇÃO ====================
@@ -227,7 +225,7 @@ def render(df, mes_ini, mes_fim, show_labels, ultima_atualizacao=None):
         @st.dialog("Opções de Exportação - Relatório ABC")
         def export_dialog():
             table_options = {
-                "1. Distribuição da Carteira (Dados)": {'df': resumo_classes.reset_index()},
+                "1. Distribuição da Carteira (Dados)": {'df': resumo_classes.assign(Total_Faturamento=to_reais(resumo_classes["Total_Faturamento"], em_centavos)).reset_index()},
                 "1. Distribuição da Carteira (Gráfico)": {'fig': fig_pie}, # Corrigido
                 "2. Detalhamento dos Clientes (Dados)": {'df': df_abc_export}
             }
@@ -3,6 +3,7 @@
 import streamlit as st
 import plotly.express as px
 from utils.format import brl, PALETTE
+from utils.cube import cube_of
 from utils.export import create_zip_package 
 import pandas as pd
 import plotly.graph_objects as go
@@ -79,21 +80,17 @@ def render(df, mes_ini, mes_fim, show_labels, ultima_atualizacao=None):
     fig = go.Figure() 
     top10_raw_export = pd.DataFrame()
 
-    df = df.rename(columns={c: c.lower() for c in df.columns})
     if "emissora" not in df.columns or "ano" not in df.columns:
         st.error("Colunas 'Emissora' e/ou 'Ano' ausentes.")
         return
-    
-    # Garante Inserções
-    if "insercoes" not in df.columns:
-        df["insercoes"] = 0.0
 
-    # Filtra período (Mês)
-    base_periodo = df[df["mes"].between(mes_ini, mes_fim)]
+    # Filtra período (Mês) no cubo mensal da base (somas por cliente/emissora/mês já prontas)
+    cubo = cube_of(df)
+    celulas_periodo = cubo.slice(mes_ini, mes_fim).celulas
     
     # Listas para os seletores
-    emis_list = sorted(base_periodo["emissora"].dropna().unique())
-    anos_list = sorted(base_periodo["ano"].dropna().unique())
+    emis_list = sorted(celulas_periodo["emissora"].dropna().unique())
+    anos_list = sorted(celulas_periodo["ano"].dropna().unique())
 
     if not emis_list or not anos_list:
         st.info("Sem dados para selecionar emissora/ano.")
@@ -144,22 +141,19 @@ def render(df, mes_ini, mes_fim, show_labels, ultima_atualizacao=None):
     # ==================== LÓGICA DE FILTRAGEM ====================
     # 1. Filtro de Emissora
     if emis_sel == "Consolidado (Seleção Atual)":
-        base = base_periodo.copy()
+        filtro_emissora = {}
         cor_grafico = PALETTE[3] # Azul Escuro
     else:
-        base = base_periodo[base_periodo["emissora"] == emis_sel].copy()
+        filtro_emissora = {"emissora": emis_sel}
         cor_grafico = PALETTE[0] # Azul Claro
 
     # 2. Filtro de Ano
-    if ano_sel != "Consolidado (Seleção Atual)":
-        base = base[base["ano"] == ano_sel]
+    ano_filtro = None if ano_sel == "Consolidado (Seleção Atual)" else ano_sel
+    base = cubo.slice(mes_ini, mes_fim, ano_filtro, **filtro_emissora)
 
     # ==================== PROCESSAMENTO ====================
     # Agrupa por cliente somando métricas
-    top10_raw = base.groupby("cliente", as_index=False).agg(
-        faturamento=("faturamento", "sum"),
-        insercoes=("insercoes", "sum")
-    )
+    top10_raw = base.group("cliente").reset_index()
     
     # Calcula Custo Unitário
     top10_raw["custo_unitario"] = np.where(
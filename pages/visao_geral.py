@@ -2,7 +2,9 @@
 
 import streamlit as st
 import plotly.express as px
-from utils.format import brl, PALETTE
+from utils.format import brl, to_reais, PALETTE
+from utils.cube import cube_of
+from utils.filters import rolling_window_controls
 import pandas as pd
 import plotly.graph_objects as go 
 from plotly.subplots import make_subplots
@@ -82,17 +84,18 @@ def get_pretty_ticks(max_val, num_ticks=5):
     y_axis_cap = max_y_rounded * 1.05
     return tick_values, tick_texts, y_axis_cap
 
-def get_top_client_info(df_base):
-    """Retorna nome completo, valor e nome abreviado do maior cliente."""
-    if df_base.empty:
+def get_top_client_info(prefixos, janela, em_centavos=False):
+    """Retorna nome completo, valor e nome abreviado do maior cliente da janela (início, fim)."""
+    if "cliente" not in prefixos.valores:
         return "—", 0.0, "—"
     
-    top_series = df_base.groupby("cliente")["faturamento"].sum().sort_values(ascending=False)
+    presentes = prefixos.totals("cliente", *janela, "linhas") > 0
+    top_series = prefixos.totals("cliente", *janela)[presentes].sort_values(ascending=False)
     if top_series.empty:
         return "—", 0.0, "—"
         
     nome_full = top_series.index[0]
-    valor = top_series.iloc[0]
+    valor = to_reais(top_series.iloc[0], em_centavos)
     
     # Trunca nome muito longo para exibição no card (visual), mas mantém full para tooltip
     nome_display = nome_full[:18] + "..." if len(nome_full) > 18 else nome_full
@@ -118,29 +121,15 @@ def render(df, mes_ini, mes_fim, show_labels, ultima_atualizacao=None):
     figs_share_dict = {}
     
     # ==================== PREPARAÇÃO DE DADOS ====================
-    df = df.rename(columns={c: c.lower() for c in df.columns})
-
-    if "emissora" in df.columns:
-        df["emissora"] = df["emissora"].astype(str).str.strip().str.title()
-        df["emissora"] = df["emissora"].replace({
-            "Thathi": "Thathi Tv",
-            "Th+": "Th+ Prime" 
-        })
-
-    if "insercoes" not in df.columns:
-        df["insercoes"] = 0.0
-
-    if "meslabel" not in df.columns:
-        if "ano" in df.columns and "mes" in df.columns:
-            df["meslabel"] = pd.to_datetime(dict(
-                year=df["ano"].astype(int),
-                month=df["mes"].astype(int),
-                day=1
-            )).dt.strftime("%b/%y")
-        else:
-            df["meslabel"] = ""
+    # Nomes de exibição das emissoras: calculados por categoria, sobre as células do cubo mensal
+    # da base (utils/cube.py); todas as métricas da página são somas/contagens nesse cubo
+    def nome_emissora(nome):
+        nome = str(nome).strip().title()
+        return {"Thathi": "Thathi Tv", "Th+": "Th+ Prime"}.get(nome, nome)
+
+    cubo = cube_of(df).map("emissora", nome_emissora)
 
-    anos = sorted(df["ano"].dropna().unique())
+    anos = sorted(cubo.celulas["ano"].dropna().unique())
     if not anos:
         st.info("Sem anos válidos na base.")
         return
@@ -152,65 +141,84 @@ def render(df, mes_ini, mes_fim, show_labels, ultima_atualizacao=None):
     ano_base_str = str(ano_base)[-2:]
     ano_comp_str = str(ano_comp)[-2:]
     
-    base_periodo = df[df["mes"].between(mes_ini, mes_fim)]
-    baseA = base_periodo[base_periodo["ano"] == ano_base]
-    baseB = base_periodo[base_periodo["ano"] == ano_comp]
-
-    # ==================== KPI LINHA 1: TOTAIS (MACRO) ====================
-    totalA = float(baseA["faturamento"].sum()) if not baseA.empty else 0.0
-    totalB = float(baseB["faturamento"].sum()) if not baseB.empty else 0.0
-    delta_abs = totalB - totalA
-    delta_pct = (delta_abs / totalA * 100) if totalA > 0.0 else 0
-
-    c1, c2, c3, c4 = st.columns(4)
-    c1.metric(f"Total {ano_base}", format_pt_br_abrev(totalA))
-    c2.metric(f"Total {ano_comp}", format_pt_br_abrev(totalB))
-    c3.metric(f"Δ Absoluto ({ano_comp_str}-{ano_base_str})", format_pt_br_abrev(delta_abs))
-    c4.metric(f"Δ % ({ano_comp_str} vs {ano_base_str})", f"{delta_pct:.2f}%" if totalA > 0 else "—")
-
-    # ==================== KPI LINHA 2: TICKET MÉDIO E MAIOR CLIENTE ====================
-    # Ticket Médio Base A (Menor Ano)
-    cliA = baseA["cliente"].nunique()
-    tmA = totalA / cliA if cliA > 0 else 0.0
+    base_periodo = cubo.slice(mes_ini, mes_fim)
+
+    # Cards: totais de qualquer intervalo de meses por subtração nas somas acumuladas do cubo
+    # (em centavos quando houver). Padrão: os meses do filtro em cada ano; ou uma janela móvel.
+    cubo_centavos, em_centavos = cube_of(df).with_centavos()
+    prefixos = cubo_centavos.prefix_sums()
+    conjuntos = cubo_centavos.client_sets()
+
+    # Fragmento: trocar o modo ou o mês de referência reexecuta só os cards, não os gráficos
+    @st.fragment
+    def cards(ano_base, ano_comp, ano_base_str, ano_comp_str):
+        janelas = rolling_window_controls(prefixos, "visao_geral")
+        if janelas is None:
+            janelaA = ((ano_base, mes_ini), (ano_base, mes_fim))
+            janelaB = ((ano_comp, mes_ini), (ano_comp, mes_fim))
+        else:
+            (ano_base, janelaA), (ano_comp, janelaB) = janelas.items()
+            ano_base_str, ano_comp_str = "ant.", "atual"
+            st.caption("Os cards comparam as janelas móveis; os gráficos seguem os meses do filtro.")
+
+        # ==================== KPI LINHA 1: TOTAIS (MACRO) ====================
+        totalA = float(to_reais(prefixos.totals(None, *janelaA), em_centavos))
+        totalB = float(to_reais(prefixos.totals(None, *janelaB), em_centavos))
+        delta_abs = totalB - totalA
+        delta_pct = (delta_abs / totalA * 100) if totalA > 0.0 else 0
+
+        c1, c2, c3, c4 = st.columns(4)
+        c1.metric(f"Total {ano_base}", format_pt_br_abrev(totalA))
+        c2.metric(f"Total {ano_comp}", format_pt_br_abrev(totalB))
+        c3.metric(f"Δ Absoluto ({ano_comp_str}-{ano_base_str})", format_pt_br_abrev(delta_abs))
+        c4.metric(f"Δ % ({ano_comp_str} vs {ano_base_str})", f"{delta_pct:.2f}%" if totalA > 0 else "—")
+
+        # ==================== KPI LINHA 2: TICKET MÉDIO E MAIOR CLIENTE ====================
+        # Ticket Médio Base A (Menor Ano)
+        # Clientes distintos: OR dos bitsets de clientes dos meses da janela + contagem de bits
+        cliA = conjuntos.count(conjuntos.union([janelaA]))
+        tmA = totalA / cliA if cliA > 0 else 0.0
     
-    # Ticket Médio Base B (Maior Ano)
-    cliB = baseB["cliente"].nunique()
-    tmB = totalB / cliB if cliB > 0 else 0.0
+        # Ticket Médio Base B (Maior Ano)
+        cliB = conjuntos.count(conjuntos.union([janelaB]))
+        tmB = totalB / cliB if cliB > 0 else 0.0
 
-    # Maior Cliente Base A
-    full_A, val_A, disp_A = get_top_client_info(baseA)
-    # Maior Cliente Base B
-    full_B, val_B, disp_B = get_top_client_info(baseB)
+        # Maior Cliente Base A
+        full_A, val_A, disp_A = get_top_client_info(prefixos, janelaA, em_centavos)
+        # Maior Cliente Base B
+        full_B, val_B, disp_B = get_top_client_info(prefixos, janelaB, em_centavos)
 
-    st.markdown("<div style='height: 25px;'></div>", unsafe_allow_html=True) 
+        st.markdown("<div style='height: 25px;'></div>", unsafe_allow_html=True) 
     
-    k1, k2, k3, k4 = st.columns(4)
+        k1, k2, k3, k4 = st.columns(4)
     
-    k1.metric(f"Ticket Médio ({ano_base})", format_pt_br_abrev(tmA))
-    k2.metric(f"Ticket Médio ({ano_comp})", format_pt_br_abrev(tmB))
+        k1.metric(f"Ticket Médio ({ano_base})", format_pt_br_abrev(tmA))
+        k2.metric(f"Ticket Médio ({ano_comp})", format_pt_br_abrev(tmB))
     
-    k3.metric(
-        label=f"Maior Cliente ({ano_base})", 
-        value=format_pt_br_abrev(val_A),
-        delta=disp_A, # Nome abreviado visível
-        delta_color="off",
-        help=f"Cliente: {full_A}" # Tooltip com nome completo
-    )
+        k3.metric(
+            label=f"Maior Cliente ({ano_base})", 
+            value=format_pt_br_abrev(val_A),
+            delta=disp_A, # Nome abreviado visível
+            delta_color="off",
+            help=f"Cliente: {full_A}" # Tooltip com nome completo
+        )
     
-    k4.metric(
-        label=f"Maior Cliente ({ano_comp})", 
-        value=format_pt_br_abrev(val_B),
-        delta=disp_B, # Nome abreviado visível
-        delta_color="off",
-        help=f"Cliente: {full_B}" # Tooltip com nome completo
-    )
+        k4.metric(
+            label=f"Maior Cliente ({ano_comp})", 
+            value=format_pt_br_abrev(val_B),
+            delta=disp_B, # Nome abreviado visível
+            delta_color="off",
+            help=f"Cliente: {full_B}" # Tooltip com nome completo
+        )
+
+    cards(ano_base, ano_comp, ano_base_str, ano_comp_str)
 
     st.divider()
 
     # ==================== GRÁFICO 1: EVOLUÇÃO MENSAL ====================
     st.markdown("<p class='custom-chart-title'>1. Evolução Mensal de Faturamento e Inserções</p>", unsafe_allow_html=True)
     
-    evol_raw = base_periodo.groupby(["ano", "meslabel", "mes"], as_index=False)[["faturamento", "insercoes"]].sum().sort_values(["ano", "mes"])
+    evol_raw = base_periodo.group(["ano", "meslabel", "mes"]).reset_index().sort_values(["ano", "mes"])
     
     if not evol_raw.empty:
         fig_evol = make_subplots(specs=[[{"secondary_y": True}]])
@@ -295,12 +303,12 @@ def render(df, mes_ini, mes_fim, show_labels, ultima_atualizacao=None):
     # ==================== GRÁFICO 2: FATURAMENTO POR EMISSORA ====================
     st.markdown("<p class='custom-chart-title'>2. Faturamento por Emissora (Ano a Ano)</p>", unsafe_allow_html=True)
     
-    base_emis_raw = base_periodo.groupby(["emissora", "ano"], as_index=False)["faturamento"].sum()
+    base_emis_raw = base_periodo.group(["emissora", "ano"], ["faturamento"]).reset_index()
     
     if not base_emis_raw.empty:
         # Ordenação e concatenação
         base_emis_raw = base_emis_raw.sort_values(["emissora", "ano"])
-        base_emis_raw["label_x"] = base_emis_raw["emissora"] + " " + base_emis_raw["ano"].astype(str)
+        base_emis_raw["label_x"] = base_emis_raw["emissora"].astype(str) + " " + base_emis_raw["ano"].astype(str)
         
         fig_emis = px.bar(
             base_emis_raw, 
@@ -335,12 +343,12 @@ def render(df, mes_ini, mes_fim, show_labels, ultima_atualizacao=None):
     # ==================== GRÁFICO 3: SHARE DE MERCADO ====================
     st.markdown("<p class='custom-chart-title'>3. Share Faturamento (%)</p>", unsafe_allow_html=True)
     
-    anos_presentes = sorted(base_periodo["ano"].dropna().unique())
+    anos_presentes = sorted(base_periodo.celulas["ano"].dropna().unique())
     if anos_presentes:
         cols_share = st.columns(len(anos_presentes))
         
         for idx, ano_share in enumerate(anos_presentes):
-            df_share_ano = base_periodo[base_periodo["ano"] == ano_share].groupby("emissora", as_index=False)["faturamento"].sum()
+            df_share_ano = cubo.slice(mes_ini, mes_fim, ano_share).group("emissora", ["faturamento"]).reset_index()
             
             if not df_share_ano.empty:
                 fig_share = px.pie(
@@ -385,10 +393,10 @@ def render(df, mes_ini, mes_fim, show_labels, ultima_atualizacao=None):
     # ==================== GRÁFICO 4: FATURAMENTO POR EXECUTIVO ====================
     st.markdown("<p class='custom-chart-title'>4. Faturamento por Executivo (Ano a Ano)</p>", unsafe_allow_html=True)
     
-    base_exec_raw = base_periodo.groupby(["executivo", "ano"], as_index=False)["faturamento"].sum()
+    base_exec_raw = base_periodo.group(["executivo", "ano"], ["faturamento"]).reset_index()
     
     if not base_exec_raw.empty:
-        rank_exec = base_exec_raw.groupby("executivo")["faturamento"].sum().sort_values(ascending=False).index.tolist()
+        rank_exec = base_exec_raw.groupby("executivo", observed=True)["faturamento"].sum().sort_values(ascending=False).index.tolist()
         base_exec_raw["executivo"] = pd.Categorical(base_exec_raw["executivo"], categories=rank_exec, ordered=True)
         base_exec_raw = base_exec_raw.sort_values(["executivo", "ano"])
         base_exec_raw["label_x"] = base_exec_raw["executivo"].astype(str) + " " + base_exec_raw["ano"].astype(str)
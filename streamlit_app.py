@@ -1,5 +1,6 @@
 # streamlit_app.py
 import os
+import io
 import streamlit as st
 from PIL import Image
 import pandas as pd
@@ -20,7 +21,9 @@ except locale.Error:
         print("AVISO: Não foi possível definir o locale para pt-BR.")
 
 # Importações dos módulos
-from utils.loaders import load_main_base
+from utils.loaders import load_main_base, publish_base, validate_upload
+from utils.upload import UploadJob
+from utils.watcher import start_data_watcher
 from utils.filters import aplicar_filtros
 from utils.format import normalize_dataframe
 
@@ -166,6 +169,9 @@ if pagina_ativa == "Início":
     st.title("Dashboard Vendas Ribeirão Preto")
     st.caption("Menu lateral para navegar • Filtros no topo • Exportação em Excel")
 
+# Novas planilhas em /data são processadas em segundo plano e publicadas sem esperar um novo acesso
+start_data_watcher()
+
 df, ultima_atualizacao = load_main_base()
 
 if df is None or df.empty:
@@ -179,22 +185,58 @@ if df is None or df.empty:
     )
     
     if uploaded_file is not None:
-        try:
-            base_dir = os.path.dirname(__file__)
-            data_dir = os.path.join(base_dir, "data")
-            if not os.path.exists(data_dir):
-                os.makedirs(data_dir)
-            
-            save_path = os.path.join(data_dir, "temp_data_uploaded.xlsx")
-            with open(save_path, "wb") as f:
-                f.write(uploaded_file.getbuffer())
-
-            st.success("✅ Arquivo carregado. O dashboard será iniciado.")
-            st.rerun()
-
-        except Exception as e:
-            st.error(f"Erro ao processar o arquivo: {e}")
-            
+        tarefa = st.session_state.get("upload_job")
+        if tarefa is None or tarefa.arquivo_id != uploaded_file.file_id:
+            try:
+                base_dir = os.path.dirname(__file__)
+                data_dir = os.path.join(base_dir, "data")
+                if not os.path.exists(data_dir):
+                    os.makedirs(data_dir)
+                save_path = os.path.join(data_dir, "temp_data_uploaded.xlsx")
+
+                # Lê direto da memória; o cabeçalho é validado antes de processar o arquivo inteiro
+                buffer = io.BytesIO(uploaded_file.getvalue())
+                abas = validate_upload(buffer)
+            except Exception as e:
+                st.error(f"Erro ao processar o arquivo: {e}")
+                st.stop()
+
+            if not abas:
+                st.error("Nenhuma aba com cabeçalho de vendas encontrada (ex.: Data/Ano e Mês, Cliente, Valor).")
+                st.stop()
+
+            tarefa = UploadJob(buffer, abas, save_path, uploaded_file.file_id).start()
+            st.session_state.upload_job = tarefa
+
+        @st.fragment(run_every=1)
+        def acompanhar_upload():
+            # Só este trecho é reexecutado a cada segundo enquanto a leitura roda em segundo plano
+            tarefa = st.session_state.upload_job
+            if tarefa.status == "executando":
+                st.progress(tarefa.progresso, text=f"Processando planilha... {tarefa.progresso:.0%}")
+                if st.button("Cancelar"):
+                    tarefa.cancelar()
+            else:
+                # Leitura encerrada: a página inteira é refeita, já sem o fragmento com run_every
+                st.rerun()
+
+        def resultado_upload(tarefa):
+            if tarefa.status == "concluido":
+                # Publica para todas as sessões
+                publish_base(*tarefa.resultado)
+                del st.session_state["upload_job"]
+                st.success("✅ Arquivo carregado. O dashboard será iniciado.")
+                st.rerun()
+            elif tarefa.status == "cancelado":
+                st.info("Carregamento cancelado. Remova o arquivo e selecione-o novamente para recomeçar.")
+            else:
+                st.error(f"Erro ao processar o arquivo: {tarefa.erro}")
+
+        if tarefa.status == "executando":
+            acompanhar_upload()
+        else:
+            resultado_upload(tarefa)
+
     st.stop() 
 
 
@@ -0,0 +1,40 @@
+# tests/test_cache.py
+import numpy as np
+import pandas as pd
+
+from utils.cache import NormalizedFrameCache, filtered_frames
+from utils.store import MAX_VERSOES, SharedBaseStore
+
+def _normalizada(n=5_000):
+    rng = np.random.default_rng(3)
+    return pd.DataFrame({
+        "Emissora": rng.choice(["Difusora", "Novabrasil"], n).astype(object),
+        "Cliente": rng.choice([f"Cliente {i}" for i in range(50)], n).astype(object),
+        "Faturamento": rng.random(n) * 1000,
+        "Misturada": pd.Series(["a", None] * (n // 2), dtype=object),
+        "_row_key": rng.integers(0, 2**63, n, dtype=np.uint64),
+    })
+
+def test_bases_normalizadas_guardadas_com_texto_compacto():
+    cache = NormalizedFrameCache()
+    df = _normalizada()
+    cache.put("a", df)
+    pd.testing.assert_frame_equal(cache.get("a"), df)
+    assert cache.stats()["bytes"] < df.memory_usage(deep=True).sum() / 3
+
+def test_publicar_descarta_recortes_das_versoes_que_sairam_do_store():
+    filtered_frames.clear()
+    store, base = SharedBaseStore(), _normalizada()
+    versoes = []
+    for _ in range(MAX_VERSOES + 1):
+        versao = store.publish(base, None, "teste")
+        versoes.append(versao.version_id)
+        filtered_frames.put(filtered_frames.key(versao.version_id, (("emissora", (0,)),)), base.iloc[:10])
+    versoes.append(store.publish(base, None, "teste").version_id)
+
+    retidas = [v for v in versoes if store.get(v) is not None]
+    assert len(retidas) == MAX_VERSOES
+    for v in versoes[:-1]:
+        encontrado = filtered_frames.get(filtered_frames.key(v, (("emissora", (0,)),)))
+        assert (encontrado is not None) == (v in retidas)
+    assert filtered_frames.stats()["entradas"] == len(retidas) - 1
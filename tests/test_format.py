@@ -0,0 +1,81 @@
+# tests/test_format.py
+import numpy as np
+import pandas as pd
+import pytest
+from hypothesis import given, settings, strategies as st
+
+from utils.format import (_parse_date_scalar, normalize_dataframe, parse_currency_br, parse_currency_series,
+                          parse_dates_br)
+
+# Trechos de valores monetários como aparecem nas planilhas, combinados em qualquer ordem
+TRECHOS = st.sampled_from(["R$", "R$ ", " ", " ", "-", "(", ")", ".", ",", "e", "E3", "nan", "inf", "abc",
+                           "0", "1", "12", "999", "1.234", "1.234,56", "0,5", ",5", "5,", "00", "\t"])
+TEXTOS = st.one_of(st.lists(TRECHOS, max_size=6).map("".join), st.text(max_size=8))
+NUMEROS = st.one_of(st.integers(-10**12, 10**12), st.floats(allow_nan=True, allow_infinity=True), st.booleans())
+VAZIOS = st.sampled_from([None, np.nan, "", "   "])
+VALORES = st.one_of(TEXTOS, NUMEROS, VAZIOS)
+
+def _escalar(valores):
+    return np.array([parse_currency_br(v) for v in valores], dtype="float64")
+
+@settings(max_examples=500, deadline=None)
+@given(st.lists(VALORES, max_size=40))
+def test_coluna_mista_igual_ao_escalar(valores):
+    serie = pd.Series(valores, dtype=object)
+    np.testing.assert_array_equal(parse_currency_series(serie).to_numpy(), _escalar(valores))
+
+@settings(max_examples=300, deadline=None)
+@given(st.lists(st.one_of(TEXTOS, VAZIOS), max_size=40))
+def test_coluna_de_texto_igual_ao_escalar(valores):
+    serie = pd.Series(valores, dtype=object)
+    np.testing.assert_array_equal(parse_currency_series(serie).to_numpy(), _escalar(valores))
+
+@settings(max_examples=200, deadline=None)
+@given(st.lists(st.one_of(st.floats(allow_nan=True, allow_infinity=True), st.none()), max_size=40))
+def test_coluna_numerica_igual_ao_escalar(valores):
+    serie = pd.Series(valores, dtype="float64")
+    np.testing.assert_array_equal(parse_currency_series(serie).to_numpy(), _escalar(serie.tolist()))
+
+def test_faturamento_em_reais_nao_e_arredondado():
+    bruto = pd.DataFrame({"Ref.": ["01/2024"] * 3, "Cliente": ["A"] * 3, "Valor": [1477.436, "R$ 10,004", 3],
+                          "Inserções": [1, 2, 0]})
+    df = normalize_dataframe(bruto)
+    np.testing.assert_array_equal(df["Faturamento"], [1477.436, 10.004, 3.0])
+    np.testing.assert_array_equal(df["Faturamento_Centavos"], [147744, 1000, 300])
+    np.testing.assert_array_equal(df["Custo_Unitario"], [1477.436, 10.004 / 2, 3.0])
+
+# Corpus de regressão das datas: cada valor deve sair de parse_dates_br como da regra escalar
+CORPUS_DATAS = [
+    # ISO (com e sem hora, dias e meses inválidos)
+    "2024-01-01", "2024-13-01", "2024-02-30", "2024-01-01 00:00:00", "2024-01-01 13:45:10", "2024-02-30 00:00:00",
+    "2024-01-01T10:00:00", "2024-1-5", "2024/01/15",
+    # dd/mm/aaaa: dias inválidos, mês primeiro, anos de 2 e 3 dígitos
+    "01/02/2024", "1/2/2024", "12/25/2024", "31/02/2024", "13/13/2024", "00/01/2024", "01/02/24", "1/2/124",
+    "01-02-2024", "15.01.2024",
+    # mm/aaaa
+    "01/2024", "1/2024", "13/2024", "0/2024",
+    # Seriais do Excel (e fora do intervalo)
+    "45658", "45658.5", "45658.25", "2024", "20240101", "99999999", "1.2.3", "..1234", "1234.",
+    # Dígitos unicode
+    "²³⁴⁵", "١٢٣٤٥",
+    # Vazios e outros
+    "nan", "None", "NaT", "", "  ", "jan/24", "Jan 2024", "abc", None, np.nan,
+]
+# Com fuso horário a regra escalar devolve Timestamps com fuso (coluna object): comparados à parte
+CORPUS_FUSOS = ["2024-01-01 00:00:00+00:00", "2024-01-01T10:00:00-03:00"]
+
+def _mesma_data(a, b):
+    return (pd.isna(a) and pd.isna(b)) or a == b
+
+@pytest.mark.parametrize("valor", CORPUS_DATAS + CORPUS_FUSOS)
+def test_data_igual_a_regra_escalar(valor):
+    esperado = _parse_date_scalar(valor)
+    # Sozinho e no meio de datas comuns (outros grupos de formato na mesma coluna)
+    assert _mesma_data(parse_dates_br(pd.Series([valor], dtype=object)).iloc[0], esperado)
+    coluna = pd.Series(["2024-03-01", valor, "05/2024", valor], dtype=object)
+    assert _mesma_data(parse_dates_br(coluna).iloc[1], esperado)
+    assert _mesma_data(parse_dates_br(coluna).iloc[3], esperado)
+
+def test_coluna_de_datas_igual_ao_apply():
+    coluna = pd.Series(CORPUS_DATAS * 3, dtype=object, name="data_ref")
+    pd.testing.assert_series_equal(parse_dates_br(coluna), coluna.map(_parse_date_scalar))
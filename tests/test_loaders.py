@@ -0,0 +1,87 @@
+# tests/test_loaders.py
+import io
+from datetime import datetime
+
+import numpy as np
+import openpyxl
+import pandas as pd
+import pytest
+
+from utils import loaders
+from utils.loaders import (_parse_sheet, _sheet_salt, ingest_upload, ingest_workbooks, iter_sheet_chunks,
+                           read_sheet_streaming, row_keys)
+
+ABA = "Vendas"
+CABECALHO = ["Ref.", "Emissora", "Cliente", "Contato Coml.", "Valor", "Inserções", "Observação"]
+LINHAS = [
+    [datetime(2024, 1, 1), "Difusora", "ACME LTDA", "Eduardo", 1477.44, 3, "x"],
+    [datetime(2024, 1, 1), "Difusora", "ACME LTDA", "Eduardo", 1477.44, 3, "x"],   # repetida
+    [datetime(2024, 2, 1), "Novabrasil", "Padaria", None, 1200, None, None],        # int e vazios
+    ["03/2024", "Novabrasil", "Padaria", "Julia", "R$ 1.234,56", 2.0, 7],          # texto e float inteiro
+    [datetime(2024, 4, 1, 10, 30), "Difusora", "Mercado 5", "Olga", 0.1, 1.5, True],
+    [datetime(2024, 5, 1), None, 12345, "Walner", -50, 0, ""],
+]
+
+def _grava(path, linhas=LINHAS):
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws.title = ABA
+    ws.append(CABECALHO)
+    for linha in linhas:
+        ws.append(linha)
+    wb.save(path)
+
+def _chaves_em_blocos(arquivo, engine, chunk_rows=2):
+    blocos = iter_sheet_chunks(arquivo, ABA, chunk_rows, engine=engine)
+    header = next(blocos)
+    salt, contagem, chaves = _sheet_salt(ABA, header), pd.Series(dtype="float64"), []
+    for bloco in blocos:
+        chaves_bloco, contagem = row_keys(bloco, salt, contagem)
+        chaves.append(chaves_bloco)
+    return np.concatenate(chaves)
+
+def _chaves_inteira(arquivo, engine):
+    df_raw = pd.read_excel(arquivo, sheet_name=ABA, engine=engine)
+    df_raw = df_raw.iloc[:, loaders.project_columns(df_raw.columns)]
+    return row_keys(df_raw, _sheet_salt(ABA, df_raw.columns))[0]
+
+@pytest.fixture
+def planilha(tmp_path):
+    path = tmp_path / "base.xlsx"
+    _grava(path)
+    return str(path)
+
+def test_chaves_iguais_em_todos_os_leitores(planilha):
+    referencia = _chaves_inteira(planilha, "openpyxl")
+    assert len(referencia) == len(LINHAS) and len(set(referencia)) == len(LINHAS)
+    np.testing.assert_array_equal(_chaves_inteira(planilha, "calamine"), referencia)
+    np.testing.assert_array_equal(_chaves_em_blocos(planilha, "calamine"), referencia)
+    np.testing.assert_array_equal(_chaves_em_blocos(planilha, "openpyxl"), referencia)
+    np.testing.assert_array_equal(_parse_sheet(planilha, ABA, streaming=False)[1], referencia)
+    np.testing.assert_array_equal(_parse_sheet(planilha, ABA, streaming=True)[1], referencia)
+    with open(planilha, "rb") as f:
+        buffer = io.BytesIO(f.read())
+    np.testing.assert_array_equal(read_sheet_streaming(buffer, ABA, 2)[1], referencia)
+
+def test_upload_seguido_de_recarga_so_normaliza_o_que_mudou(tmp_path):
+    origem = tmp_path / "origem.xlsx"
+    _grava(origem)
+    destino = str(tmp_path / "base.xlsx")
+    ingest_upload(io.BytesIO(origem.read_bytes()), [ABA], destino)
+
+    _grava(destino, LINHAS + [[datetime(2024, 6, 1), "Difusora", "Nova", "Julia", 10, 1, None]])
+    _, relatorio = ingest_workbooks([destino])
+    diff = next(item for item in relatorio if item["origem"] == "diff")
+    assert (diff["adicionadas"], diff["removidas"], diff["alteradas"]) == (1, 0, 0)
+
+def test_blocos_voltam_ao_openpyxl_quando_o_calamine_falha(planilha, monkeypatch):
+    def falha(*args, **kwargs):
+        raise ValueError("arquivo ilegível")
+        yield
+
+    esperado = _chaves_em_blocos(planilha, "openpyxl")
+    monkeypatch.setattr(loaders, "_iter_rows_calamine", falha)
+    np.testing.assert_array_equal(_chaves_em_blocos(planilha, "calamine"), esperado)
+    with open(planilha, "rb") as f:
+        buffer = io.BytesIO(f.read())
+    np.testing.assert_array_equal(read_sheet_streaming(buffer, ABA, 2)[1], esperado)
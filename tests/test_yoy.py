@@ -0,0 +1,54 @@
+# tests/test_yoy.py
+import numpy as np
+import pandas as pd
+import pytest
+
+from utils.cube import Cube
+from utils.yoy import compare_years, window_pivot, yearly_pivot
+
+@pytest.fixture
+def cubo():
+    rng = np.random.default_rng(7)
+    n = 400
+    df = pd.DataFrame({
+        "ano": rng.choice([2023, 2024, 2025], n),
+        "mes": rng.integers(1, 13, n),
+        "emissora": pd.Categorical(rng.choice(["Difusora", "Novabrasil", "Massa"], n)),
+        "executivo": pd.Categorical(rng.choice(["Eduardo", "Julia", "Olga", None], n)),
+        "cliente": pd.Categorical(rng.choice([f"Cliente {i}" for i in range(30)], n)),
+        "faturamento_centavos": rng.integers(0, 10**6, n),
+        "insercoes": rng.integers(0, 20, n),
+    })
+    return Cube.from_frame(df).with_centavos()[0]
+
+JANELAS = [
+    {"Últimos 3 meses": ((2025, 1), (2025, 3)), "Ano anterior": ((2024, 1), (2024, 3))},
+    {"Atual": ((2024, 11), (2025, 4)), "Anterior": ((2023, 11), (2024, 4))},
+    {"Atual": ((2023, 1), (2023, 2)), "Anterior": ((2022, 1), (2022, 2))},
+]
+
+@pytest.mark.parametrize("dim", ["emissora", "executivo", "cliente"])
+@pytest.mark.parametrize("janelas", JANELAS)
+def test_janelas_pelas_somas_acumuladas_iguais_ao_agrupamento(cubo, dim, janelas):
+    agrupado = cubo.windows(janelas).group([dim, "ano"], ["faturamento", "insercoes", "linhas"]).unstack(fill_value=0)
+    somas = window_pivot(cubo, dim, janelas)
+    pd.testing.assert_frame_equal(somas, agrupado.reindex(columns=somas.columns, fill_value=0),
+                                  check_dtype=False, check_column_type=False, check_index_type=False)
+
+def test_pivo_de_janelas_guardado_no_cubo(cubo):
+    janelas = JANELAS[0]
+    assert yearly_pivot(cubo, "cliente", janelas=janelas) is yearly_pivot(cubo, "cliente", janelas=janelas)
+
+def test_comparativo_mantem_valores_ausentes_nos_dois_anos(cubo):
+    # Emissora só em 2023: fora do par 2024 x 2025, mas presente no recorte (linha com 0 e 0)
+    extra = pd.DataFrame({"ano": [2023], "mes": [5], "emissora": ["Extinta"], "executivo": ["Julia"],
+                          "cliente": ["Cliente 1"], "faturamento_centavos": [500], "insercoes": [1]})
+    celulas = pd.concat([cubo.celulas, Cube.from_frame(extra).with_centavos()[0].celulas], ignore_index=True)
+    tres_anos = Cube(celulas.sort_values(["ano", "mes"], kind="stable", ignore_index=True))
+
+    tabela = compare_years(yearly_pivot(tres_anos, "emissora"), 2024, 2025)
+    esperado = tres_anos.slice(1, 12).pivot("emissora", "ano", "faturamento")
+    assert list(tabela.index) == list(esperado.index)
+    assert tabela.loc["Extinta", [2024, 2025, "Δ"]].tolist() == [0, 0, 0]
+    assert np.isnan(tabela.loc["Extinta", "Δ%"])
+    np.testing.assert_array_equal(tabela[2025], esperado[2025])
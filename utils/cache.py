@@ -0,0 +1,321 @@
+# utils/cache.py
+import os
+import json
+import hashlib
+import threading
+import weakref
+from collections import OrderedDict
+import pandas as pd
+from .format import ALIAS_VERSION
+
+# Pasta (dentro de /data) onde ficam as cópias colunares da base já normalizada
+CACHE_DIRNAME = ".cache"
+
+# Incrementar sempre que a saída de normalize_dataframe mudar de formato,
+# para invalidar os arquivos colunares gravados por versões anteriores.
+CACHE_VERSION = 6
+
+# Quantas entradas do histórico de versões (diff por atualização) ficam no meta.json
+MAX_HISTORICO = 24
+
+# Limite de memória das bases normalizadas mantidas no processo entre recargas de /data
+MEMORY_CACHE_MAX_BYTES = 512 * 1024 * 1024
+
+# Limite de memória dos recortes filtrados (filtros globais) compartilhados entre sessões
+FILTER_CACHE_MAX_BYTES = 256 * 1024 * 1024
+
+def _cache_paths(source_path):
+    """Retorna (pasta, meta.json, prefixo do parquet) do cache de um arquivo de origem."""
+    cache_dir = os.path.join(os.path.dirname(source_path), CACHE_DIRNAME)
+    nome = os.path.basename(source_path)
+    return cache_dir, os.path.join(cache_dir, f"{nome}.meta.json"), os.path.join(cache_dir, nome)
+
+# Uma trava por pasta de dados: ingestões simultâneas (watcher, sessões, upload) gravariam os
+# mesmos temporários do cache (<parquet>.tmp, meta.json.tmp)
+_travas_pastas = {}
+_travas_lock = threading.Lock()
+
+def ingest_lock(pasta):
+    """Trava (RLock) das ingestões que gravam no cache colunar de `pasta`."""
+    pasta = os.path.abspath(pasta)
+    with _travas_lock:
+        return _travas_pastas.setdefault(pasta, threading.RLock())
+
+def _hash_file(path, chunk_size=1024 * 1024):
+    """Hash SHA-256 do conteúdo do arquivo, lido em blocos."""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for bloco in iter(lambda: f.read(chunk_size), b""):
+            h.update(bloco)
+    return h.hexdigest()
+
+def file_fingerprint(path, sha256=None):
+    """
+    Impressão digital do arquivo de origem: tamanho, mtime e hash do conteúdo.
+    O hash é o que decide a validade do cache; tamanho/mtime só evitam recalculá-lo.
+    """
+    stat = os.stat(path)
+    return {
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "sha256": sha256 or _hash_file(path),
+        "version": CACHE_VERSION,
+        "aliases": ALIAS_VERSION,
+    }
+
+def _read_meta(meta_path):
+    try:
+        with open(meta_path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def _compatible(meta):
+    """O cache foi gravado por esta versão da normalização (formato e tabelas de aliases)?"""
+    return bool(meta) and meta.get("version") == CACHE_VERSION and meta.get("aliases") == ALIAS_VERSION
+
+def current_fingerprint(source_path, meta=None):
+    """
+    Fingerprint atual de `source_path`. Se tamanho e mtime batem com o meta.json, o hash gravado
+    é reaproveitado (o arquivo não é relido); senão o conteúdo é hasheado.
+    """
+    if meta is None:
+        meta = _read_meta(_cache_paths(source_path)[1])
+    stat = os.stat(source_path)
+    if meta and meta.get("sha256") and meta.get("size") == stat.st_size and meta.get("mtime_ns") == stat.st_mtime_ns:
+        return file_fingerprint(source_path, meta["sha256"])
+    return file_fingerprint(source_path)
+
+def load_cached_base(source_path, fingerprint=None):
+    """
+    Procura a base normalizada de `source_path` no cache colunar.
+    Retorna (df, fingerprint); df é None quando não há cache válido.
+    O fingerprint devolvido deve ser repassado a save_cached_base para não recalcular o hash.
+    """
+    _, meta_path, _ = _cache_paths(source_path)
+    meta = _read_meta(meta_path)
+    if fingerprint is None:
+        fingerprint = current_fingerprint(source_path, meta)
+
+    if not _compatible(meta) or meta.get("sha256") != fingerprint["sha256"] or not os.path.exists(meta.get("parquet", "")):
+        return None, fingerprint
+    try:
+        df = pd.read_parquet(meta["parquet"], engine="pyarrow")
+    except Exception as e:
+        print(f"AVISO: cache colunar ilegível ({meta['parquet']}): {e}")
+        return None, fingerprint
+
+    fingerprint = dict(fingerprint, parquet=meta["parquet"], historico=meta.get("historico", []))
+    # Mesmo conteúdo com outro mtime/tamanho (arquivo copiado ou salvo sem mudanças): atualiza o meta.json
+    if meta.get("size") != fingerprint["size"] or meta.get("mtime_ns") != fingerprint["mtime_ns"]:
+        _write_meta(meta_path, fingerprint)
+    return df, fingerprint
+
+def load_previous_base(source_path):
+    """
+    Última base normalizada gravada para `source_path`, mesmo que o arquivo tenha mudado desde então.
+    Serve de ponto de partida para a atualização incremental; None se não houver cache compatível.
+    """
+    _, meta_path, _ = _cache_paths(source_path)
+    meta = _read_meta(meta_path)
+    if not _compatible(meta) or not os.path.exists(meta.get("parquet", "")):
+        return None
+    try:
+        return pd.read_parquet(meta["parquet"], engine="pyarrow")
+    except Exception as e:
+        print(f"AVISO: cache colunar ilegível ({meta['parquet']}): {e}")
+        return None
+
+def _write_meta(meta_path, meta):
+    tmp = meta_path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+    os.replace(tmp, meta_path)
+
+def _arrow_safe(df):
+    """Converte colunas texto com tipos misturados (ex.: número e texto na mesma coluna) para str."""
+    out = df
+    for col in df.columns:
+        if df[col].dtype == object and pd.api.types.infer_dtype(df[col], skipna=True) not in ("string", "empty"):
+            if out is df:
+                out = df.copy()
+            out[col] = df[col].where(df[col].isna(), df[col].astype(str))
+    return out
+
+def save_cached_base(source_path, df, fingerprint, diff=None):
+    """
+    Grava a base normalizada em Parquet, com escrita atômica e meta.json ao lado.
+    `diff` (linhas adicionadas/removidas/alteradas em relação à versão anterior) entra no histórico do meta.json.
+    """
+    cache_dir, meta_path, prefixo = _cache_paths(source_path)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        parquet_path = f"{prefixo}.{fingerprint['sha256'][:16]}.parquet"
+        tmp = parquet_path + ".tmp"
+        _arrow_safe(df).to_parquet(tmp, engine="pyarrow", index=False)
+        os.replace(tmp, parquet_path)
+
+        antigo = _read_meta(meta_path)
+        historico = antigo.get("historico", []) if _compatible(antigo) else []
+        if diff is not None:
+            historico = (historico + [dict(diff, sha256=fingerprint["sha256"], mtime_ns=fingerprint["mtime_ns"])])[-MAX_HISTORICO:]
+        meta = dict(fingerprint, parquet=parquet_path, historico=historico)
+        _write_meta(meta_path, meta)
+
+        # Remove a versão anterior do parquet deste arquivo de origem
+        if antigo and antigo.get("parquet") not in (None, parquet_path) and os.path.exists(antigo["parquet"]):
+            os.remove(antigo["parquet"])
+    except Exception as e:
+        print(f"AVISO: não foi possível gravar o cache colunar de {source_path}: {e}")
+
+# ==================== CACHE EM MEMÓRIA ====================
+class FrameCache:
+    """
+    LRU de DataFrames em memória do processo, limitado por bytes (memory_usage).
+    Não há expiração por tempo: uma entrada só sai por falta de espaço. Os DataFrames
+    guardados são compartilhados entre sessões e não devem ser alterados.
+    """
+
+    # Conta também o conteúdo das colunas de objetos (strings), não só os ponteiros
+    deep = True
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._itens = OrderedDict()  # chave -> (df, bytes)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _guardar(self, df):
+        """Forma em que `df` fica guardado (e é medido) no cache."""
+        return df
+
+    def _entregar(self, guardado):
+        """DataFrame devolvido por get a partir do que foi guardado."""
+        return guardado
+
+    def get(self, chave):
+        with self._lock:
+            item = self._itens.get(chave)
+            if item is None:
+                self.misses += 1
+                return None
+            self._itens.move_to_end(chave)
+            self.hits += 1
+            guardado = item[0]
+        return self._entregar(guardado)
+
+    def put(self, chave, df):
+        df = self._guardar(df)
+        tamanho = int(df.memory_usage(deep=self.deep).sum())
+        if tamanho > self.max_bytes:
+            return
+        with self._lock:
+            if chave in self._itens:
+                self._bytes -= self._itens.pop(chave)[1]
+            self._itens[chave] = (df, tamanho)
+            self._bytes += tamanho
+            while self._bytes > self.max_bytes:
+                _, (_, liberado) = self._itens.popitem(last=False)
+                self._bytes -= liberado
+                self.evictions += 1
+
+    def discard(self, descartar):
+        """Remove as entradas cuja chave atende a `descartar(chave)`. Retorna quantas saíram."""
+        with self._lock:
+            chaves = [chave for chave in self._itens if descartar(chave)]
+            for chave in chaves:
+                self._bytes -= self._itens.pop(chave)[1]
+            return len(chaves)
+
+    def clear(self):
+        with self._lock:
+            self._itens.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                    "entradas": len(self._itens), "bytes": self._bytes, "max_bytes": self.max_bytes}
+
+class NormalizedFrameCache(FrameCache):
+    """
+    Bases normalizadas por arquivo. A chave é o conteúdo do arquivo (SHA-256) mais as versões
+    do formato e das tabelas de aliases: uma base só sai do cache por falta de espaço ou se a
+    normalização mudar.
+    O processo já mantém a base publicada compacta (e a versão anterior no store): para não
+    guardar outra cópia com uma string por linha, as colunas de texto ficam aqui como category
+    (uma string por valor distinto) e voltam a object na leitura. A saída de normalize_dataframe
+    não tem colunas category, e só entram colunas só de strings, sem vazios: a volta é exata.
+    """
+
+    def __init__(self, max_bytes=MEMORY_CACHE_MAX_BYTES):
+        super().__init__(max_bytes)
+
+    def _guardar(self, df):
+        textos = [col for col in df.columns if df[col].dtype == object
+                  and pd.api.types.infer_dtype(df[col], skipna=False) == "string"]
+        return df.astype({col: "category" for col in textos}) if textos else df
+
+    def _entregar(self, guardado):
+        categorias = [col for col in guardado.columns if isinstance(guardado[col].dtype, pd.CategoricalDtype)]
+        return guardado.astype({col: object for col in categorias}) if categorias else guardado
+
+    @staticmethod
+    def key(fingerprint):
+        return (fingerprint["sha256"], CACHE_VERSION, ALIAS_VERSION)
+
+class FilteredFrameCache(FrameCache):
+    """
+    Recortes da base pelos filtros globais. A chave é a versão publicada da base mais a
+    assinatura canônica da seleção (FilterIndex.signature): sessões e páginas com os mesmos
+    filtros reaproveitam o mesmo recorte, e uma nova versão da base nunca casa com as antigas.
+    """
+
+    # As strings de um recorte (iloc) são as mesmas da base: só os ponteiros ocupam memória nova
+    deep = False
+
+    def __init__(self, max_bytes=FILTER_CACHE_MAX_BYTES):
+        super().__init__(max_bytes)
+
+    @staticmethod
+    def key(version_id, assinatura):
+        return (version_id, assinatura)
+
+    def drop_versions_before(self, version_id):
+        """
+        Descarta os recortes das versões anteriores a `version_id` (as que saíram do store):
+        são fatias rasas da base antiga e, guardadas aqui, a manteriam inteira em memória.
+        """
+        return self.discard(lambda chave: chave[0] < version_id)
+
+# Uma instância de cada por processo (sessões e o watcher compartilham as mesmas bases)
+normalized_frames = NormalizedFrameCache()
+filtered_frames = FilteredFrameCache()
+
+# ==================== ESTRUTURAS DERIVADAS POR DATAFRAME ====================
+# Estruturas calculadas a partir de um DataFrame específico (tabela de períodos, cubo), guardadas
+# enquanto ele existir: chaveadas pelo id do objeto e descartadas quando ele é coletado, para não
+# segurar recortes vivos nem reaproveitar ids. A base publicada já chega com as suas (load_data_dir).
+_anexos = {}  # id(df) -> (weakref do df, {nome: estrutura})
+_anexos_lock = threading.Lock()
+
+def attach_to_frame(df, nome, valor):
+    """Guarda `valor` como a estrutura `nome` de `df`. Retorna o próprio valor."""
+    chave = id(df)
+    with _anexos_lock:
+        item = _anexos.get(chave)
+        if item is None or item[0]() is not df:
+            item = (weakref.ref(df, lambda _, c=chave: _anexos.pop(c, None)), {})
+            _anexos[chave] = item
+        item[1][nome] = valor
+    return valor
+
+def frame_attachment(df, nome):
+    """Estrutura `nome` guardada para `df`, ou None."""
+    item = _anexos.get(id(df))
+    if item is None or item[0]() is not df:
+        return None
+    return item[1].get(nome)
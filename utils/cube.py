@@ -0,0 +1,399 @@
+# utils/cube.py
+import threading
+import numpy as np
+import pandas as pd
+from .format import use_centavos, map_categories
+from .index import FilterIndex
+from .period import sort_by_period, period_slice, month_range_slice
+from .cache import attach_to_frame, frame_attachment
+
+# Grão do cubo: todas as métricas das páginas são somas sobre subconjuntos destas dimensões
+CUBE_DIMENSIONS = ["ano", "mes", "emissora", "executivo", "cliente"]
+# Atributos que dependem só do período (um valor por ano/mes): acompanham o grão sem mudá-lo
+CUBE_ATTRIBUTES = ["meslabel"]
+# Quantas consultas derivadas (ex.: pivôs anuais de utils/yoy.py) cada cubo guarda
+MAX_CONSULTAS = 64
+
+class Cube:
+    """
+    Cubo mensal pré-agregado da base: uma célula por (ano, mes, emissora, executivo, cliente)
+    presente, com as somas de faturamento (e faturamento_centavos), inserções e o nº de linhas
+    de origem. As colunas têm os mesmos nomes da base, e a presença de cliente é a própria célula:
+    clientes distintos de um agrupamento = clientes distintos entre as suas células.
+    As consultas (slice, group, pivot) custam em função do nº de células, não de transações.
+    As células ficam ordenadas por (ano, mes), então o recorte de período é uma fatia (utils/period.py).
+    O cubo da base publicada é compartilhado entre sessões: as estruturas montadas sob demanda
+    (índice, centavos, somas acumuladas, consultas) são criadas sob uma trava do próprio cubo.
+    """
+
+    def __init__(self, celulas):
+        self.celulas = celulas
+        self._indice = None
+        self._centavos = None
+        self._prefixos = None
+        self._consultas = {}
+        # Reentrante: uma consulta pode montar outra do mesmo cubo (ex.: pivô anual -> ClientSets)
+        self._lock = threading.RLock()
+
+    @classmethod
+    def from_frame(cls, df):
+        """Agrega as linhas de `df` (esquema canônico) no grão do cubo."""
+        chaves = [c for c in CUBE_DIMENSIONS + CUBE_ATTRIBUTES if c in df.columns]
+        medidas = {"linhas": ("ano", "size")}
+        for col in ("faturamento_centavos", "insercoes"):
+            if col in df.columns:
+                medidas[col] = (col, "sum")
+        if "faturamento_centavos" not in df.columns:
+            medidas["faturamento"] = ("faturamento", "sum")
+        celulas = df.groupby(chaves, observed=True, dropna=False).agg(**medidas).reset_index()
+        if "faturamento_centavos" in celulas.columns:
+            # Reais a partir da soma exata em centavos (a mesma conta de normalize_dataframe)
+            celulas["faturamento"] = celulas["faturamento_centavos"] / 100
+        return cls(sort_by_period(celulas))
+
+    def __len__(self):
+        return len(self.celulas)
+
+    @property
+    def empty(self):
+        return self.celulas.empty
+
+    def with_centavos(self):
+        """(cubo com faturamento em centavos inteiros, True) quando houver; senão (self, False). Ver use_centavos."""
+        with self._lock:
+            if self._centavos is None:
+                celulas, em_centavos = use_centavos(self.celulas)
+                self._centavos = (Cube(celulas), True) if em_centavos else (self, False)
+            return self._centavos
+
+    def prefix_sums(self):
+        """Somas acumuladas mês a mês do cubo (PrefixSums), montadas na primeira chamada e guardadas nele."""
+        with self._lock:
+            if self._prefixos is None:
+                self._prefixos = PrefixSums(self)
+            return self._prefixos
+
+    def client_sets(self, dim="emissora"):
+        """Bitsets de clientes por (valor de `dim`, mês) do cubo (ClientSets), montados na primeira chamada."""
+        return self.cached(("clientes", dim), lambda: ClientSets(self, dim))
+
+    def lifecycle(self, chaves=("cliente",), historico=None):
+        """
+        Ciclo de vida por cliente (ou por combinação das `chaves`, ex.: cliente x emissora) (ClientLifecycle).
+        `historico`: cubo de onde saem o primeiro e o último mês visto (history_of); padrão, o próprio cubo.
+        """
+        return self.cached(("ciclo", tuple(chaves), historico),
+                           lambda: ClientLifecycle(self, chaves, historico))
+
+    def cached(self, chave, calcular):
+        """
+        Resultado de `calcular()` guardado no cubo sob `chave`. O cubo acompanha a base publicada
+        ou o recorte dos filtros (cache por versão e assinatura), então a consulta vale enquanto ele existir.
+        """
+        with self._lock:
+            if chave not in self._consultas:
+                valor = calcular()
+                # Depois do cálculo: ele pode ter guardado consultas aninhadas no mesmo cubo
+                while len(self._consultas) >= MAX_CONSULTAS:
+                    self._consultas.pop(next(iter(self._consultas)))
+                self._consultas[chave] = valor
+            return self._consultas[chave]
+
+    def filter(self, selecao):
+        """Células que atendem à seleção dos filtros globais (mesmo formato de FilterIndex.select)."""
+        with self._lock:
+            if self._indice is None:
+                self._indice = FilterIndex(self.celulas)
+        return Cube(self.celulas.iloc[self._indice.select(selecao)])
+
+    def map(self, coluna, funcao):
+        """Cubo com os nomes de uma dimensão trocados por `funcao` (ver map_categories); nomes que coincidem somam juntos."""
+        celulas = self.celulas.copy(deep=False)
+        celulas[coluna] = map_categories(celulas[coluna], funcao)
+        return Cube(celulas)
+
+    def slice(self, mes_ini=1, mes_fim=12, ano=None, **filtros):
+        """
+        Sub-cubo do intervalo de meses (e do ano, se houver), fatiado pelo período.
+        `filtros` = {dimensão: valor ou lista de valores aceitos}.
+        """
+        celulas = period_slice(self.celulas, mes_ini, mes_fim, ano)
+        for col, valores in filtros.items():
+            if not isinstance(valores, (list, tuple, set)):
+                valores = [valores]
+            celulas = celulas[celulas[col].isin(valores)]
+        return Cube(celulas)
+
+    def windows(self, janelas):
+        """
+        Sub-cubo das janelas {rótulo: (início, fim)} de meses (ano, mes) consecutivos, que podem
+        atravessar anos, com o rótulo no lugar do ano: group/pivot por "ano" comparam as janelas.
+        """
+        partes = []
+        for rotulo, (inicio, fim) in janelas.items():
+            parte = month_range_slice(self.celulas, inicio, fim).copy(deep=False)
+            parte["ano"] = rotulo
+            partes.append(parte)
+        celulas = pd.concat(partes, ignore_index=True)
+        celulas["ano"] = pd.Categorical(celulas["ano"], categories=list(janelas))
+        return Cube(celulas)
+
+    def total(self, medida="faturamento"):
+        """Soma de uma medida no cubo todo; "clientes" = clientes distintos."""
+        if medida == "clientes":
+            return self.celulas["cliente"].nunique()
+        return self.celulas[medida].sum()
+
+    def group(self, by, medidas=("faturamento", "insercoes")):
+        """
+        Medidas somadas por `by` (dimensão ou lista), indexadas por `by` como no groupby.
+        "clientes" entre as medidas conta clientes distintos.
+        """
+        by = [by] if isinstance(by, str) else list(by)
+        grupos = self.celulas.groupby(by, observed=True)
+        somas = [m for m in medidas if m != "clientes"]
+        saida = grupos[somas].sum() if somas else pd.DataFrame(index=grupos.size().index)
+        if "clientes" in medidas:
+            saida["clientes"] = grupos["cliente"].nunique()
+        return saida[list(medidas)]
+
+    def pivot(self, index, columns="ano", medida="faturamento", fill_value=0):
+        """Medida por `index` (linhas) x `columns` (colunas), como groupby(...).sum().unstack()."""
+        index = [index] if isinstance(index, str) else list(index)
+        return self.group(index + [columns], [medida])[medida].unstack(fill_value=fill_value)
+
+class MonthAxis:
+    """
+    Eixo global de meses das células: do primeiro ao último mês presente, sem buracos, com a
+    posição de cada célula nele. Base das estruturas por mês (PrefixSums, ClientSets).
+    """
+
+    def __init__(self, celulas):
+        mes_global = celulas["ano"].to_numpy(dtype=np.int64) * 12 + celulas["mes"].to_numpy(dtype=np.int64) - 1
+        self.primeiro = int(mes_global.min()) if len(mes_global) else 0
+        self.n_meses = int(mes_global.max()) - self.primeiro + 1 if len(mes_global) else 0
+        # Meses do eixo, em ordem: (ano, mes)
+        self.meses = [(m // 12, m % 12 + 1) for m in range(self.primeiro, self.primeiro + self.n_meses)]
+        self.posicao = mes_global - self.primeiro
+
+    def _colunas(self, inicio, fim):
+        """Posições [a, b) do eixo para os meses de `inicio` a `fim`, inclusive, presas ao eixo."""
+        a = min(max(int(inicio[0]) * 12 + int(inicio[1]) - 1 - self.primeiro, 0), self.n_meses)
+        b = min(max(int(fim[0]) * 12 + int(fim[1]) - self.primeiro, a), self.n_meses)
+        return a, b
+
+class PrefixSums(MonthAxis):
+    """
+    Somas acumuladas do cubo ao longo do eixo global de meses (MonthAxis), no total e por
+    valor de emissora, executivo e cliente. O total de
+    qualquer intervalo de meses consecutivos, dentro de um ano ou atravessando anos, é uma
+    subtração de duas colunas (acumulado até o fim - acumulado antes do início), para todos os
+    valores da dimensão de uma vez, sem voltar às células.
+    Medidas: as do cubo (faturamento na unidade dele, centavos em with_centavos) e linhas.
+    """
+
+    DIMENSOES = ("emissora", "executivo", "cliente")
+    MEDIDAS = ("faturamento", "insercoes", "linhas")
+
+    def __init__(self, cubo):
+        celulas = cubo.celulas
+        super().__init__(celulas)
+        posicao = self.posicao
+        self.valores = {}      # dimensão -> Index dos valores (linhas das tabelas)
+        self.acumulados = {}   # (dimensão ou None = total, medida) -> array (valores, meses + 1)
+        for dim in (None,) + self.DIMENSOES:
+            if dim is None:
+                codigos, n = np.zeros(len(celulas), dtype=np.int64), 1
+            elif dim in celulas.columns:
+                codigos, unicos = pd.factorize(celulas[dim], sort=True)
+                self.valores[dim] = pd.Index(unicos, name=dim)
+                n = len(unicos)
+            else:
+                continue
+            validos = codigos >= 0
+            chave = codigos[validos] * self.n_meses + posicao[validos]
+            for medida in self.MEDIDAS:
+                if medida not in celulas.columns:
+                    continue
+                pesos = celulas[medida].to_numpy()
+                inteiro = np.issubdtype(pesos.dtype, np.integer)
+                somas = np.bincount(chave, weights=pesos[validos], minlength=n * self.n_meses)
+                if inteiro:
+                    # bincount soma em float64: exato para inteiros até 2**53 (centavos inclusive)
+                    somas = np.rint(somas).astype(np.int64)
+                acumulado = np.zeros((n, self.n_meses + 1), dtype=somas.dtype)
+                np.cumsum(somas.reshape(n, self.n_meses), axis=1, out=acumulado[:, 1:])
+                self.acumulados[(dim, medida)] = acumulado
+
+    def totals(self, dim, inicio, fim, medida="faturamento"):
+        """
+        Soma da medida entre os meses `inicio` e `fim` = (ano, mes), inclusive: Series por valor
+        da dimensão (zeros para quem não aparece no intervalo) ou, com dim=None, o total.
+        """
+        a, b = self._colunas(inicio, fim)
+        acumulado = self.acumulados[(dim, medida)]
+        somas = acumulado[:, b] - acumulado[:, a]
+        return somas[0] if dim is None else pd.Series(somas, index=self.valores[dim], name=medida)
+
+class ClientSets(MonthAxis):
+    """
+    Clientes presentes em cada (valor da dimensão, mês) do cubo, como bitset: 1 bit por cliente
+    (código em `clientes`), em palavras uint64, no eixo global de meses (MonthAxis). Clientes
+    distintos de qualquer combinação de células = OR dos bitsets + contagem de bits; novos,
+    perdidos e compartilhados entre dois recortes = b & ~a, a & ~b e a & b, sem voltar às células.
+    Células sem valor na dimensão ficam numa linha extra (entram nos totais, não por valor).
+    """
+
+    def __init__(self, cubo, dim="emissora"):
+        celulas = cubo.celulas
+        super().__init__(celulas)
+        codigos_cli, clientes = pd.factorize(celulas["cliente"], sort=True)
+        codigos_dim, valores = pd.factorize(celulas[dim], sort=True)
+        self.clientes = pd.Index(clientes, name="cliente")
+        self.valores = pd.Index(valores, name=dim)
+        self.palavras = (len(clientes) + 63) // 64
+        codigos_dim = np.where(codigos_dim >= 0, codigos_dim, len(valores))
+        validos = codigos_cli >= 0
+        cli = codigos_cli[validos].astype(np.uint64)
+        self.bits = np.zeros((len(valores) + 1, self.n_meses, self.palavras), dtype=np.uint64)
+        np.bitwise_or.at(self.bits, (codigos_dim[validos], self.posicao[validos], (cli >> np.uint64(6)).astype(np.int64)),
+                         np.left_shift(np.uint64(1), cli & np.uint64(63)))
+
+    def _mascara(self, periodos):
+        """Meses do eixo cobertos pelos intervalos [(início, fim), ...] de meses (ano, mes)."""
+        mascara = np.zeros(self.n_meses, dtype=bool)
+        for inicio, fim in periodos:
+            a, b = self._colunas(inicio, fim)
+            mascara[a:b] = True
+        return mascara
+
+    def by_value(self, periodos):
+        """Bitset dos clientes de cada valor da dimensão nos intervalos: array (valores, palavras)."""
+        selecao = self.bits[:len(self.valores), self._mascara(periodos)]
+        return np.bitwise_or.reduce(selecao, axis=1) if selecao.shape[1] \
+            else np.zeros((len(self.valores), self.palavras), dtype=np.uint64)
+
+    def union(self, periodos, valores=None):
+        """Bitset dos clientes presentes nos intervalos, nos valores da dimensão dados (None = todas as células)."""
+        linhas = np.arange(len(self.bits)) if valores is None else self.valores.get_indexer(list(valores))
+        selecao = self.bits[linhas[linhas >= 0]][:, self._mascara(periodos)].reshape(-1, self.palavras)
+        return np.bitwise_or.reduce(selecao, axis=0) if len(selecao) else np.zeros(self.palavras, dtype=np.uint64)
+
+    def counts(self, periodos):
+        """Clientes distintos por valor da dimensão nos intervalos (Series indexada pelos valores)."""
+        return pd.Series(np.bitwise_count(self.by_value(periodos)).sum(axis=1, dtype=np.int64),
+                         index=self.valores, name="clientes")
+
+    @staticmethod
+    def count(bits):
+        """Nº de clientes de um bitset."""
+        return int(np.bitwise_count(bits).sum())
+
+    def names(self, bits):
+        """Clientes de um bitset, na ordem dos códigos."""
+        presentes = np.unpackbits(bits.view(np.uint8), bitorder="little", count=len(self.clientes)).view(bool)
+        return self.clientes[presentes]
+
+class ClientLifecycle(MonthAxis):
+    """
+    Ciclo de vida de cada cliente (ou de cada combinação das `chaves`, ex.: cliente x emissora)
+    no eixo global de meses (MonthAxis): meses ativos (ao menos uma célula no mês), primeiro e
+    último mês visto. Perdidos, novos, reativados e retidos entre dois períodos quaisquer e a
+    linha do tempo de entradas e saídas saem dessas marcas, sem voltar às células.
+    O primeiro e o último mês visto vêm do cubo `historico` (padrão: o próprio cubo). Com o cubo da
+    base restrito só pelos filtros fora do período (history_of), eles não dependem do período
+    filtrado: quem veiculou antes dele é reativado, e não novo. Por isso são posições no eixo que
+    podem cair fora dele (negativas, ou além do último mês).
+    """
+
+    # Situações de classify, na ordem de exibição
+    SITUACOES = ["Retido", "Perdido", "Novo", "Reativado"]
+
+    def __init__(self, cubo, chaves=("cliente",), historico=None):
+        celulas = cubo.celulas
+        super().__init__(celulas)
+        grupos = celulas.groupby(list(chaves), sort=True, observed=True)
+        codigos = grupos.ngroup().fillna(-1).to_numpy(dtype=np.int64)
+        self.chaves = grupos.size().index
+        validos = codigos >= 0
+        self.ativos = np.zeros((len(self.chaves), self.n_meses), dtype=bool)
+        self.ativos[codigos[validos], self.posicao[validos]] = True
+        # Posições no eixo do primeiro e do último mês visto de cada chave no histórico, e do
+        # primeiro e do último mês do próprio histórico (bordas da linha do tempo)
+        hist = (cubo if historico is None else historico).celulas
+        eixo_hist = MonthAxis(hist)
+        limites = (pd.DataFrame({"posicao": eixo_hist.posicao + eixo_hist.primeiro - self.primeiro})
+                   .join(hist[list(chaves)].reset_index(drop=True))
+                   .groupby(list(chaves), observed=True)["posicao"].agg(["min", "max"])
+                   .reindex(self.chaves))
+        self.primeiro_visto = limites["min"].to_numpy(dtype=np.int64)
+        self.ultimo_visto = limites["max"].to_numpy(dtype=np.int64)
+        self.inicio_historico = eixo_hist.primeiro - self.primeiro
+        self.fim_historico = self.inicio_historico + eixo_hist.n_meses - 1
+
+    def active(self, periodo):
+        """Máscara das chaves com ao menos um mês ativo no período (início, fim)."""
+        a, b = self._colunas(*periodo)
+        return self.ativos[:, a:b].any(axis=1)
+
+    def classify(self, periodo_a, periodo_b):
+        """
+        Situação de cada chave ativa em ao menos um dos períodos, de A para B: "Retido" (nos dois),
+        "Perdido" (só em A), "Novo" (só em B, visto pela primeira vez em B) ou "Reativado" (só em B,
+        já visto antes do início de B). Series indexada pelas chaves, em ordem.
+        """
+        em_a, em_b = self.active(periodo_a), self.active(periodo_b)
+        inicio_b = self._colunas(*periodo_b)[0]
+        situacao = np.select([em_a & em_b, em_a, self.primeiro_visto >= inicio_b],
+                             self.SITUACOES[:3], self.SITUACOES[3])
+        presentes = em_a | em_b
+        return pd.Series(situacao[presentes], index=self.chaves[presentes], name="situacao")
+
+    def timeline(self):
+        """
+        Por mês do eixo (índice (ano, mes)): chaves ativas, entradas (primeiro mês visto) e saídas
+        (último mês visto). No primeiro mês do histórico ninguém conta como entrada (já podia estar
+        ativo antes dele) e no último ninguém conta como saída (ainda está ativo).
+        """
+        n = self.n_meses
+
+        def por_mes(posicoes, borda):
+            return np.bincount(posicoes[(posicoes >= 0) & (posicoes < n) & (posicoes != borda)], minlength=n)
+
+        return pd.DataFrame({"ativos": self.ativos.sum(axis=0),
+                             "entradas": por_mes(self.primeiro_visto, self.inicio_historico),
+                             "saidas": por_mes(self.ultimo_visto, self.fim_historico)},
+                            index=pd.MultiIndex.from_tuples(self.meses, names=["ano", "mes"]))
+
+def register_cube(df, cubo):
+    """Associa um cubo já calculado (da base publicada ou de um recorte dos filtros) ao DataFrame."""
+    return attach_to_frame(df, "cubo", cubo)
+
+def register_history(df, cubo_base, selecao, assinatura):
+    """
+    Associa a `df` (um recorte dos filtros globais) a origem do seu histórico: o cubo da base e a
+    seleção dos filtros fora do período, com a assinatura canônica dela (FilterIndex.signature).
+    """
+    return attach_to_frame(df, "historico", (cubo_base, selecao, assinatura))
+
+def history_of(df):
+    """
+    Cubo da base restrito só pelos filtros globais fora do período (ano e mês) que geraram `df`:
+    o histórico completo dos clientes do recorte, para o ciclo de vida. Guardado no cubo da base
+    pela assinatura da seleção. Sem origem registrada (base publicada, DataFrame avulso), o cubo de `df`.
+    """
+    origem = frame_attachment(df, "historico")
+    if origem is None:
+        return cube_of(df)
+    cubo_base, selecao, assinatura = origem
+    if not assinatura:
+        return cubo_base
+    return cubo_base.cached(("historico", assinatura), lambda: cubo_base.filter(selecao))
+
+def cube_of(df):
+    """
+    Cubo das linhas de `df`. A base publicada e os recortes dos filtros globais já chegam com o
+    seu (load_data_dir / filter_base); para qualquer outro DataFrame, agrega na primeira chamada.
+    """
+    cubo = frame_attachment(df, "cubo")
+    return cubo if cubo is not None else register_cube(df, Cube.from_frame(df))
@@ -1,54 +1,34 @@
 # utils/filters.py
 import streamlit as st
-import pandas as pd
 import json 
 from datetime import datetime 
+from .loaders import base_filter_options, base_filter_index, filter_base
+from .period import month_label, rolling_windows
+
+def _brl_abrev(val):
+    """R$ abreviado (mil / Mi) para caber nas tabelas de contagens dos filtros."""
+    sign = "-" if val < 0 else ""
+    val_abs = abs(val)
+    if val_abs >= 1_000_000: return f"{sign}R$ {val_abs/1_000_000:,.1f} Mi".replace(",", "X").replace(".", ",").replace("X", ".")
+    if val_abs >= 1_000: return f"{sign}R$ {val_abs/1_000:,.0f} mil".replace(",", "X").replace(".", ",").replace("X", ".")
+    return f"{sign}R$ {val_abs:,.0f}".replace(",", "X").replace(".", ",").replace("X", ".")
 
 def aplicar_filtros(df, cookies):
     """
     Aplica filtros interativos no TOPO da página (Main Area).
     """
 
-    # ==================== NORMALIZAÇÃO ====================
-    df.columns = df.columns.str.strip().str.lower()
-
-    if "mes" not in df.columns: 
-        possiveis = ["mês", "month", "mês referência", "mes_ref", "data", "date"]
-        for c in possiveis:
-            if c in df.columns:
-                if pd.api.types.is_datetime64_any_dtype(df[c]):
-                    df["mes"] = df[c].dt.month
-                else:
-                    df["mes"] = pd.to_numeric(df[c], errors="coerce")
-                break
-        else:
-            df["mes"] = 1
-
-    if "ano" not in df.columns:
-        possiveis_ano = ["ano_ref", "ano referência", "year", "data", "date"]
-        for c in possiveis_ano:
-            if c in df.columns:
-                if pd.api.types.is_datetime64_any_dtype(df[c]):
-                    df["ano"] = df[c].dt.year
-                else:
-                    df["ano"] = pd.to_numeric(df[c], errors="coerce")
-                break
-        else:
-            df["ano"] = 2024
-
-    for col in ["emissora", "executivo", "cliente"]:
-        if col not in df.columns:
-            df[col] = ""
-
-    df["ano"] = pd.to_numeric(df["ano"], errors="coerce").fillna(0).astype(int)
-    df["mes"] = pd.to_numeric(df["mes"], errors="coerce").fillna(0).astype(int)
-
+    # A base já chega no esquema canônico (utils/format.canonical_schema): colunas em minúsculas,
+    # ano/mes inteiros e emissora/cliente/executivo presentes. É compartilhada entre sessões
+    # (utils/store.py), então aqui só é lida, nunca alterada.
 
     # ==================== DADOS BASE PARA FILTROS ====================
-    anos_disponiveis = sorted(df["ano"].dropna().unique())
-    emisoras = sorted(df["emissora"].dropna().unique())
-    execs = sorted(df["executivo"].dropna().unique())
-    clientes = sorted(df["cliente"].dropna().unique())
+    # Listas calculadas uma vez por versão da base (meta["filtros"]), não a cada execução
+    opcoes = base_filter_options(df)["opcoes"]
+    anos_disponiveis = opcoes["ano"]
+    emisoras = opcoes["emissora"]
+    execs = opcoes["executivo"]
+    clientes = opcoes["cliente"]
     
     mes_map = {
         1: "Jan", 2: "Fev", 3: "Mar", 4: "Abr", 5: "Mai", 6: "Jun",
@@ -56,7 +36,7 @@ def aplicar_filtros(df, cookies):
     }
     mes_map_inverso = {v: k for k, v in mes_map.items()}
     
-    meses_disponiveis_num = sorted(df[df["mes"].between(1, 12)]["mes"].dropna().unique())
+    meses_disponiveis_num = opcoes["mes"]
     meses_disponiveis_nomes = [mes_map.get(m, m) for m in meses_disponiveis_num]
 
 
@@ -70,6 +50,20 @@ def aplicar_filtros(df, cookies):
         default_ini = 2024
         default_fim = 2025
     
+    # A base pode ter sido trocada em segundo plano (utils/watcher.py) ou os filtros vieram do cookie:
+    # descarta seleções que não existem na versão atual, senão os widgets rejeitam o valor salvo.
+    if st.session_state.get("filtro_base_version") != st.session_state.get("base_version"):
+        if st.session_state.get("filtro_ano_ini") not in anos_disponiveis:
+            st.session_state.pop("filtro_ano_ini", None)
+        if st.session_state.get("filtro_ano_fim") not in anos_disponiveis:
+            st.session_state.pop("filtro_ano_fim", None)
+        for chave, opcoes in [("filtro_emis", emisoras), ("filtro_execs", execs),
+                              ("filtro_clientes", clientes), ("filtro_meses_lista", meses_disponiveis_nomes)]:
+            if chave in st.session_state:
+                validos = set(opcoes)
+                st.session_state[chave] = [v for v in st.session_state[chave] if v in validos]
+        st.session_state["filtro_base_version"] = st.session_state.get("base_version")
+
     if "filtro_ano_ini" not in st.session_state:
         st.session_state["filtro_ano_ini"] = default_ini
     if "filtro_ano_fim" not in st.session_state:
@@ -111,6 +105,57 @@ def aplicar_filtros(df, cookies):
         meses_ytd_nomes = [mes_map.get(m) for m in meses_ytd_num if m in mes_map]
         st.session_state["filtro_meses_lista"] = meses_ytd_nomes
         
+    # ==================== FACETAS (CONTAGENS POR OPÇÃO) ====================
+    # Para cada opção: linhas, clientes e faturamento sob os DEMAIS filtros ativos, pelo índice da
+    # versão (FilterIndex.facets). Guardadas na sessão até a seleção ou a base mudarem.
+    # Vão no tooltip (help) de cada filtro, e não no rótulo das opções: o Streamlit inclui os rótulos
+    # formatados na identidade do widget, e rótulos que mudam a cada filtro zerariam as seleções.
+    def selecao_atual():
+        ano_1 = min(st.session_state["filtro_ano_ini"], st.session_state["filtro_ano_fim"])
+        ano_2 = max(st.session_state["filtro_ano_ini"], st.session_state["filtro_ano_fim"])
+        return {
+            "ano": list(range(ano_1, ano_2 + 1)),
+            "emissora": st.session_state["filtro_emis"],
+            "executivo": st.session_state["filtro_execs"],
+            "mes": [mes_map_inverso.get(m, -1) for m in st.session_state["filtro_meses_lista"]],
+            "cliente": st.session_state["filtro_clientes"] or None,
+        }
+
+    selecao = selecao_atual()
+    chave_facetas = (st.session_state.get("base_version"), base_filter_index(df).signature(selecao))
+    memo = st.session_state.get("filtro_facetas")
+    if memo is None or memo[0] != chave_facetas:
+        memo = (chave_facetas, base_filter_index(df).facets(selecao))
+        st.session_state["filtro_facetas"] = memo
+    facetas = memo[1]
+
+    def ajuda(col, opcoes_col, nomes=None, limite=None, texto=None):
+        """Tabela markdown (opção, linhas, clientes, faturamento) para o help do filtro."""
+        tabela = facetas.get(col)
+        if tabela is None:
+            return texto
+        tabela = tabela.reindex(opcoes_col).fillna(0)
+        if limite is not None and len(tabela) > limite:
+            # Muitas opções (clientes): as de maior faturamento mais as já selecionadas
+            selecionados = set(st.session_state["filtro_clientes"])
+            maiores = tabela.nlargest(limite, "faturamento")
+            tabela = tabela[tabela.index.isin(selecionados) | tabela.index.isin(maiores.index)]
+            tabela = tabela.sort_values("faturamento", ascending=False)
+        linhas = [texto, ""] if texto else []
+        com_clientes = col != "cliente"  # na própria dimensão cliente a contagem é sempre 1
+        linhas += ["Sob os demais filtros ativos:", ""]
+        linhas += (["| Opção | Linhas | Clientes | Faturamento |", "|---|---:|---:|---:|"] if com_clientes
+                   else ["| Opção | Linhas | Faturamento |", "|---|---:|---:|"])
+        for valor, (n_linhas, n_clientes, faturamento) in zip(tabela.index, tabela[["linhas", "clientes", "faturamento"]].to_numpy()):
+            nome = str(nomes.get(valor, valor) if nomes else valor).replace("|", "\\|")
+            n_linhas = f"{int(n_linhas):,}".replace(",", ".")
+            n_clientes = f"{int(n_clientes):,}".replace(",", ".")
+            colunas = [nome, n_linhas] + ([n_clientes] if com_clientes else []) + [_brl_abrev(faturamento)]
+            linhas.append("| " + " | ".join(colunas) + " |")
+        if limite is not None and len(opcoes_col) > limite:
+            linhas += ["", f"Maiores {limite} de {len(opcoes_col):,} clientes por faturamento.".replace(",", ".")]
+        return "\n".join(linhas)
+
     # ==================== WIDGETS NO TOPO (EXPANDER WIDE) ====================
     
     # ATUALIZAÇÃO: Título sem emoji
@@ -120,21 +165,23 @@ def aplicar_filtros(df, cookies):
         c1, c2, c3, c4 = st.columns([1, 1, 2, 2])
         
         with c1:
-            st.selectbox("Ano De:", anos_disponiveis, key="filtro_ano_ini")
+            st.selectbox("Ano De:", anos_disponiveis, key="filtro_ano_ini", help=ajuda("ano", anos_disponiveis))
         with c2:
-            st.selectbox("Ano Até:", anos_disponiveis, key="filtro_ano_fim")
+            st.selectbox("Ano Até:", anos_disponiveis, key="filtro_ano_fim", help=ajuda("ano", anos_disponiveis))
         with c3:
-            st.multiselect("Emissoras:", emisoras, key="filtro_emis")
+            st.multiselect("Emissoras:", emisoras, key="filtro_emis", help=ajuda("emissora", emisoras))
         with c4:
-            st.multiselect("Executivos:", execs, key="filtro_execs")
+            st.multiselect("Executivos:", execs, key="filtro_execs", help=ajuda("executivo", execs))
 
         # --- LINHA 2: MESES E CLIENTES ---
         c5, c6 = st.columns([2, 4])
         
         with c5:
-            st.multiselect("Meses:", meses_disponiveis_nomes, key="filtro_meses_lista")
+            st.multiselect("Meses:", meses_disponiveis_nomes, key="filtro_meses_lista",
+                           help=ajuda("mes", meses_disponiveis_num, nomes=mes_map))
         with c6:
-            st.multiselect("Clientes:", clientes, key="filtro_clientes", help="Digite para buscar clientes específicos")
+            st.multiselect("Clientes:", clientes, key="filtro_clientes",
+                           help=ajuda("cliente", clientes, limite=15, texto="Digite para buscar clientes específicos"))
 
         st.markdown("---")
 
@@ -164,34 +211,23 @@ def aplicar_filtros(df, cookies):
 
 
     # ==================== APLICA FILTROS (BACKEND) ====================
-    ano_ini_sel = st.session_state["filtro_ano_ini"]
-    ano_fim_sel = st.session_state["filtro_ano_fim"]
-    
-    ano_1 = min(ano_ini_sel, ano_fim_sel)
-    ano_2 = max(ano_ini_sel, ano_fim_sel)
-    anos_sel = list(range(ano_1, ano_2 + 1)) 
+    selecao = selecao_atual()
+    anos_sel = selecao["ano"]
     
     emis_sel = st.session_state["filtro_emis"]
     exec_sel = st.session_state["filtro_execs"]
     cli_sel = st.session_state["filtro_clientes"]
     
-    meses_sel_nomes = st.session_state["filtro_meses_lista"]
-    meses_sel_num = [mes_map_inverso.get(m, -1) for m in meses_sel_nomes]
+    meses_sel_num = selecao["mes"]
     
     mes_ini = min(meses_sel_num) if meses_sel_num else 1
     mes_fim = max(meses_sel_num) if meses_sel_num else 12
     
     show_labels = st.session_state["filtro_show_labels"]
     
-    df_filtrado = df[
-        (df["ano"].between(ano_1, ano_2)) &
-        (df["emissora"].isin(emis_sel)) &
-        (df["executivo"].isin(exec_sel)) &
-        (df["mes"].isin(meses_sel_num))
-    ]
-
-    if cli_sel:
-        df_filtrado = df_filtrado[df_filtrado["cliente"].isin(cli_sel)]
+    # OR dentro de cada dimensão e AND entre elas, sobre os bitsets do índice da versão (utils/index.py);
+    # recortes já calculados para a mesma versão e assinatura vêm do LRU compartilhado (filter_base)
+    df_filtrado = filter_base(df, selecao)
     
     # Salva os filtros no Cookie (silencioso)
     try:
@@ -209,4 +245,43 @@ def aplicar_filtros(df, cookies):
     except Exception:
         pass
 
-    return df_filtrado, anos_sel, emis_sel, exec_sel, cli_sel, mes_ini, mes_fim, show_labels
\ No newline at end of file
+    return df_filtrado, anos_sel, emis_sel, exec_sel, cli_sel, mes_ini, mes_fim, show_labels
+
+
+# ==================== PAR DE ANOS (PÁGINAS) ====================
+def year_pair_controls(anos, chave):
+    """
+    Seletores do par de anos comparado numa página: ano base e ano de comparação (padrão: os
+    dois últimos anos presentes). Retorna (ano_base, ano_comp); com um único ano, os dois são ele,
+    e sem nenhum ano retorna (None, None).
+    """
+    anos = [int(a) for a in anos]
+    if not anos:
+        return None, None
+    if len(anos) < 2:
+        return anos[-1], anos[-1]
+    c1, c2, _ = st.columns([1, 1, 3])
+    ano_base = c1.selectbox("Ano base:", anos, index=len(anos) - 2, key=f"{chave}_ano_base")
+    ano_comp = c2.selectbox("Comparar com:", anos, index=len(anos) - 1, key=f"{chave}_ano_comp")
+    return ano_base, ano_comp
+
+# ==================== JANELA MÓVEL (PÁGINAS) ====================
+MODO_MESES_FILTRO = "Meses do filtro"
+JANELAS_MOVEIS = {"Últimos 3 meses": 3, "Últimos 6 meses": 6, "Últimos 12 meses": 12, "YTD vs YTD anterior": "ytd"}
+
+def rolling_window_controls(prefixos, chave):
+    """
+    Modo de período de uma página: os meses do filtro global (padrão, retorna None) ou uma janela
+    móvel que termina no mês de referência, comparada à mesma janela um ano antes.
+    `prefixos` = PrefixSums do cubo da página (eixo de meses); `chave` separa os widgets por página.
+    Retorna {rótulo: (início, fim)} das duas janelas, a anterior primeiro (ver rolling_windows).
+    """
+    c1, c2 = st.columns([3, 2])
+    modo = c1.radio("Período:", [MODO_MESES_FILTRO] + list(JANELAS_MOVEIS), horizontal=True,
+                    key=f"{chave}_janela_modo")
+    if modo == MODO_MESES_FILTRO or not prefixos.meses:
+        return None
+    rotulos = [month_label(*m) for m in prefixos.meses]
+    referencia = c2.select_slider("Mês de referência:", options=rotulos, value=rotulos[-1],
+                                  key=f"{chave}_janela_ref")
+    return rolling_windows(JANELAS_MOVEIS[modo], prefixos.meses[rotulos.index(referencia)])
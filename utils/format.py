@@ -1,8 +1,10 @@
 # utils/format.py
+import os
+import hashlib
 import pandas as pd
 import re
-import streamlit as st
 import numpy as np
+import pyarrow as pa
 
 PALETTE = ["#007dc3", "#00a8e0", "#7ad1e6", "#004b8d", "#0095d9"]
 
@@ -22,10 +24,50 @@ COLUMN_ALIASES = {
     "inserções": "Insercoes", "insercoes": "Insercoes", "inserts": "Insercoes", "qtd": "Insercoes"
 }
 
-def brl(valor):
-    """Formata número para Real (R$)."""
+# Colunas produzidas por normalize_dataframe (demais colunas da planilha passam adiante sem tratamento)
+NORMALIZED_COLUMNS = ["data_ref", "Emissora", "Cliente", "Executivo", "Faturamento", "Faturamento_Centavos",
+                      "Insercoes", "Ano", "Mes", "MesLabel", "Custo_Unitario"]
+
+# Colunas sempre presentes na base publicada (esquema canônico, nomes em minúsculas)
+CANONICAL_COLUMNS = ["data_ref", "emissora", "cliente", "executivo", "faturamento", "insercoes",
+                     "ano", "mes", "meslabel", "custo_unitario"]
+
+# Dimensões da base publicada (viram category)
+DIMENSION_COLUMNS = ["emissora", "cliente", "executivo", "meslabel"]
+
+# Colunas com lista de opções nos filtros globais (utils/filters.py)
+FILTER_COLUMNS = ["ano", "mes", "emissora", "executivo", "cliente"]
+
+def alias_for(col):
+    """Nome padronizado de uma coluna da planilha, ou None se ela não estiver em COLUMN_ALIASES."""
+    return COLUMN_ALIASES.get(str(col).strip().lower())
+
+def is_sales_header(columns):
+    """Indica se um cabeçalho tem o mínimo para virar base: coluna de data ou o par Ano/Mês."""
+    nomes = {alias_for(c) or str(c) for c in columns}
+    return "data_ref" in nomes or {"Ano", "Mês"} <= nomes
+
+def project_columns(columns):
+    """
+    Posições das colunas da planilha que a normalização usa: as que têm alias conhecido
+    e o par Ano/Mês (fallback de data). As demais nem chegam a ser lidas.
+    """
+    return [i for i, c in enumerate(columns) if alias_for(c) or str(c) in ("Ano", "Mês")]
+
+def brl(valor, centavos=False):
+    """
+    Formata número para Real (R$). Com centavos=True o valor está em centavos: inteiros
+    (somas de faturamento_centavos) são formatados sem passar por float; frações (médias,
+    custo unitário) são divididas por 100 só aqui.
+    """
     try:
         if pd.isna(valor): return "—"
+        if centavos:
+            if isinstance(valor, (int, np.integer)):
+                inteiro, resto = divmod(abs(int(valor)), 100)
+                sinal = "-" if valor < 0 else ""
+                return f"R$ {sinal}{inteiro:,}.{resto:02d}".replace(",", "X").replace(".", ",").replace("X", ".")
+            valor = float(valor) / 100
         return f"R$ {float(valor):,.2f}".replace(",", "X").replace(".", ",").replace("X", ".")
     except Exception: return str(valor)
 
@@ -45,6 +87,83 @@ def parse_currency_br(valor):
     except Exception:
         return 0.0
 
+# Valor já limpo ("-1234.5", "12.", ".5") que pode ir direto para a conversão numérica em lote
+RE_NUMERO_SIMPLES = r"^-?(?:[0-9]+(?:\.[0-9]*)?|\.[0-9]+)$"
+
+# Mesmo conjunto de espaços que str.strip() remove (o strip do Arrow usa outra definição)
+ESPACOS = "".join(ch for ch in map(chr, range(0x3001)) if ch.isspace())
+
+def parse_currency_series(valores):
+    """
+    Versão vetorizada de parse_currency_br para uma coluna inteira (mesmo resultado, valor a valor).
+    Coluna já numérica (inteira ou float64): só troca NaN por 0.0. Texto: a limpeza (R$, espaços,
+    parênteses, troca de ./,) roda nos kernels de string do Arrow sobre os valores distintos;
+    o que não vira número simples (ex.: "1e3", "nan", lixo) passa pela função escalar.
+    """
+    valores = pd.Series(valores)
+    if valores.dtype.kind in "iu" or valores.dtype == "float64":
+        return valores.astype("float64").fillna(0.0)
+
+    codigos, unicos = pd.factorize(valores)
+    unicos = pd.Series(unicos, dtype=object)
+    resultado = np.zeros(len(unicos), dtype="float64")
+
+    # Números soltos numa coluna de texto (células numéricas do Excel) seguem o caminho do float()
+    if pd.api.types.infer_dtype(unicos, skipna=True) in ("string", "empty"):
+        e_numero = np.zeros(len(unicos), dtype=bool)
+    else:
+        e_numero = unicos.map(type).isin([float, int, bool, np.float64]).to_numpy()
+        resultado[e_numero] = unicos[e_numero].astype("float64").to_numpy()
+
+    outros = unicos[~e_numero]
+    limpo = (outros.astype(str).astype("string[pyarrow]").str.strip(ESPACOS)
+             .str.replace("R\\$|[ \u00a0]", "", regex=True))
+    negativo = (limpo.str.startswith("-") | limpo.str.startswith("(")).to_numpy(dtype=bool)
+    limpo = limpo.str.replace(r"[()]|\.", "", regex=True).str.replace(",", ".", regex=False)
+
+    simples = limpo.str.match(RE_NUMERO_SIMPLES).to_numpy(dtype=bool)
+    convertidos = np.empty(len(limpo), dtype="float64")
+    try:
+        convertidos[simples] = limpo[simples].astype("float64").to_numpy()
+    except (ValueError, TypeError, pa.ArrowInvalid):
+        simples[:] = False
+    convertidos = np.where(negativo & simples & (convertidos > 0), -convertidos, convertidos)
+    convertidos[~simples] = outros[~simples].map(parse_currency_br).to_numpy(dtype="float64")
+    resultado[~e_numero] = convertidos
+
+    saida = resultado[codigos] if len(resultado) else np.zeros(len(codigos))
+    saida[codigos < 0] = 0.0
+    return pd.Series(saida, index=valores.index, name=valores.name)
+
+# ==================== CENTAVOS ====================
+# Faturamento também é guardado em centavos inteiros (int64): somas de inteiros são exatas e
+# não dependem da ordem, então o mesmo recorte dá o mesmo total em qualquer página.
+# FATURAMENTO_CENTAVOS=0 no ambiente publica a base só com a coluna em reais (float).
+FATURAMENTO_CENTAVOS = os.environ.get("FATURAMENTO_CENTAVOS", "1") != "0"
+
+def to_centavos(valores):
+    """Valores em reais (float) para centavos int64, arredondando ao centavo mais próximo."""
+    valores = pd.Series(valores)
+    centavos = np.rint(valores.to_numpy(dtype="float64") * 100).astype("int64")
+    return pd.Series(centavos, index=valores.index, name=valores.name)
+
+def to_reais(valores, centavos=True):
+    """Converte para reais o que foi somado em centavos (para gráficos e exportação)."""
+    return valores / 100 if centavos else valores
+
+def use_centavos(df):
+    """
+    Visão da base (cópia rasa, a base compartilhada não é alterada) em que a coluna faturamento
+    traz os centavos de faturamento_centavos, quando a base publicada os tiver.
+    Retorna (df, em_centavos); com em_centavos=True a formatação usa brl(..., centavos=True)
+    e exportações usam to_reais.
+    """
+    if "faturamento_centavos" not in df.columns:
+        return df, False
+    df = df.copy(deep=False)
+    df["faturamento"] = df["faturamento_centavos"]
+    return df, True
+
 def normalize_text(texto):
     """Normaliza nomes para Título (Primeira Letra Maiúscula) mantendo siglas."""
     if pd.isna(texto): return ""
@@ -54,25 +173,214 @@ def normalize_text(texto):
         return texto
     return " ".join(p.capitalize() for p in texto.split())
 
+# Regras de consolidação de executivos, testadas em ordem (a primeira que casar vale).
+# Trecho procurado no nome em maiúsculas -> nome final (None = remove, vira "N/A").
+EXECUTIVE_RULES = [
+    # REGRA ATUALIZADA: Vendas Externas são removidas e viram N/A
+    ("VENDA EXTERNA", None),
+    # Regras de Aglomeração
+    ("EDUARDO", "Eduardo Notomi"),
+    ("JULIA", "Julia Bergo"),
+    ("OLGA", "Olga Luiza"),
+    ("WALNER", "Walner Francisco"),
+]
+
+# Versão das tabelas de normalização (COLUMN_ALIASES e EXECUTIVE_RULES): muda sozinha quando
+# alguma delas é editada e invalida as bases normalizadas em cache (disco e memória).
+ALIAS_VERSION = hashlib.sha256(repr((sorted(COLUMN_ALIASES.items()), EXECUTIVE_RULES)).encode()).hexdigest()[:12]
+
 def consolidate_executives(name):
     """
-    Padroniza nomes de executivos e filtra Vendas Externas.
+    Padroniza nomes de executivos e filtra Vendas Externas (regras em EXECUTIVE_RULES).
     """
     if not isinstance(name, str): return name
     name_upper = name.upper()
-    
-    # REGRA ATUALIZADA: Vendas Externas são removidas e viram N/A
-    if "VENDA EXTERNA" in name_upper: return None 
-
-    # Regras de Aglomeração
-    if "EDUARDO" in name_upper: return "Eduardo Notomi"
-    if "JULIA" in name_upper: return "Julia Bergo"
-    if "OLGA" in name_upper: return "Olga Luiza"
-    if "WALNER" in name_upper: return "Walner Francisco"
-    
+    for trecho, destino in EXECUTIVE_RULES:
+        if trecho in name_upper:
+            return destino
     return name
 
-@st.cache_data(ttl=600)
+def _executivo_final(valor):
+    """Normalização completa de um executivo: texto, consolidação e vazios/removidos -> "N/A"."""
+    nome = consolidate_executives(normalize_text(valor))
+    if nome is None or nome in ("", "nan", "None"):
+        return "N/A"
+    return nome
+
+def map_unique(serie, func):
+    """
+    Aplica `func` uma vez por valor distinto da coluna e devolve o resultado linha a linha.
+    Colunas como Cliente/Emissora têm poucos milhares de valores para centenas de milhares de linhas.
+    Valores que não são texto entram como str (5 e 5.0 são iguais para o factorize, mas não para
+    normalize_text), então `func` deve tratar um valor e seu str() da mesma forma.
+    """
+    if pd.api.types.infer_dtype(serie, skipna=True) not in ("string", "empty"):
+        serie = serie.where(serie.isna(), serie.astype(str))
+    codigos, unicos = pd.factorize(serie, use_na_sentinel=False)
+    mapeados = np.array([func(v) for v in unicos], dtype=object)
+    return pd.Series(mapeados[codigos], index=serie.index, name=serie.name, dtype=object)
+
+def map_categories(serie, func):
+    """
+    Como map_unique, para colunas category da base publicada: `func` roda uma vez por categoria
+    e a coluna é remontada pelos códigos, sem passar por objetos Python linha a linha.
+    Categorias que passam a ter o mesmo nome são unidas.
+    """
+    if not isinstance(serie.dtype, pd.CategoricalDtype):
+        return map_unique(serie, func).astype("category")
+    novos = [func(c) for c in serie.cat.categories]
+    categorias = pd.Index(sorted(set(novos)))
+    de_para = categorias.get_indexer(novos)
+    codigos = serie.cat.codes.to_numpy()
+    codigos = np.where(codigos >= 0, de_para[codigos], -1)
+    return pd.Series(pd.Categorical.from_codes(codigos, categorias), index=serie.index, name=serie.name)
+
+def canonical_schema(df):
+    """
+    Esquema canônico da base publicada, aplicado uma única vez na carga: nomes de colunas em
+    minúsculas e sem espaços nas pontas, e presença garantida de CANONICAL_COLUMNS
+    (emissora/cliente/executivo vazios e insercoes = 0 quando a planilha não as tiver).
+    Filtros e páginas consomem a base assim, sem renomear, copiar ou reconverter ano/mes.
+    """
+    df = df.copy(deep=False)
+    df.columns = [str(c).strip().lower() for c in df.columns]
+    df = df.loc[:, ~df.columns.duplicated()]
+    for col in ["emissora", "cliente", "executivo"]:
+        if col not in df.columns:
+            df[col] = ""
+    if "insercoes" not in df.columns:
+        df["insercoes"] = 0.0
+    for col in ["ano", "mes"]:
+        if not pd.api.types.is_integer_dtype(df[col]):
+            df[col] = pd.to_numeric(df[col], errors="coerce").fillna(0).astype(int)
+    return df
+
+def compact_dataframe(df):
+    """
+    Esquema compacto da base publicada (já no esquema canônico):
+    - dimensões (DIMENSION_COLUMNS) como category, com categorias em ordem alfabética
+      (os códigos inteiros seguem essa ordem e são estáveis dentro de uma versão da base);
+    - ano/mes como int16/int8;
+    - insercoes como int32 quando não há vazios nem frações (senão continua float64).
+    faturamento e custo_unitario ficam em float64 (valores monetários); faturamento_centavos
+    (int64) só é publicada com FATURAMENTO_CENTAVOS ligado.
+    Retorna (df, dimensoes), com dimensoes = {coluna: DataFrame(codigo, coluna)}.
+    """
+    df = df.copy(deep=False)
+    if not FATURAMENTO_CENTAVOS and "faturamento_centavos" in df.columns:
+        df = df.drop(columns="faturamento_centavos")
+    dimensoes = {}
+    for col in DIMENSION_COLUMNS:
+        if col in df.columns:
+            df[col] = df[col].astype(pd.CategoricalDtype(sorted(df[col].dropna().unique())))
+            categorias = df[col].cat.categories
+            dimensoes[col] = pd.DataFrame({"codigo": np.arange(len(categorias), dtype="int32"), col: categorias})
+
+    for col, tipo in [("ano", "int16"), ("mes", "int8")]:
+        if col in df.columns and pd.api.types.is_integer_dtype(df[col]):
+            df[col] = df[col].astype(tipo)
+
+    if "insercoes" in df.columns and df["insercoes"].notna().all():
+        ins = df["insercoes"].to_numpy()
+        if len(ins) and (ins == np.round(ins)).all() and np.abs(ins).max() < 2**31:
+            df["insercoes"] = df["insercoes"].astype("int32")
+    return df, dimensoes
+
+def build_filter_options(df):
+    """
+    Opções dos filtros globais, calculadas uma vez por versão da base (meta["filtros"]):
+    - "opcoes": {coluna: valores distintos ordenados} (mes só de 1 a 12);
+    - "contagens": {coluna: DataFrame indexado pelo valor com linhas e faturamento (R$)}.
+    O faturamento por opção sai de faturamento_centavos quando a base o tiver.
+    """
+    if "faturamento_centavos" in df.columns:
+        valores, escala = df["faturamento_centavos"].to_numpy(dtype="float64"), 100
+    else:
+        valores, escala = df["faturamento"].fillna(0).to_numpy(dtype="float64"), 1
+
+    opcoes, contagens = {}, {}
+    for col in FILTER_COLUMNS:
+        codigos, unicos = pd.factorize(df[col], sort=True)
+        ok = codigos >= 0
+        tabela = pd.DataFrame({
+            "linhas": np.bincount(codigos[ok], minlength=len(unicos)),
+            "faturamento": np.bincount(codigos[ok], weights=valores[ok], minlength=len(unicos)) / escala,
+        }, index=pd.Index(np.asarray(unicos), name=col))
+        if col == "mes":
+            tabela = tabela[(tabela.index >= 1) & (tabela.index <= 12)]
+        opcoes[col] = tabela.index.tolist()
+        contagens[col] = tabela
+    return {"opcoes": opcoes, "contagens": contagens}
+
+# ==================== DATAS ====================
+RE_DATA_ISO = r"^\d{4}-\d{2}-\d{2}$"
+RE_DATA_ISO_HORA = r"^\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}$"
+RE_DATA_BR = r"^\d{1,2}/\d{1,2}/\d{2,4}$"
+RE_DATA_BR_ANO4 = r"^\d{1,2}/\d{1,2}/\d{4}$"
+RE_MES_ANO = r"^\d{1,2}/\d{4}$"
+
+def _parse_date_scalar(val):
+    """Interpretação de uma data isolada (referência para parse_dates_br e fallback dos casos ambíguos)."""
+    if not isinstance(val, str): return pd.to_datetime(val, errors="coerce")
+    if re.match(RE_DATA_ISO, val): return pd.to_datetime(val, format="%Y-%m-%d", errors="coerce")
+    if re.match(RE_DATA_BR, val): return pd.to_datetime(val, dayfirst=True, errors="coerce")
+    if re.match(RE_MES_ANO, val): return pd.to_datetime("01/" + val, dayfirst=True, errors="coerce")
+    if val.replace(".", "").isdigit() and len(val) >= 4:
+        try: return pd.to_datetime(float(val), unit="D", origin="1899-12-30")
+        except: pass
+    return pd.to_datetime(val, errors="coerce")
+
+def parse_dates_br(textos):
+    """
+    Versão vetorizada de _parse_date_scalar para uma coluna de textos (mesmo resultado).
+    Trabalha sobre os valores distintos: cada um é classificado por formato (ISO, ISO com hora,
+    dd/mm/aaaa, mm/aaaa, serial do Excel, outros) e cada grupo é convertido num único to_datetime
+    com formato explícito. Valores que um formato explícito não resolve (ex.: 12/25/2024, que o
+    dayfirst do dateutil inverte) e o grupo "outros" passam pela função escalar.
+    """
+    codigos, unicos = pd.factorize(textos, use_na_sentinel=False)
+    unicos = pd.Series(unicos, dtype=object)
+    resultado = pd.Series(pd.NaT, index=unicos.index, dtype="datetime64[ns]")
+    pendente = pd.Series(True, index=unicos.index)
+
+    def converter(mascara, valores, **kwargs):
+        datas = pd.to_datetime(valores, errors="coerce", **kwargs)
+        ok = pd.notna(datas)
+        indices = mascara[mascara].index[ok]
+        resultado.loc[indices] = np.asarray(datas)[ok]
+        pendente.loc[indices] = False
+
+    e_texto = unicos.map(type) == str
+    iso = e_texto & unicos.str.match(RE_DATA_ISO, na=False)
+    converter(iso, unicos[iso], format="%Y-%m-%d")
+
+    br = e_texto & ~iso & unicos.str.match(RE_DATA_BR, na=False)
+    br4 = br & unicos.str.match(RE_DATA_BR_ANO4, na=False)
+    converter(br4, unicos[br4], format="%d/%m/%Y")
+
+    mes_ano = e_texto & ~iso & ~br & unicos.str.match(RE_MES_ANO, na=False)
+    converter(mes_ano, "01/" + unicos[mes_ano], format="%d/%m/%Y")
+
+    serial = (e_texto & ~iso & ~br & ~mes_ano
+              & unicos.str.replace(".", "", regex=False).str.isdigit().eq(True)
+              & (unicos.str.len() >= 4))
+    converter(serial, pd.to_numeric(unicos[serial], errors="coerce").to_numpy(), unit="D", origin="1899-12-30")
+
+    # Datas vindas do Excel chegam como "aaaa-mm-dd hh:mm:ss" e cairiam no caso genérico
+    iso_hora = e_texto & ~iso & ~br & ~mes_ano & ~serial & unicos.str.match(RE_DATA_ISO_HORA, na=False)
+    converter(iso_hora, unicos[iso_hora], format="%Y-%m-%d %H:%M:%S")
+
+    # Casos restantes (e os que o formato explícito não resolveu): regra original, valor a valor
+    restantes = unicos[pendente]
+    if len(restantes):
+        avulsos = restantes.map(_parse_date_scalar)
+        if not all(v is pd.NaT or (isinstance(v, pd.Timestamp) and v.tz is None) for v in avulsos):
+            # Fuso horário ou tipos inesperados: mantém exatamente o comportamento do apply
+            return pd.Series(textos).map(_parse_date_scalar)
+        resultado.loc[avulsos.index] = pd.to_datetime(avulsos.to_numpy(dtype=object))
+
+    return pd.Series(resultado.to_numpy()[codigos], index=getattr(textos, "index", None), name=getattr(textos, "name", None))
+
 def normalize_dataframe(df_raw: pd.DataFrame) -> pd.DataFrame:
     """Normaliza estrutura de planilhas de vendas (Novabrasil) com alias robustos."""
     df = df_raw.copy()
@@ -94,31 +402,19 @@ def normalize_dataframe(df_raw: pd.DataFrame) -> pd.DataFrame:
         if col not in df.columns:
             df[col] = "" 
 
-    # 3. Normaliza Textos (Capitalização)
-    for col in ["Emissora", "Cliente", "Executivo"]:
-        df[col] = df[col].apply(normalize_text)
+    # 3. Normaliza Textos (Capitalização), uma vez por valor distinto
+    for col in ["Emissora", "Cliente"]:
+        df[col] = map_unique(df[col], normalize_text)
 
     # 4. Consolidação de Executivos (Aglomeração e Filtro)
-    df["Executivo"] = df["Executivo"].apply(consolidate_executives)
-    
-    # Substitui vazios e None (incluindo as Vendas Externas removidas) por "N/A"
-    df["Executivo"] = df["Executivo"].replace(["", "nan", "None"], np.nan).fillna("N/A")
+    # Vazios e None (incluindo as Vendas Externas removidas) viram "N/A"
+    df["Executivo"] = map_unique(df["Executivo"], _executivo_final)
 
     # 5. Detecção e Conversão de Datas
     if "data_ref" in df.columns:
         df["data_ref"] = df["data_ref"].astype(str).str.strip().str.replace("'", "", regex=False)
         
-        def try_parse_date(val):
-            if not isinstance(val, str): return pd.to_datetime(val, errors="coerce")
-            if re.match(r"^\d{4}-\d{2}-\d{2}$", val): return pd.to_datetime(val, format="%Y-%m-%d", errors="coerce")
-            if re.match(r"^\d{1,2}/\d{1,2}/\d{2,4}$", val): return pd.to_datetime(val, dayfirst=True, errors="coerce")
-            if re.match(r"^\d{1,2}/\d{4}$", val): return pd.to_datetime("01/" + val, dayfirst=True, errors="coerce")
-            if val.replace(".", "").isdigit() and len(val) >= 4:
-                try: return pd.to_datetime(float(val), unit="D", origin="1899-12-30")
-                except: pass
-            return pd.to_datetime(val, errors="coerce")
-
-        df["data_ref"] = df["data_ref"].apply(try_parse_date)
+        df["data_ref"] = parse_dates_br(df["data_ref"])
 
     elif "Ano" in df.columns and "Mês" in df.columns:
         df["data_ref"] = pd.to_datetime(dict(year=df["Ano"], month=df["Mês"], day=1), errors="coerce")
@@ -133,8 +429,10 @@ def normalize_dataframe(df_raw: pd.DataFrame) -> pd.DataFrame:
     df["Mes"] = df["data_ref"].dt.month
     df["MesLabel"] = df["data_ref"].dt.strftime("%b/%y")
 
-    # 7. Faturamento
-    df["Faturamento"] = df["Faturamento"].apply(parse_currency_br)
+    # 7. Faturamento em reais como lido (caminho float, igual com ou sem centavos) e em centavos
+    # inteiros, arredondado só nessa coluna (a usada nas somas com FATURAMENTO_CENTAVOS)
+    df["Faturamento"] = parse_currency_series(df["Faturamento"])
+    df["Faturamento_Centavos"] = to_centavos(df["Faturamento"])
 
     # 8. Tratamento de Inserções e Custo Unitário
     if "Insercoes" in df.columns:
@@ -0,0 +1,188 @@
+# utils/index.py
+import numpy as np
+import pandas as pd
+
+from .format import FILTER_COLUMNS
+
+# Até quantos valores distintos uma dimensão usa bitmaps (1 bit por linha por valor).
+# Acima disso, listas de posições (4 bytes por linha, qualquer que seja o número de valores)
+# ocupam menos memória: é o caso de cliente.
+MAX_VALORES_BITMAP = 32
+
+def _pack(mascara, palavras):
+    """Máscara booleana -> bitset em palavras uint64 (bit i = linha i)."""
+    bits = np.packbits(mascara, bitorder="little")
+    saida = np.zeros(palavras * 8, dtype=np.uint8)
+    saida[:len(bits)] = bits
+    return saida.view(np.uint64)
+
+class FilterIndex:
+    """
+    Índice invertido da base publicada para os filtros globais, montado uma vez por versão.
+    Para cada dimensão (FILTER_COLUMNS), cada valor aponta para as linhas em que aparece:
+    - poucas opções (ano, mes, emissora, executivo): um bitset uint64 por valor;
+    - muitas opções (cliente): posições ordenadas por valor (CSR: offsets + posições).
+    A seleção faz OR dentro da dimensão e AND entre dimensões sobre os bitsets, sem comparar
+    strings, e devolve as posições das linhas selecionadas (para df.iloc / take).
+    """
+
+    def __init__(self, df, colunas=FILTER_COLUMNS):
+        self.linhas = len(df)
+        self.palavras = (self.linhas + 63) // 64
+        self.valores = {}   # coluna -> {valor: código}
+        self.bitmaps = {}   # coluna -> array (valores, palavras) uint64
+        self.csr = {}       # coluna -> (offsets, posições)
+        self.codigos = {}   # coluna -> código de cada linha (-1 = vazio), para as facetas
+        self._contagens_base = {}  # coluna -> contagens da base toda (ver facets)
+        # Faturamento por linha para as facetas (view da coluna, sem cópia quando já é int64/float64)
+        if "faturamento_centavos" in df.columns:
+            self.pesos, self.escala = df["faturamento_centavos"].to_numpy(), 100
+        elif "faturamento" in df.columns:
+            self.pesos, self.escala = df["faturamento"].fillna(0).to_numpy(dtype="float64"), 1
+        else:
+            self.pesos, self.escala = None, 1
+        for col in colunas:
+            if col not in df.columns:
+                continue
+            codigos, unicos = pd.factorize(df[col], sort=True)
+            self.valores[col] = {v: i for i, v in enumerate(pd.Index(np.asarray(unicos)).tolist())}
+            self.codigos[col] = codigos.astype(np.int8 if len(unicos) < 127 else
+                                               np.int16 if len(unicos) < 32767 else np.int32)
+            if len(unicos) <= MAX_VALORES_BITMAP:
+                self.bitmaps[col] = np.stack([_pack(codigos == i, self.palavras) for i in range(len(unicos))]) \
+                    if len(unicos) else np.zeros((0, self.palavras), dtype=np.uint64)
+            else:
+                validos = np.flatnonzero(codigos >= 0)
+                ordem = validos[np.argsort(codigos[validos], kind="stable")].astype(np.int32)
+                offsets = np.zeros(len(unicos) + 1, dtype=np.int64)
+                np.cumsum(np.bincount(codigos[validos], minlength=len(unicos)), out=offsets[1:])
+                self.csr[col] = (offsets, ordem)
+
+    def _codigos(self, col, selecionados):
+        """Códigos ordenados dos valores selecionados; None quando a seleção cobre a dimensão inteira."""
+        mapa = self.valores[col]
+        codigos = sorted({mapa[v] for v in selecionados if v in mapa})
+        return None if len(codigos) == len(mapa) else codigos
+
+    def _bits_da_dimensao(self, col, selecionados):
+        """OR dos bitsets dos valores selecionados; None quando a seleção cobre a dimensão inteira."""
+        codigos = self._codigos(col, selecionados)
+        if codigos is None:
+            return None
+        if col in self.bitmaps:
+            return np.bitwise_or.reduce(self.bitmaps[col][codigos], axis=0) if codigos \
+                else np.zeros(self.palavras, dtype=np.uint64)
+        offsets, ordem = self.csr[col]
+        mascara = np.zeros(self.palavras * 64, dtype=bool)
+        for c in codigos:
+            mascara[ordem[offsets[c]:offsets[c + 1]]] = True
+        return _pack(mascara, self.palavras)
+
+    def _bits_por_dimensao(self, selecao):
+        """{coluna: bitset da seleção}, só para as dimensões que de fato restringem linhas."""
+        bits = {}
+        for col, selecionados in selecao.items():
+            if selecionados is None or col not in self.valores:
+                continue
+            dim = self._bits_da_dimensao(col, selecionados)
+            if dim is not None:
+                bits[col] = dim
+        return bits
+
+    def _mascara(self, bitsets):
+        """AND dos bitsets -> máscara booleana por linha (None se não houver restrição)."""
+        if not bitsets:
+            return None
+        bits = bitsets[0]
+        for dim in bitsets[1:]:
+            bits = bits & dim
+        return np.unpackbits(bits.view(np.uint8), bitorder="little", count=self.linhas).view(bool)
+
+    def _posicoes(self, bitsets):
+        """AND dos bitsets -> posições das linhas (None se não houver restrição)."""
+        mascara = self._mascara(bitsets)
+        return None if mascara is None else np.flatnonzero(mascara)
+
+    def signature(self, selecao):
+        """
+        Assinatura canônica da seleção (mesmo formato de `select`): códigos ordenados por dimensão,
+        sem as dimensões que não restringem nada e sem valores inexistentes na base. Seleções
+        equivalentes (outra ordem, repetições, "todas" = sem filtro) têm a mesma assinatura.
+        """
+        partes = []
+        for col in sorted(selecao):
+            if selecao[col] is None or col not in self.valores:
+                continue
+            codigos = self._codigos(col, selecao[col])
+            if codigos is not None:
+                partes.append((col, tuple(codigos)))
+        return tuple(partes)
+
+    def select(self, selecao):
+        """
+        `selecao` = {coluna: valores aceitos}; coluna ausente ou valor None = sem restrição.
+        Valores que não existem na base são ignorados. Retorna as posições (int64, em ordem).
+        """
+        posicoes = self._posicoes(list(self._bits_por_dimensao(selecao).values()))
+        return np.arange(self.linhas, dtype=np.int64) if posicoes is None else posicoes
+
+    def _contar(self, col, posicoes):
+        """
+        (linhas, faturamento, pares) por código de `col` nas posições dadas (None = base toda).
+        Códigos deslocados em 1 (0 = vazio) para contar sem filtrar os -1 antes. `pares` conta
+        as linhas de cada (valor, cliente), para os clientes distintos; None para a própria coluna cliente.
+        """
+        n = len(self.valores[col]) + 1
+        codigos = (self.codigos[col] if posicoes is None else self.codigos[col][posicoes]).astype(np.int32) + 1
+        linhas = np.bincount(codigos, minlength=n)
+        if self.pesos is None:
+            faturamento = np.zeros(n)
+        else:
+            pesos = self.pesos if posicoes is None else self.pesos[posicoes]
+            faturamento = np.bincount(codigos, weights=pesos, minlength=n)
+        pares = None
+        clientes = self.codigos.get("cliente")
+        if col != "cliente" and clientes is not None:
+            n_clientes = len(self.valores["cliente"]) + 1
+            cli = (clientes if posicoes is None else clientes[posicoes]).astype(np.int32) + 1
+            pares = np.bincount(codigos * n_clientes + cli, minlength=n * n_clientes).reshape(n, n_clientes)
+        return linhas, faturamento, pares
+
+    def facets(self, selecao, colunas=None):
+        """
+        Contagens por opção de cada dimensão sob os demais filtros ativos (a própria dimensão
+        não se restringe, como em busca facetada): {coluna: DataFrame indexado pelo valor com
+        linhas, clientes distintos e faturamento em R$}. Só bincount sobre os códigos do
+        índice, uma passada por dimensão, sem varrer o DataFrame opção a opção.
+        As contagens da base toda ficam guardadas no índice; quando os demais filtros mantêm
+        mais da metade das linhas, conta-se o complemento e subtrai-se da base (tudo é aditivo).
+        """
+        bits = self._bits_por_dimensao(selecao)
+        saida = {}
+        for col in (colunas or list(self.valores)):
+            if col not in self._contagens_base:
+                self._contagens_base[col] = self._contar(col, None)
+            base = self._contagens_base[col]
+            mascara = self._mascara([b for c, b in bits.items() if c != col])
+            if mascara is None:
+                linhas, faturamento, pares = base
+            else:
+                posicoes = np.flatnonzero(mascara)
+                if 2 * len(posicoes) <= self.linhas:
+                    linhas, faturamento, pares = self._contar(col, posicoes)
+                else:
+                    fora = self._contar(col, np.flatnonzero(~mascara))
+                    linhas, faturamento = base[0] - fora[0], base[1] - fora[1]
+                    pares = None if base[2] is None else base[2] - fora[2]
+            distintos = (linhas > 0).astype(np.int64) if pares is None else (pares[:, 1:] > 0).sum(axis=1)
+            if col != "cliente" and "cliente" not in self.codigos:
+                distintos = np.zeros(len(linhas), dtype=np.int64)
+            saida[col] = pd.DataFrame({"linhas": linhas[1:], "clientes": distintos[1:],
+                                       "faturamento": faturamento[1:] / self.escala},
+                                      index=pd.Index(list(self.valores[col]), name=col))
+        return saida
+
+    def nbytes(self):
+        return (sum(b.nbytes for b in self.bitmaps.values())
+                + sum(o.nbytes + p.nbytes for o, p in self.csr.values())
+                + sum(c.nbytes for c in self.codigos.values()))
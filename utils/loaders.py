@@ -1,82 +1,625 @@
 # utils/loaders.py
 import os
+import time
+import zipfile
+import multiprocessing
+from contextlib import ExitStack
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from xml.etree import ElementTree
+import openpyxl
+import numpy as np
 import pandas as pd
+import pyarrow as pa
 import streamlit as st
-from datetime import datetime
-from .format import normalize_dataframe
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+from datetime import datetime, date
+from .format import normalize_dataframe, is_sales_header, project_columns, canonical_schema, compact_dataframe, build_filter_options, NORMALIZED_COLUMNS
+from .index import FilterIndex
+from .period import sort_by_period, register_offsets, PeriodOffsets
+from .cube import Cube, cube_of, register_cube, register_history
+from .cache import ingest_lock, file_fingerprint, current_fingerprint, load_cached_base, load_previous_base, save_cached_base, normalized_frames, filtered_frames
+from .store import get_store
 
-def load_main_base():
+def get_data_dir():
+    """Pasta /data do projeto (criada se não existir)."""
+    base_dir = os.path.dirname(os.path.dirname(__file__))
+    data_dir = os.path.join(base_dir, "data")
+    if not os.path.exists(data_dir):
+        os.makedirs(data_dir) # Cria a pasta se não existir
+    return data_dir
+
+def compute_ultima_atualizacao(df, file_path=None):
+    """Último mês/ano presente na base (MM/YYYY); na falta de data_ref, a data de modificação do arquivo."""
+    ultima_atualizacao = "N/A"
+    if "data_ref" in df.columns and pd.api.types.is_datetime64_any_dtype(df["data_ref"]):
+
+        # Pega a data mais recente válida
+        latest_date = df["data_ref"].max()
+
+        if pd.notna(latest_date):
+            latest_month = latest_date.month
+            latest_year = latest_date.year
+            # Formata como MM/YYYY (02d garante o zero à esquerda)
+            ultima_atualizacao = f"{latest_month:02d}/{latest_year}"
+        else:
+            ultima_atualizacao = "Data Inválida"
+
+    elif file_path:
+        # Fallback para o tempo de modificação do arquivo se data_ref não estiver disponível
+        mod_time = datetime.fromtimestamp(os.path.getmtime(file_path))
+        ultima_atualizacao = mod_time.strftime("%d/%m/%Y")
+    return ultima_atualizacao
+
+# Motor de leitura: calamine (Rust) quando instalado, openpyxl caso contrário
+try:
+    import python_calamine
+    EXCEL_ENGINE = "calamine"
+except ImportError:
+    python_calamine = None
+    EXCEL_ENGINE = "openpyxl"
+
+# Abaixo deste volume total (bytes a reler), o custo de subir processos supera o ganho do paralelismo
+PARALLEL_MIN_BYTES = 2 * 1024 * 1024
+
+# Arquivos a partir deste tamanho são lidos em streaming (blocos normalizados um a um)
+STREAMING_MIN_BYTES = 20 * 1024 * 1024
+STREAM_CHUNK_ROWS = 50_000
+
+# Colunas auxiliares gravadas no cache (chave da linha crua e aba de origem); não chegam às páginas
+INTERNAL_COLUMNS = ["_row_key", "_aba"]
+EMPTY_KEYS = np.array([], dtype=np.uint64)
+
+# Colunas que identificam uma linha de venda na deduplicação entre arquivos/abas
+DEDUP_COLUMNS = ["data_ref", "Emissora", "Cliente", "Executivo", "Faturamento", "Insercoes"]
+
+def list_sheet_names(file_path):
+    """Nomes das abas do .xlsx, lidos direto do workbook.xml (sem carregar a planilha)."""
+    with zipfile.ZipFile(file_path) as zf:
+        root = ElementTree.fromstring(zf.read("xl/workbook.xml"))
+    return [el.get("name") for el in root.iter() if el.tag.endswith("}sheet") or el.tag == "sheet"]
+
+def _make_header(values):
+    """Cabeçalho no mesmo formato do pd.read_excel: vazios viram 'Unnamed: i' e repetidos ganham '.1', '.2'..."""
+    header, vistos = [], {}
+    for i, v in enumerate(values):
+        nome = f"Unnamed: {i}" if v is None or (isinstance(v, str) and v.strip() == "") else v
+        if nome in vistos:
+            vistos[nome] += 1
+            nome = f"{nome}.{vistos[nome]}"
+        else:
+            vistos[nome] = 0
+        header.append(nome)
+    return header
+
+def _iter_rows_calamine(file_path, sheet_name):
+    if hasattr(file_path, "seek"):
+        file_path.seek(0)
+    wb = python_calamine.load_workbook(file_path)
+    try:
+        for row in wb.get_sheet_by_name(sheet_name).iter_rows():
+            # calamine devolve "" em células vazias; openpyxl/pandas usam None
+            yield tuple(None if v == "" else v for v in row)
+    finally:
+        wb.close()
+
+def _iter_rows_openpyxl(file_path, sheet_name):
+    if hasattr(file_path, "seek"):
+        file_path.seek(0)
+    wb = openpyxl.load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        yield from wb[sheet_name].iter_rows(values_only=True)
+    finally:
+        wb.close()
+
+def iter_sheet_chunks(file_path, sheet_name, chunk_rows=STREAM_CHUNK_ROWS, engine=None):
     """
-    Carrega a base principal.
-    Prioridade:
-    1. Procura em st.session_state (se o usuário fez upload).
-    2. Procura na pasta /data (arquivo .xlsx).
-    Retorna (df, data_modificação) ou (None, None) se nada for encontrado.
+    Percorre a aba e devolve DataFrames crus de até `chunk_rows` linhas, só com as colunas
+    reconhecidas em COLUMN_ALIASES (projeção feita pelo cabeçalho, antes de ler o resto).
+    O primeiro item produzido é o cabeçalho (lista), para permitir validar a aba antes de ler o resto.
+    engine: "calamine" ou "openpyxl"; None usa EXCEL_ENGINE. Se o calamine não conseguir abrir a
+    aba, a leitura volta ao openpyxl (como em read_excel_fast).
     """
-    
-    # --- 1. Verifica se o usuário já fez upload de um arquivo nesta sessão ---
-    if "uploaded_dataframe" in st.session_state and st.session_state.uploaded_dataframe is not None:
-        df = st.session_state.uploaded_dataframe
-        data_modificacao = st.session_state.get("uploaded_timestamp", "Sessão Atual")
-        return df, data_modificacao
+    linhas = None
+    if (engine or EXCEL_ENGINE) == "calamine":
+        linhas = _iter_rows_calamine(file_path, sheet_name)
+        try:
+            primeira = next(linhas, None)
+        except Exception as e:
+            linhas.close()
+            linhas = None
+            print(f"AVISO: calamine não conseguiu ler {os.path.basename(str(file_path))} / {sheet_name} ({e}); usando openpyxl.")
+    if linhas is None:
+        linhas = _iter_rows_openpyxl(file_path, sheet_name)
+        primeira = None
+    try:
+        if primeira is None:
+            primeira = next(linhas, None)
+        if primeira is None:
+            return
+        header_completo = _make_header(primeira)
+        posicoes = project_columns(header_completo)
+        header = [header_completo[i] for i in posicoes]
+        yield header
 
-    # --- 2. Se não houver, procura na pasta /data ---
-    base_dir = os.path.dirname(os.path.dirname(__file__)) 
-    data_dir = os.path.join(base_dir, "data")
+        largura = len(header_completo)
+        buffer = []
+        for row in linhas:
+            if len(row) < largura:
+                row = tuple(row) + (None,) * (largura - len(row))
+            row = tuple(row[i] for i in posicoes)
+            if all(v is None for v in row):
+                continue
+            buffer.append(row)
+            if len(buffer) >= chunk_rows:
+                yield pd.DataFrame(buffer, columns=header, dtype=object)
+                buffer = []
+        if buffer:
+            yield pd.DataFrame(buffer, columns=header, dtype=object)
+    finally:
+        linhas.close()
 
-    if not os.path.exists(data_dir):
-        os.makedirs(data_dir) # Cria a pasta se não existir
+def read_excel_fast(file_path, sheet_name, **kwargs):
+    """pd.read_excel pelo motor mais rápido disponível (calamine), com volta ao openpyxl se ele falhar."""
+    if EXCEL_ENGINE == "calamine":
+        try:
+            return pd.read_excel(file_path, sheet_name=sheet_name, engine="calamine", **kwargs)
+        except Exception as e:
+            print(f"AVISO: calamine não conseguiu ler {os.path.basename(str(file_path))} / {sheet_name} ({e}); usando openpyxl.")
+    return pd.read_excel(file_path, sheet_name=sheet_name, engine="openpyxl", **kwargs)
+
+def _stream_columns_as_text(df):
+    """Colunas fora do esquema padrão viram texto, para que todos os blocos tenham o mesmo esquema Arrow."""
+    for col in df.columns:
+        if col not in NORMALIZED_COLUMNS and df[col].dtype == object:
+            df[col] = df[col].where(df[col].isna(), df[col].astype(str))
+    return df
 
+def _sheet_salt(sheet_name, header):
+    """Semente do hash das linhas: a mesma linha em outra aba, ou sob outro cabeçalho, é outra linha."""
+    return pd.util.hash_array(np.array([repr((sheet_name, list(map(str, header))))], dtype=object))[0]
+
+def _canonical_cell(valor):
+    """
+    Forma única de uma célula crua, qualquer que seja o leitor: pd.read_excel (float64, NaN,
+    Timestamp), calamine ou openpyxl em blocos (object, None, int/float/datetime do Python).
+    Vazios viram None, números inteiros viram int (5.0 -> 5, True -> 1) e datas viram texto ISO
+    ao segundo; textos ficam como estão.
+    """
+    if valor is None or (not isinstance(valor, str) and pd.isna(valor)):
+        return None
+    if isinstance(valor, (bool, np.bool_, int, np.integer)):
+        return int(valor)
+    if isinstance(valor, (float, np.floating)):
+        return int(valor) if float(valor).is_integer() else float(valor)
+    if isinstance(valor, (datetime, date, np.datetime64)):
+        return pd.Timestamp(valor).round("s").isoformat()
+    return valor
+
+def _canonical_column(serie):
+    """Coluna crua na forma de _canonical_cell (object), convertida uma vez por valor distinto."""
+    codigos, unicos = pd.factorize(serie)
+    canonicos = np.empty(len(unicos) + 1, dtype=object)
+    canonicos[1:] = [_canonical_cell(v) for v in unicos]
+    return canonicos[codigos + 1]
+
+def row_keys(df_raw, salt, contagem=None):
+    """
+    Chave de cada linha crua: hash do conteúdo + número da ocorrência, para que linhas idênticas
+    dentro da aba recebam chaves distintas. `contagem` acumula as ocorrências entre blocos (streaming).
+    O conteúdo é levado antes à forma canônica (_canonical_cell): a mesma aba tem as mesmas
+    chaves lida inteira, em blocos ou no upload, pelo calamine ou pelo openpyxl.
+    Retorna (chaves uint64, contagem atualizada).
+    """
+    canonico = pd.DataFrame({i: _canonical_column(df_raw.iloc[:, i]) for i in range(df_raw.shape[1])},
+                            index=df_raw.index)
+    h = pd.util.hash_pandas_object(canonico, index=False).to_numpy() ^ salt
+    serie = pd.Series(h)
+    ocorrencia = serie.groupby(serie).cumcount().to_numpy().astype(np.uint64)
+    if contagem is not None:
+        if len(contagem):
+            ocorrencia += contagem.reindex(h, fill_value=0).to_numpy().astype(np.uint64)
+            contagem = contagem.add(serie.value_counts(), fill_value=0)
+        else:
+            contagem = serie.value_counts()
+    return h + ocorrencia * np.uint64(0x9E3779B97F4A7C15), contagem
+
+def _normalize_new_rows(df_raw, chaves, conhecidas):
+    """Normaliza só as linhas cujas chaves não estão no cache; as demais são reaproveitadas depois."""
+    novas = ~np.isin(chaves, conhecidas) if len(conhecidas) else np.ones(len(chaves), dtype=bool)
+    if not novas.any():
+        return pd.DataFrame()
+    delta = df_raw[novas].copy()
+    delta["_row_key"] = chaves[novas]
+    return normalize_dataframe(delta)
+
+def read_sheet_streaming(file_path, sheet_name, chunk_rows=STREAM_CHUNK_ROWS, conhecidas=EMPTY_KEYS, ao_ler_bloco=None):
+    """
+    Leitura com memória limitada: normaliza a aba em blocos de `chunk_rows` linhas e acumula
+    o resultado numa tabela Arrow. Só um bloco de objetos Python existe por vez.
+    Linhas com chave em `conhecidas` não são normalizadas (já estão no cache).
+    `ao_ler_bloco(linhas)` é chamado após cada bloco (progresso/cancelamento do upload).
+    Retorna (df_novas, chaves_da_aba, linhas_lidas); df vazio se a aba não tiver cabeçalho de vendas.
+    """
+    blocos = iter_sheet_chunks(file_path, sheet_name, chunk_rows)
+    header = next(blocos, None)
+    if header is None or not is_sales_header(header):
+        blocos.close()
+        return pd.DataFrame(), EMPTY_KEYS, 0
+
+    salt = _sheet_salt(sheet_name, header)
+    tabelas, chaves, contagem, linhas = [], [], pd.Series(dtype="float64"), 0
     try:
-        excel_files = [f for f in os.listdir(data_dir) if f.lower().endswith(".xlsx")]
+        for chunk in blocos:
+            linhas += len(chunk)
+            chaves_chunk, contagem = row_keys(chunk, salt, contagem)
+            chaves.append(chaves_chunk)
+            df_chunk = _normalize_new_rows(chunk, chaves_chunk, conhecidas)
+            if not df_chunk.empty:
+                tabelas.append(pa.Table.from_pandas(_stream_columns_as_text(df_chunk), preserve_index=False))
+            del chunk, df_chunk
+            if ao_ler_bloco is not None:
+                ao_ler_bloco(linhas)
+    finally:
+        blocos.close()
+
+    chaves = np.concatenate(chaves) if chaves else EMPTY_KEYS
+    if not tabelas:
+        return pd.DataFrame(), chaves, linhas
+    tabela = pa.concat_tables(tabelas, promote_options="permissive")
+    del tabelas
+    return tabela.to_pandas(), chaves, linhas
+
+def _parse_sheet(file_path, sheet_name, streaming=None, conhecidas=EMPTY_KEYS):
+    """
+    Lê uma aba e normaliza apenas as linhas novas (executado nos processos do pool).
+    Abas sem cabeçalho de vendas são ignoradas.
+    Retorna (df_novas, chaves_da_aba, linhas_lidas, segundos).
+    streaming=None escolhe automaticamente a leitura em blocos para arquivos grandes.
+    """
+    inicio = time.perf_counter()
+    if streaming is None:
+        streaming = os.path.getsize(file_path) >= STREAMING_MIN_BYTES
+
+    if streaming:
+        df, chaves, linhas = read_sheet_streaming(file_path, sheet_name, conhecidas=conhecidas)
+    else:
+        df, chaves, linhas = pd.DataFrame(), EMPTY_KEYS, 0
+        # Cabeçalho primeiro: só as colunas com alias conhecido são lidas por inteiro
+        header = read_excel_fast(file_path, sheet_name, nrows=0)
+        if is_sales_header(header.columns):
+            df_raw = read_excel_fast(file_path, sheet_name, usecols=project_columns(header.columns))
+            chaves, _ = row_keys(df_raw, _sheet_salt(sheet_name, df_raw.columns))
+            df = _normalize_new_rows(df_raw, chaves, conhecidas)
+            linhas = len(df_raw)
+
+    if not df.empty:
+        df["_aba"] = sheet_name
+    return df, chaves, linhas, time.perf_counter() - inicio
+
+def drop_cross_source_duplicates(frames):
+    """
+    Concatena bases de várias fontes (arquivos/abas) removendo linhas repetidas entre elas,
+    como um mês entregue em dois arquivos. Repetições dentro de uma mesma fonte são mantidas:
+    cada linha é identificada por (hash do conteúdo, ocorrência dentro da fonte).
+    """
+    frames = [f for f in frames if f is not None and not f.empty]
+    if not frames:
+        return pd.DataFrame()
+    if len(frames) == 1:
+        return frames[0]
+
+    chaves = []
+    for f in frames:
+        cols = [c for c in DEDUP_COLUMNS if c in f.columns]
+        h = pd.util.hash_pandas_object(f[cols], index=False)
+        chaves.append(pd.DataFrame({"h": h.to_numpy(), "n": h.groupby(h).cumcount().to_numpy()}))
+
+    df = pd.concat(frames, ignore_index=True)
+    manter = ~pd.concat(chaves, ignore_index=True).duplicated().to_numpy()
+    return df[manter].reset_index(drop=True)
+
+def diff_versions(removidas, adicionadas):
+    """
+    Diferença entre duas versões de um arquivo, em linhas normalizadas.
+    Uma linha removida e uma adicionada com a mesma identidade (data, emissora, cliente, executivo)
+    contam como uma linha alterada.
+    """
+    ident = ["data_ref", "Emissora", "Cliente", "Executivo"]
+    n_add, n_rem = len(adicionadas), len(removidas)
+    alteradas = 0
+    if n_add and n_rem and all(c in adicionadas.columns and c in removidas.columns for c in ident):
+        pares = pd.concat([adicionadas.groupby(ident).size(), removidas.groupby(ident).size()], axis=1)
+        alteradas = int(pares.fillna(0).min(axis=1).sum())
+    return {"adicionadas": n_add - alteradas, "removidas": n_rem - alteradas, "alteradas": alteradas}
+
+def _merge_file(anterior, resultados_abas):
+    """
+    Monta a base de um arquivo a partir do cache anterior (linhas mantidas) e das linhas novas de cada aba,
+    na ordem original da planilha. Retorna (df, diff).
+    """
+    chaves = np.concatenate([r[1] for r in resultados_abas]) if resultados_abas else EMPTY_KEYS
+    novas = [r[0] for r in resultados_abas if not r[0].empty]
+
+    if anterior is not None and not anterior.empty:
+        ainda_existe = anterior["_row_key"].isin(chaves).to_numpy()
+        mantidas, removidas = anterior[ainda_existe], anterior[~ainda_existe]
+    else:
+        mantidas, removidas = pd.DataFrame(), pd.DataFrame()
+
+    adicionadas = pd.concat(novas, ignore_index=True) if novas else pd.DataFrame()
+    diff = diff_versions(removidas, adicionadas)
+
+    partes = [p for p in (mantidas, adicionadas) if not p.empty]
+    if not partes:
+        return pd.DataFrame(), diff
+    df = pd.concat(partes, ignore_index=True)
+
+    # Reordena conforme a posição de cada chave na planilha atual
+    ordem_chaves = np.argsort(chaves, kind="stable")
+    posicao = ordem_chaves[np.searchsorted(chaves[ordem_chaves], df["_row_key"].to_numpy())]
+    df = df.iloc[np.argsort(posicao, kind="stable")]
+
+    # Deduplicação entre abas do mesmo arquivo
+    df = drop_cross_source_duplicates([g for _, g in df.groupby("_aba", sort=False)])
+    return df.reset_index(drop=True), diff
+
+def ingest_workbooks(file_paths):
+    """
+    Carrega e normaliza todos os .xlsx informados, todas as abas com cabeçalho de vendas.
+    Arquivos inalterados vêm da memória do processo (normalized_frames) ou do cache colunar.
+    Nos demais, cada aba é lida em paralelo
+    (ProcessPoolExecutor) e só as linhas que não estavam no cache anterior do arquivo
+    são normalizadas (atualização incremental, ex.: mês novo acrescentado à planilha).
+    Uma ingestão por pasta de cada vez (ingest_lock): watcher, sessões e upload não gravam o cache juntos.
+    Retorna (df, relatorio) com tempo, linhas e diff de versão por arquivo/aba.
+    """
+    with ExitStack() as travas:
+        for pasta in sorted({os.path.dirname(os.path.abspath(p)) for p in file_paths}):
+            travas.enter_context(ingest_lock(pasta))
+        return _ingest_workbooks(file_paths)
+
+def _ingest_workbooks(file_paths):
+    """Corpo de ingest_workbooks, já com as travas das pastas."""
+    relatorio = []
+    por_arquivo = {}
+    pendentes = {}
+
+    for path in file_paths:
+        inicio = time.perf_counter()
+        fingerprint = current_fingerprint(path)
+        df, origem = normalized_frames.get(normalized_frames.key(fingerprint)), "memória"
+        if df is None:
+            df, fingerprint = load_cached_base(path, fingerprint)
+            origem = "cache"
+            if df is not None:
+                normalized_frames.put(normalized_frames.key(fingerprint), df)
+        if df is not None:
+            por_arquivo[path] = df
+            relatorio.append({"arquivo": os.path.basename(path), "aba": "*", "linhas": len(df),
+                              "segundos": round(time.perf_counter() - inicio, 3), "origem": origem})
+        else:
+            pendentes[path] = (fingerprint, load_previous_base(path))
+
+    tarefas = [(path, aba) for path in pendentes for aba in list_sheet_names(path)]
+    conhecidas = {path: (anterior["_row_key"].to_numpy() if anterior is not None else EMPTY_KEYS)
+                  for path, (_, anterior) in pendentes.items()}
+    volume = sum(fp["size"] for fp, _ in pendentes.values())
+
+    resultados = {}
+    workers = min(len(tarefas), os.cpu_count() or 1)
+    if workers > 1 and volume >= PARALLEL_MIN_BYTES:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+            futuros = {pool.submit(_parse_sheet, path, aba, None, conhecidas[path]): (path, aba) for path, aba in tarefas}
+            for futuro in as_completed(futuros):
+                resultados[futuros[futuro]] = futuro.result()
+    else:
+        for path, aba in tarefas:
+            resultados[(path, aba)] = _parse_sheet(path, aba, None, conhecidas[path])
+
+    for path, (fingerprint, anterior) in pendentes.items():
+        abas = [(aba, resultados[(p, aba)]) for p, aba in tarefas if p == path]
+        for aba, (df_aba, _, linhas, segundos) in abas:
+            relatorio.append({"arquivo": os.path.basename(path), "aba": aba, "linhas": len(df_aba),
+                              "linhas_lidas": linhas, "segundos": round(segundos, 3),
+                              "origem": "incremental" if anterior is not None else "planilha"})
+
+        df, diff = _merge_file(anterior, [r for _, r in abas])
+        relatorio.append(dict({"arquivo": os.path.basename(path), "aba": "*", "linhas": len(df), "origem": "diff"}, **diff))
+        if not df.empty:
+            save_cached_base(path, df, fingerprint, diff)
+            normalized_frames.put(normalized_frames.key(fingerprint), df)
+        por_arquivo[path] = df
+
+    df = drop_cross_source_duplicates([por_arquivo[p] for p in file_paths])
+    df = df.drop(columns=[c for c in INTERNAL_COLUMNS if c in df.columns])
+    return df, relatorio
+
+# ==================== UPLOAD ====================
+# Blocos menores que os da leitura de /data: o progresso do upload é atualizado a cada bloco
+UPLOAD_CHUNK_ROWS = 2_000
+
+class IngestaoCancelada(Exception):
+    """Leitura do upload interrompida pelo usuário."""
+
+def validate_upload(buffer):
+    """
+    Confere o arquivo enviado antes da leitura completa: abre só a primeira linha de cada aba.
+    Retorna a lista de abas com cabeçalho de vendas (vazia se nenhuma servir).
+    """
+    abas = []
+    for aba in list_sheet_names(buffer):
+        # openpyxl lê só a primeira linha; o calamine carregaria a aba inteira para isso
+        blocos = iter_sheet_chunks(buffer, aba, 1, engine="openpyxl")
+        header = next(blocos, None)
+        blocos.close()
+        if header is not None and is_sales_header(header):
+            abas.append(aba)
+    return abas
+
+def ingest_upload(buffer, abas, destino, progresso=None, cancelado=None):
+    """
+    Lê e normaliza a planilha enviada direto da memória (BytesIO), em blocos.
+    `progresso(fração)` recebe o andamento; se o Event `cancelado` for acionado, levanta IngestaoCancelada.
+    Ao final grava o arquivo em `destino` (pasta /data) junto com o cache colunar,
+    para que o watcher e os próximos reinícios não reprocessem a planilha.
+    """
+    wb = openpyxl.load_workbook(buffer, read_only=True)
+    try:
+        total = sum(wb[aba].max_row or 0 for aba in abas)
+    finally:
+        wb.close()
+
+    lidas_anteriores = 0
+    def ao_ler_bloco(linhas_aba):
+        if cancelado is not None and cancelado.is_set():
+            raise IngestaoCancelada()
+        if progresso is not None and total:
+            progresso(min((lidas_anteriores + linhas_aba) / total, 1.0))
+
+    frames = []
+    for aba in abas:
+        df_aba, _, linhas = read_sheet_streaming(buffer, aba, UPLOAD_CHUNK_ROWS, ao_ler_bloco=ao_ler_bloco)
+        if not df_aba.empty:
+            df_aba["_aba"] = aba
+            frames.append(df_aba)
+        lidas_anteriores += linhas
+
+    df = drop_cross_source_duplicates(frames)
+    if df.empty:
+        return df
+
+    with ingest_lock(os.path.dirname(os.path.abspath(destino))):
+        tmp = destino + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(buffer.getbuffer())
+        os.replace(tmp, destino)
+        save_cached_base(destino, df, file_fingerprint(destino))
+    return df.drop(columns=[c for c in INTERNAL_COLUMNS if c in df.columns])
+
+def read_workbook(file_path):
+    """Lê e normaliza um único .xlsx (todas as abas), usando o cache colunar."""
+    df, _ = ingest_workbooks([file_path])
+    return df
+
+def _avisar(exibir, mensagem):
+    """
+    Aviso de load_data_dir: na página (exibir = st.error/st.warning) quando chamado numa execução
+    do Streamlit; no log quando chamado das threads de fundo (watcher, upload), que não têm página.
+    """
+    if get_script_run_ctx(suppress_warning=True) is None:
+        print(f"AVISO: {mensagem}")
+    else:
+        exibir(mensagem)
+
+def load_data_dir():
+    """
+    Procura a base na pasta /data: todos os arquivos .xlsx, todas as abas com dados de vendas.
+    Retorna (df, ultima_atualizacao, origem, meta) ou None se nada válido for encontrado.
+    """
+    data_dir = get_data_dir()
+
+    try:
+        excel_files = sorted(f for f in os.listdir(data_dir) if f.lower().endswith(".xlsx") and not f.startswith("~$"))
     except FileNotFoundError:
-        st.error(f"❌ Erro: O diretório '{data_dir}' não foi encontrado.")
+        _avisar(st.error, f"❌ Erro: O diretório '{data_dir}' não foi encontrado.")
+        return None
+
+    if not excel_files:
+        return None
+
+    file_paths = [os.path.join(data_dir, f) for f in excel_files]
+    try:
+        df, relatorio = ingest_workbooks(file_paths)
+        if df.empty:
+            _avisar(st.warning, "⚠️ Base encontrada, mas sem dados válidos.")
+            return None
+        mais_recente = max(file_paths, key=os.path.getmtime)
+        ultima = compute_ultima_atualizacao(df, mais_recente)
+        df, dimensoes = compact_dataframe(canonical_schema(df))
+        # Ordenada por (ano, mes): recortes de período viram fatias contíguas (utils/period.py)
+        df = sort_by_period(df)
+        return df, ultima, data_dir, {"ingestao": relatorio, "dimensoes": dimensoes, "filtros": build_filter_options(df),
+                                      "indice": FilterIndex(df), "periodos": register_offsets(df, PeriodOffsets(df)),
+                                      "cubo": register_cube(df, Cube.from_frame(df)),
+                                      "cache_memoria": normalized_frames.stats()}
+
+    except Exception as e:
+        _avisar(st.error, f"Erro ao ler bases em {data_dir}: {e}")
+        return None
+
+def publish_base(df, ultima_atualizacao, origem, meta=None):
+    """Publica uma nova versão da base para todas as sessões e aponta a sessão atual para ela."""
+    versao = get_store().publish(df, ultima_atualizacao, origem, meta)
+    st.session_state.base_version = versao.version_id
+    return versao
+
+def load_main_base():
+    """
+    Carrega a base principal.
+    A base normalizada fica num store único do processo (compartilhado entre sessões);
+    a sessão guarda apenas o identificador da versão em st.session_state.base_version.
+    Se o store ainda estiver vazio, procura na pasta /data (arquivo .xlsx).
+    Retorna (df, data_modificação) ou (None, None) se nada for encontrado.
+    """
+    versao = get_store().get_or_load(load_data_dir)
+    if versao is None:
         return None, None
 
-    if excel_files:
-        file_path = os.path.join(data_dir, excel_files[0]) # Pega o primeiro .xlsx que encontrar
-        try:
-            df_raw = pd.read_excel(file_path, engine="openpyxl")
-            df = normalize_dataframe(df_raw)
-            if df.empty:
-                st.warning("⚠️ Base encontrada, mas sem dados válidos.")
-                return None, None
-
-            # --- NOVA LÓGICA: PEGAR ÚLTIMO MÊS/ANO DA BASE ---
-            ultima_atualizacao = "N/A" 
-            if "data_ref" in df.columns and pd.api.types.is_datetime64_any_dtype(df["data_ref"]):
-                
-                # Pega a data mais recente válida
-                latest_date = df["data_ref"].max()
-                
-                if pd.notna(latest_date):
-                    latest_month = latest_date.month
-                    latest_year = latest_date.year
-                    # Formata como MM/YYYY (02d garante o zero à esquerda)
-                    ultima_atualizacao = f"{latest_month:02d}/{latest_year}"
-                else:
-                    ultima_atualizacao = "Data Inválida"
-
-            else:
-                # Fallback para o tempo de modificação do arquivo se data_ref não estiver disponível
-                mod_time = datetime.fromtimestamp(os.path.getmtime(file_path))
-                ultima_atualizacao = mod_time.strftime("%d/%m/%Y")
-            # --- FIM DA NOVA LÓGICA ---
-
-            # Salva no cache da sessão para não precisar ler do disco toda hora
-            st.session_state.uploaded_dataframe = df
-            st.session_state.uploaded_timestamp = ultima_atualizacao
-            
-            return df, ultima_atualizacao
-        
-        except Exception as e:
-            st.error(f"Erro ao ler base {file_path}: {e}")
-            return None, None
+    st.session_state.base_version = versao.version_id
+    return versao.df, versao.ultima_atualizacao
 
-    # --- 3. Se não encontrou em nenhum lugar ---
-    return None, None
+
+def _published_version(df):
+    """Versão da base em uso pela sessão, se `df` for exatamente a base publicada nela."""
+    versao = get_store().get(st.session_state.get("base_version"))
+    return versao if versao is not None and versao.df is df else None
+
+def _version_meta(df, chave, calcular):
+    """
+    meta[chave] da versão da base em uso pela sessão (pré-calculado em load_data_dir).
+    Se `df` não for a base publicada dessa versão, calcula na hora com calcular(df).
+    """
+    versao = _published_version(df)
+    if versao is not None and chave in versao.meta:
+        return versao.meta[chave]
+    return calcular(df)
+
+def base_filter_options(df):
+    """Opções dos filtros globais (listas e contagens por opção) da base em uso."""
+    return _version_meta(df, "filtros", build_filter_options)
+
+def base_filter_index(df):
+    """Índice invertido (utils/index.FilterIndex) da base em uso."""
+    return _version_meta(df, "indice", FilterIndex)
+
+def filter_base(df, selecao):
+    """
+    Linhas da base em uso que atendem à seleção dos filtros globais (formato de FilterIndex.select).
+    O recorte fica no LRU do processo (filtered_frames), chaveado pela versão publicada e pela
+    assinatura canônica da seleção: trocar de página, ou outra sessão com os mesmos filtros,
+    reaproveita o recorte sem refiltrar. Sem restrição alguma, devolve a própria base.
+    """
+    indice = base_filter_index(df)
+    assinatura = indice.signature(selecao)
+    if not assinatura:
+        return df
+    versao = _published_version(df)
+    chave = None if versao is None else filtered_frames.key(versao.version_id, assinatura)
+    if chave is not None:
+        df_filtrado = filtered_frames.get(chave)
+        if df_filtrado is not None:
+            return df_filtrado
+    df_filtrado = df.iloc[indice.select(selecao)]
+    # O cubo do recorte sai do cubo da base pela mesma seleção (as dimensões dos filtros são as do cubo)
+    register_cube(df_filtrado, cube_of(df).filter(selecao))
+    # Histórico do recorte (ciclo de vida): a mesma seleção sem o período, montado sob demanda (history_of)
+    sem_periodo = {col: valores for col, valores in selecao.items() if col not in ("ano", "mes")}
+    register_history(df_filtrado, cube_of(df), sem_periodo, indice.signature(sem_periodo))
+    if chave is not None:
+        filtered_frames.put(chave, df_filtrado)
+    return df_filtrado
 
 
 def load_crowley_base():
     """Placeholder para base Crowley (não usada atualmente)."""
-    return None, None
\ No newline at end of file
+    return None, None
@@ -0,0 +1,128 @@
+# utils/period.py
+import numpy as np
+from .cache import attach_to_frame, frame_attachment
+
+# ==================== LAYOUT FÍSICO POR PERÍODO ====================
+# A base publicada fica ordenada por (ano, mes) (sort_by_period, em load_data_dir). Os recortes
+# dos filtros globais (df.iloc com posições crescentes) preservam essa ordem, então cada ano,
+# e cada intervalo de meses dentro de um ano, ocupa um bloco contíguo de linhas: o recorte
+# por período é uma fatia iloc[a:b] (view, sem máscara booleana nem cópia das colunas).
+
+def _chaves(df):
+    """Chave ordenável do período de cada linha: ano * 100 + mes."""
+    return df["ano"].to_numpy(dtype=np.int64) * 100 + df["mes"].to_numpy(dtype=np.int64)
+
+def sort_by_period(df):
+    """Ordena a base por (ano, mes), estável (mantém a ordem original dentro do mês), com índice 0..n-1."""
+    chaves = _chaves(df)
+    if len(chaves) < 2 or (chaves[1:] >= chaves[:-1]).all():
+        return df.reset_index(drop=True)
+    return df.iloc[np.argsort(chaves, kind="stable")].reset_index(drop=True)
+
+class PeriodOffsets:
+    """
+    Tabela de limites de um DataFrame ordenado por (ano, mes): para cada período presente,
+    a linha onde ele começa. Localizar um ano ou intervalo de meses é um searchsorted nessa
+    tabela (tamanho = nº de meses distintos), não uma comparação linha a linha.
+    """
+
+    def __init__(self, df):
+        chaves = _chaves(df)
+        self.linhas = len(chaves)
+        self.ordenado = bool(len(chaves) < 2 or (chaves[1:] >= chaves[:-1]).all())
+        if self.ordenado:
+            inicios = np.flatnonzero(np.r_[True, chaves[1:] != chaves[:-1]]) if len(chaves) else np.zeros(0, dtype=np.int64)
+            self.periodos = chaves[inicios]                 # chaves distintas, em ordem
+            self.offsets = np.r_[inicios, self.linhas]      # início de cada período + fim da tabela
+            self.anos = np.unique(self.periodos // 100)
+
+    def bounds(self, ano, mes_ini=1, mes_fim=12):
+        """(início, fim) das linhas do ano entre mes_ini e mes_fim (fim exclusivo)."""
+        a = np.searchsorted(self.periodos, ano * 100 + mes_ini, side="left")
+        b = np.searchsorted(self.periodos, ano * 100 + mes_fim, side="right")
+        return int(self.offsets[a]), int(self.offsets[b])
+
+    def ranges(self, mes_ini=1, mes_fim=12, anos=None):
+        """Blocos (início, fim) do intervalo de meses em cada ano, já unidos quando encostam."""
+        blocos = []
+        for ano in (self.anos if anos is None else anos):
+            a, b = self.bounds(int(ano), mes_ini, mes_fim)
+            if a == b:
+                continue
+            if blocos and blocos[-1][1] == a:
+                blocos[-1] = (blocos[-1][0], b)
+            else:
+                blocos.append((a, b))
+        return blocos
+
+def register_offsets(df, tabela):
+    """Associa uma tabela já calculada (ex.: meta["periodos"] da base publicada) ao DataFrame."""
+    return attach_to_frame(df, "periodos", tabela)
+
+def period_offsets(df):
+    """Tabela de limites do DataFrame (calculada na primeira vez e reaproveitada enquanto ele existir)."""
+    tabela = frame_attachment(df, "periodos")
+    return tabela if tabela is not None else register_offsets(df, PeriodOffsets(df))
+
+def period_slice(df, mes_ini=1, mes_fim=12, ano=None):
+    """
+    Linhas de `df` com mes entre mes_ini e mes_fim (e do ano dado, se houver).
+    Com a base ordenada por período, um ano é sempre uma fatia contígua (view); o intervalo em
+    vários anos é o próprio df quando cobre tudo, uma fatia quando os blocos encostam e, senão,
+    um único take das posições. DataFrames fora de ordem caem nas máscaras booleanas.
+    """
+    tabela = period_offsets(df)
+    if not tabela.ordenado:
+        mascara = df["mes"].between(mes_ini, mes_fim)
+        if ano is not None:
+            mascara &= df["ano"] == ano
+        return df[mascara]
+    blocos = tabela.ranges(mes_ini, mes_fim, None if ano is None else [ano])
+    if not blocos:
+        return df.iloc[0:0]
+    if len(blocos) == 1:
+        a, b = blocos[0]
+        return df if (a, b) == (0, tabela.linhas) else df.iloc[a:b]
+    return df.iloc[np.concatenate([np.arange(a, b) for a, b in blocos])]
+
+def month_range_slice(df, inicio, fim):
+    """
+    Linhas de `df` entre os meses `inicio` e `fim` = (ano, mes), inclusive, atravessando anos.
+    Com a base ordenada por período, um intervalo contíguo de meses é sempre uma única fatia.
+    """
+    de, ate = int(inicio[0]) * 100 + int(inicio[1]), int(fim[0]) * 100 + int(fim[1])
+    tabela = period_offsets(df)
+    if not tabela.ordenado:
+        chaves = _chaves(df)
+        return df[(chaves >= de) & (chaves <= ate)]
+    a = np.searchsorted(tabela.periodos, de, side="left")
+    b = np.searchsorted(tabela.periodos, ate, side="right")
+    return df.iloc[int(tabela.offsets[a]):int(tabela.offsets[b])]
+
+# ==================== JANELAS MÓVEIS ====================
+# Janelas de meses consecutivos que podem atravessar anos (últimos N meses, YTD), sempre
+# comparadas à mesma janela 12 meses antes. Meses são pares (ano, mes).
+
+MESES_ABREV = {1: "Jan", 2: "Fev", 3: "Mar", 4: "Abr", 5: "Mai", 6: "Jun",
+               7: "Jul", 8: "Ago", 9: "Set", 10: "Out", 11: "Nov", 12: "Dez"}
+
+def shift_month(ano, mes, meses):
+    """(ano, mes) deslocado de `meses` meses (negativo = para trás)."""
+    ano, mes = divmod(int(ano) * 12 + int(mes) - 1 + meses, 12)
+    return ano, mes + 1
+
+def month_label(ano, mes):
+    """Rótulo curto do mês: "Mar/25"."""
+    return f"{MESES_ABREV[mes]}/{str(ano)[-2:]}"
+
+def rolling_windows(tamanho, referencia):
+    """
+    Janela que termina no mês de referência e a mesma janela um ano antes:
+    {rótulo: (início, fim)}, a anterior primeiro. `tamanho` = nº de meses ou "ytd" (janeiro até a referência).
+    """
+    inicio = (referencia[0], 1) if tamanho == "ytd" else shift_month(*referencia, -(tamanho - 1))
+    janelas = {}
+    for ini, fim in [(shift_month(*inicio, -12), shift_month(*referencia, -12)), (inicio, referencia)]:
+        rotulo = month_label(*fim) if ini == fim else f"{month_label(*ini)}–{month_label(*fim)}"
+        janelas[rotulo] = (ini, fim)
+    return janelas
@@ -0,0 +1,76 @@
+# utils/store.py
+import threading
+from datetime import datetime
+import streamlit as st
+from .cache import filtered_frames
+
+# Quantas versões da base ficam em memória ao mesmo tempo
+# (a atual + a anterior, que ainda pode estar em uso por uma execução em andamento).
+MAX_VERSOES = 2
+
+class BaseVersion:
+    """
+    Snapshot somente-leitura da base publicada.
+    Todas as sessões que apontam para a mesma versão compartilham o mesmo DataFrame:
+    ninguém deve alterar `df` no lugar (filtros e páginas trabalham sobre cópias/fatias).
+    """
+    def __init__(self, version_id, df, ultima_atualizacao, origem, meta=None):
+        self.version_id = version_id
+        self.df = df
+        self.ultima_atualizacao = ultima_atualizacao
+        self.origem = origem
+        self.meta = meta or {}
+        self.publicada_em = datetime.now()
+
+class SharedBaseStore:
+    """Base única por processo, versionada. A publicação troca a versão atual de forma atômica."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._versoes = {}
+        self._atual = None
+        self._seq = 0
+
+    def publish(self, df, ultima_atualizacao, origem, meta=None):
+        """Publica uma nova versão e a torna a atual. Retorna a BaseVersion criada."""
+        with self._lock:
+            self._seq += 1
+            versao = BaseVersion(self._seq, df, ultima_atualizacao, origem, meta)
+            self._versoes[versao.version_id] = versao
+            self._atual = versao
+
+            # Versões antigas saem do store; execuções em andamento mantêm sua própria referência
+            while len(self._versoes) > MAX_VERSOES:
+                del self._versoes[min(self._versoes)]
+            mais_antiga = min(self._versoes)
+        # ... e os recortes filtrados delas saem do cache compartilhado
+        filtered_frames.drop_versions_before(mais_antiga)
+        return versao
+
+    def current(self):
+        return self._atual
+
+    def get(self, version_id):
+        return self._versoes.get(version_id)
+
+    def get_or_load(self, loader):
+        """
+        Retorna a versão atual; se ainda não houver, executa `loader()` uma única vez
+        (as demais sessões esperam no lock em vez de reler a planilha em paralelo).
+        `loader` deve retornar (df, ultima_atualizacao, origem[, meta]) ou None.
+        """
+        if self._atual is not None:
+            return self._atual
+        with self._load_lock:
+            if self._atual is not None:
+                return self._atual
+            resultado = loader()
+            if resultado is None:
+                return None
+            return self.publish(*resultado)
+
+@st.cache_resource
+def get_store():
+    """Store compartilhado entre todas as sessões do processo."""
+    return SharedBaseStore()
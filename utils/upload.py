@@ -0,0 +1,58 @@
+# utils/upload.py
+import threading
+from .loaders import ingest_upload, load_data_dir, IngestaoCancelada
+from .watcher import ignore_own_write
+
+class UploadJob:
+    """
+    Processa uma planilha enviada pelo usuário numa thread separada, para que a sessão
+    continue respondendo (barra de progresso, botão de cancelar) durante a leitura.
+    O resultado (df, ultima_atualizacao, origem, meta) é publicado pela própria sessão ao final.
+    """
+
+    def __init__(self, buffer, abas, destino, arquivo_id=None):
+        self.buffer = buffer
+        self.abas = abas
+        self.destino = destino
+        self.arquivo_id = arquivo_id
+        self.status = "executando"  # executando | concluido | cancelado | erro
+        self.progresso = 0.0
+        self.resultado = None
+        self.erro = None
+        self._cancelado = threading.Event()
+        self._thread = threading.Thread(target=self._executar, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def cancelar(self):
+        self._cancelado.set()
+
+    def _atualizar(self, fracao):
+        self.progresso = fracao
+
+    def _executar(self):
+        try:
+            df = ingest_upload(self.buffer, self.abas, self.destino, self._atualizar, self._cancelado)
+            # A base é publicada pela sessão ao final: a gravação não deve disparar o watcher também
+            ignore_own_write(self.destino)
+            if df.empty:
+                self.erro = "Arquivo lido, mas sem dados válidos."
+                self.status = "erro"
+                return
+            # Relê /data pelo cache (a planilha enviada acabou de ser gravada lá) para publicar a base completa
+            self.resultado = load_data_dir()
+            if self.resultado is None:
+                self.erro = "Arquivo lido, mas sem dados válidos."
+                self.status = "erro"
+                return
+            self.progresso = 1.0
+            self.status = "concluido"
+        except IngestaoCancelada:
+            self.status = "cancelado"
+        except Exception as e:
+            self.erro = str(e)
+            self.status = "erro"
+        finally:
+            self.buffer = None
@@ -0,0 +1,144 @@
+# utils/watcher.py
+import os
+import threading
+import time
+import streamlit as st
+
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+except ImportError:  # watchdog é opcional: sem ele, a base só é relida ao reiniciar o app
+    Observer = None
+    FileSystemEventHandler = object
+
+from .cache import CACHE_DIRNAME
+from .loaders import get_data_dir, load_data_dir
+from .store import get_store
+
+# Espera (s) após o último evento antes de reprocessar: o Excel/cópias de rede
+# gravam o arquivo em várias etapas e não queremos ler uma planilha pela metade.
+DEBOUNCE_SEGUNDOS = 3.0
+
+# Planilhas gravadas pelo próprio app (upload), que já publica a base por conta própria: enquanto
+# o arquivo for o mesmo que o app gravou, os eventos dele não disparam outra recarga
+_gravados_pelo_app = {}   # caminho -> (tamanho, mtime_ns) após a gravação
+_gravados_lock = threading.Lock()
+
+def _assinatura(path):
+    try:
+        info = os.stat(path)
+    except OSError:
+        return None
+    return info.st_size, info.st_mtime_ns
+
+def ignore_own_write(path):
+    """Marca `path` como gravado pelo app: o watcher não recarrega /data por causa desta gravação."""
+    with _gravados_lock:
+        _gravados_pelo_app[os.path.abspath(path)] = _assinatura(path)
+
+def _gravado_pelo_app(path):
+    with _gravados_lock:
+        registro = _gravados_pelo_app.get(os.path.abspath(path))
+    return registro is not None and registro == _assinatura(path)
+
+def _is_workbook(path):
+    nome = os.path.basename(path)
+    return (nome.lower().endswith(".xlsx") and not nome.startswith("~$")
+            and CACHE_DIRNAME not in path.split(os.sep))
+
+class _DataDirHandler(FileSystemEventHandler):
+    def __init__(self, watcher):
+        self.watcher = watcher
+
+    def on_any_event(self, event):
+        if event.is_directory:
+            return
+        caminhos = [p for p in (event.src_path, getattr(event, "dest_path", "") or "") if p and _is_workbook(p)]
+        if caminhos:
+            self.watcher.agendar(caminhos)
+
+class DataDirWatcher:
+    """
+    Observa a pasta /data e, quando uma planilha é criada, alterada, renomeada ou removida,
+    reconstrói a base numa thread própria (fora das execuções dos usuários) e publica a nova
+    versão no store compartilhado. A troca é atômica: execuções em andamento continuam com
+    o DataFrame que já tinham em mãos.
+    """
+
+    def __init__(self, data_dir, store):
+        self.data_dir = data_dir
+        self.store = store
+        self._lock = threading.Lock()
+        self._timer = None
+        self._rebuild_lock = threading.Lock()
+        self._pendente = False
+        self._alterados = set()   # planilhas com eventos desde a última reconstrução
+        self._observer = None
+        self.ultima_recarga = None
+        self.ultimo_erro = None
+
+    def start(self):
+        if Observer is None:
+            print("AVISO: watchdog não instalado; novas planilhas em /data só serão lidas ao reiniciar o app.")
+            return self
+        if not os.path.isdir(self.data_dir):
+            print(f"AVISO: pasta {self.data_dir} não encontrada; observação de arquivos desativada.")
+            return self
+        self._observer = Observer()
+        self._observer.schedule(_DataDirHandler(self), self.data_dir, recursive=False)
+        self._observer.daemon = True
+        self._observer.start()
+        return self
+
+    def stop(self):
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+        if self._observer is not None:
+            self._observer.stop()
+
+    def agendar(self, caminhos=()):
+        """Reinicia o debounce; a reconstrução só roda depois de DEBOUNCE_SEGUNDOS sem eventos."""
+        with self._lock:
+            self._alterados.update(caminhos)
+            if self._timer is not None:
+                self._timer.cancel()
+            self._timer = threading.Timer(DEBOUNCE_SEGUNDOS, self._reconstruir)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _reconstruir(self):
+        # Uma reconstrução por vez; eventos que chegarem no meio disparam mais uma rodada ao final
+        if not self._rebuild_lock.acquire(blocking=False):
+            self._pendente = True
+            return
+        try:
+            while True:
+                self._pendente = False
+                with self._lock:
+                    alterados, self._alterados = self._alterados, set()
+                if alterados and all(_gravado_pelo_app(p) for p in alterados):
+                    # Só a planilha que o upload acabou de gravar e publicar: nada a recarregar
+                    if not self._pendente:
+                        break
+                    continue
+                try:
+                    resultado = load_data_dir()
+                    if resultado is not None:
+                        self.store.publish(*resultado)
+                    self.ultima_recarga = time.time()
+                    self.ultimo_erro = None
+                except Exception as e:
+                    self.ultimo_erro = str(e)
+                    print(f"AVISO: falha ao recarregar /data: {e}")
+                if not self._pendente:
+                    break
+        finally:
+            self._rebuild_lock.release()
+        if self._pendente:
+            self.agendar()
+
+@st.cache_resource
+def start_data_watcher():
+    """Inicia (uma única vez por processo) o observador da pasta /data."""
+    return DataDirWatcher(get_data_dir(), get_store()).start()
@@ -0,0 +1,87 @@
+# utils/yoy.py
+import numpy as np
+import pandas as pd
+from .cube import PrefixSums
+
+# ==================== COMPARATIVO ANO A ANO ====================
+# Tabelas "dimensão x ano" com Δ e Δ% para um par de anos escolhido (base, comparação).
+# O pivô de todos os anos sai de uma única agregação do cubo (utils/cube.py) e fica guardado
+# nele, então trocar o par de anos ou a medida não reagrupa nada. No modo de janela móvel, as
+# colunas de emissora, executivo e cliente saem das somas acumuladas do cubo (PrefixSums): mover
+# a janela é uma subtração por coluna, sem reagrupar células. Clientes distintos vêm dos
+# bitsets de clientes por (valor, mês) do cubo (ClientSets), não de nunique nas células.
+
+# Medidas aditivas de cada pivô anual; "linhas" marca a presença de cada valor em cada ano (ou janela)
+MEDIDAS_ANUAIS = ["faturamento", "insercoes", "linhas"]
+
+def column_periods(anos, mes_ini=1, mes_fim=12, janelas=None):
+    """{coluna: [(início, fim)]} dos meses de cada coluna do pivô: cada ano em mes_ini..mes_fim, ou cada janela."""
+    if janelas is not None:
+        return {rotulo: [janela] for rotulo, janela in janelas.items()}
+    return {ano: [((int(ano), mes_ini), (int(ano), mes_fim))] for ano in anos}
+
+def distinct_clients(cubo, dim, periodos):
+    """Clientes distintos por valor de `dim` em cada coluna ({coluna: [(início, fim)]}): DataFrame valores x colunas."""
+    conjuntos = cubo.client_sets(dim)
+    return pd.DataFrame({coluna: conjuntos.counts(intervalos) for coluna, intervalos in periodos.items()},
+                        index=conjuntos.valores)
+
+def window_pivot(cubo, dim, janelas):
+    """
+    Medidas por valor de `dim` (emissora, executivo ou cliente) x (medida, janela), pelas somas
+    acumuladas do cubo (PrefixSums.totals): mesmo formato do pivô de Cube.windows agrupado, só
+    com os valores presentes em ao menos uma janela.
+    """
+    prefixos = cubo.prefix_sums()
+    colunas = pd.MultiIndex.from_product(
+        [MEDIDAS_ANUAIS, pd.CategoricalIndex(list(janelas), categories=list(janelas))], names=[None, "ano"])
+    pivo = pd.concat([prefixos.totals(dim, inicio, fim, medida)
+                      for medida in MEDIDAS_ANUAIS for inicio, fim in janelas.values()], axis=1)
+    pivo.columns = colunas
+    return pivo[(pivo["linhas"] > 0).any(axis=1)]
+
+def yearly_pivot(cubo, dim, mes_ini=1, mes_fim=12, janelas=None):
+    """
+    Medidas por valor de `dim` (linhas) x (medida, ano) (colunas), de todos os anos de uma vez,
+    nos meses mes_ini..mes_fim. Com `janelas` ({rótulo: (início, fim)}, ver Cube.windows),
+    as colunas são as janelas no lugar dos anos (somas acumuladas, ver window_pivot, para as
+    dimensões de PrefixSums). Calculado uma vez por cubo e período.
+    """
+    if janelas is None:
+        chave = ("anual", dim, mes_ini, mes_fim)
+        medidas = lambda: cubo.slice(mes_ini, mes_fim).group([dim, "ano"], MEDIDAS_ANUAIS).unstack(fill_value=0)
+    else:
+        chave = ("janelas", dim, tuple(janelas.items()))
+        medidas = (lambda: window_pivot(cubo, dim, janelas)) if dim in PrefixSums.DIMENSOES \
+            else lambda: cubo.windows(janelas).group([dim, "ano"], MEDIDAS_ANUAIS).unstack(fill_value=0)
+
+    def calcular():
+        pivo = medidas()
+        if dim == "cliente":
+            clientes = (pivo["linhas"] > 0).astype(np.int64)
+        else:
+            periodos = column_periods(pivo["linhas"].columns, mes_ini, mes_fim, janelas)
+            clientes = distinct_clients(cubo, dim, periodos).reindex(index=pivo.index, columns=pivo["linhas"].columns,
+                                                                   fill_value=0)
+        clientes.columns = pd.MultiIndex.from_product([["clientes"], pivo["linhas"].columns],
+                                                      names=pivo.columns.names)
+        return pd.concat([pivo, clientes], axis=1)
+
+    return cubo.cached(chave, calcular)
+
+def compare_years(pivo, ano_base, ano_comp, medida="faturamento"):
+    """
+    Comparativo de uma medida do pivô anual: colunas ano_base, ano_comp (zeros quando o ano não
+    tem dados), "Δ" (comp - base) e "Δ%" (NaN quando a base é zero), indexado pela dimensão.
+    Entram todos os valores do pivô (presentes em algum ano do recorte), com zeros nos dois anos
+    quando o valor não aparece em nenhum deles, como nas tabelas das páginas.
+    """
+    def coluna(nome, ano):
+        return pivo[(nome, ano)] if (nome, ano) in pivo.columns else pd.Series(0, index=pivo.index)
+
+    base = coluna(medida, ano_base)
+    comp = coluna(medida, ano_comp)
+    tabela = pd.DataFrame({ano_base: base, ano_comp: comp}, index=base.index)
+    tabela["Δ"] = comp - base
+    tabela["Δ%"] = np.where(base > 0, tabela["Δ"] / base.where(base != 0) * 100, np.nan)
+    return tabela